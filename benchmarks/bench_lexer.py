@@ -0,0 +1,47 @@
+# Benchmark of the lexical analysis of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Times the lexer on machine-generated expressions of increasing length; the time per token should not depend on the length.
+# Usage: python benchmarks/bench_lexer.py [terms...]
+
+import random
+import sys
+
+from common import best
+from maexpa import tokens
+
+def generate( terms, seed = 0 ):
+	rng = random.Random( seed )
+
+	parts = []
+	for i in range( terms ):
+		parts.append( rng.choice( [ "x{:d}".format( i ), "{:d}".format( i ), "{:d}.{:d}e-3".format( i, i ), "sqrt(y{:d})".format( i ), "max(a, b{:d})".format( i ) ] ) )
+		parts.append( rng.choice( [ "+", "-", "*", "/", "**", "//" ] ) )
+	parts.append( "1" )
+
+	return " ".join( parts )
+
+def main( argv ):
+	sizes = [ int( float( arg ) ) for arg in argv[ 1: ] ] or [ 100, 1000, 10000, 100000 ]
+
+	for terms in sizes:
+		formula = generate( terms )
+		count = len( tokens.lexer( formula ) )
+		value = best( lambda: tokens.lexer( formula ) )
+		print( "{:8d} terms {:9d} tokens {:10.2f} ms {:8.0f} ns/token".format( terms, count, value * 1e3, value / count * 1e9 ) )
+
+if __name__ == "__main__":
+	main( sys.argv )
@@ -0,0 +1,55 @@
+# Benchmark of the memory used by compiled expressions in MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the memory taken by many compiled expressions, including their tokens and trees but not their text.
+# Usage: python benchmarks/bench_memory.py [count]
+
+import gc
+import random
+import sys
+import tracemalloc
+
+import common
+import maexpa
+
+def generate( count, seed = 0 ):
+	rng = random.Random( seed )
+
+	texts = []
+	for i in range( count ):
+		terms = [ rng.choice( [ "x{:d}".format( i % 50 ), "{:d}".format( i ), "{:d}.5".format( i ), "sqrt(y)", "max(a, b)", "exp(-c*t)" ] ) for j in range( 8 ) ]
+		texts.append( "+".join( "{:s}*{:s}".format( terms[ j ], terms[ j + 1 ] ) for j in range( 0, 8, 2 ) ) )
+
+	return texts
+
+def main( argv ):
+	count = int( float( argv[ 1 ] ) ) if len( argv ) > 1 else 10000
+
+	maexpa.lib( "std" )
+	texts = generate( count )
+
+	gc.collect()
+	tracemalloc.start()
+	exprs = [ maexpa.Expression( text ) for text in texts ]
+	gc.collect()
+	size, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	tokens = sum( len( expr.tokens ) for expr in exprs ) / count
+	print( "{:d} expressions, {:.1f} tokens each: {:.0f} bytes per expression".format( count, tokens, size / count ) )
+
+if __name__ == "__main__":
+	main( sys.argv )
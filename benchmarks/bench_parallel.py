@@ -0,0 +1,70 @@
+# Benchmark of the multi-process evaluation of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the evaluation of expressions over large arrays in a single process and split between several worker processes.
+# The inputs and the result are either plain arrays, which are copied to and from shared memory, or arrays allocated in shared memory by the pool.
+# Usage: python benchmarks/bench_parallel.py [size [workers...]]
+
+import os
+import sys
+
+import numpy
+
+from common import best
+import maexpa
+import maexpa.parallel
+
+def main( argv ):
+	size = int( float( argv[ 1 ] ) ) if len( argv ) > 1 else 10000000
+	workers = [ int( arg ) for arg in argv[ 2: ] ] or sorted( { 2, 4, os.cpu_count() or 1 } )
+
+	maexpa.lib( "numpy" )
+
+	rng = numpy.random.default_rng( 0 )
+	arrays = { name: rng.random( size ) for name in "abcde" }
+	out = numpy.empty( size )
+
+	print( "{:d} elements, {:d} cores".format( size, os.cpu_count() or 1 ) )
+
+	pools = [ maexpa.parallel.ProcessPool( count ) for count in workers ]
+	try:
+		shared = []
+		for pool in pools:
+			values = { name: pool.empty( size ) for name in arrays }
+			for name, value in values.items():
+				value[ ... ] = arrays[ name ]
+			shared.append( ( values, pool.empty( size ) ) )
+
+		for expr in [ "a*b+c*d-e", "sqrt(a*a+b*b)*exp(-c)/(d+e)", "log(1+a)*cbrt(b)+pow(c,d)*exp(-e)" ]:
+			obj = maexpa.Expression( expr, backend = "numpy" )
+
+			results = [ ( "single", best( lambda: obj( var = arrays, out = out ) ) ), ( "blocked", best( lambda: obj.blocked( var = arrays, out = out ) ) ) ]
+			for count, pool, ( values, result ) in zip( workers, pools, shared ):
+				results.append( ( "{:d} copied".format( count ), best( lambda: obj.parallel( var = arrays, out = out, pool = pool ) ) ) )
+				results.append( ( "{:d} shared".format( count ), best( lambda: obj.parallel( var = values, out = result, pool = pool ) ) ) )
+
+			print( expr )
+			for name, value in results:
+				print( "  {:12s} {:8.2f} ms  x{:.2f}".format( name, value * 1e3, results[ 0 ][ 1 ] / value ) )
+	finally:
+		shared = None
+		values = None
+		result = None
+		for pool in pools:
+			pool.close()
+
+if __name__ == "__main__":
+	main( sys.argv )
@@ -0,0 +1,52 @@
+# Benchmark of the thread-parallel chunked evaluation of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the evaluation of expressions over large arrays in a single thread, chunk by chunk, and chunk by chunk with several threads.
+# Usage: python benchmarks/bench_threads.py [size [threads...]]
+
+import os
+import sys
+
+import numpy
+
+from common import best
+import maexpa
+
+def main( argv ):
+	size = int( float( argv[ 1 ] ) ) if len( argv ) > 1 else 10000000
+	threads = [ int( arg ) for arg in argv[ 2: ] ] or sorted( { 2, 4, os.cpu_count() or 1 } )
+
+	maexpa.lib( "numpy" )
+
+	rng = numpy.random.default_rng( 0 )
+	arrays = { name: rng.random( size ) for name in "abcde" }
+	out = numpy.empty( size )
+
+	print( "{:d} elements, {:d} cores".format( size, os.cpu_count() or 1 ) )
+
+	for expr in [ "a*b+c*d-e", "sqrt(a*a+b*b)*exp(-c)/(d+e)", "log(1+a)*cbrt(b)+pow(c,d)*exp(-e)" ]:
+		obj = maexpa.Expression( expr, backend = "numpy" )
+
+		results = [ ( "single", best( lambda: obj( var = arrays, out = out ) ) ), ( "blocked", best( lambda: obj.blocked( var = arrays, out = out ) ) ) ]
+		for count in threads:
+			results.append( ( "{:d} threads".format( count ), best( lambda: obj.blocked( var = arrays, out = out, threads = count ) ) ) )
+
+		print( expr )
+		for name, value in results:
+			print( "  {:12s} {:8.2f} ms  x{:.2f}".format( name, value * 1e3, results[ 0 ][ 1 ] / value ) )
+
+if __name__ == "__main__":
+	main( sys.argv )
@@ -0,0 +1,35 @@
+# Helpers shared by the benchmarks of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Importing this module makes the benchmarks run against the source tree they are part of rather than an installed copy.
+
+import os
+import sys
+import time
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), os.pardir ) )
+
+def best( func, repeat = 5 ):
+	"""
+	Get the shortest time taken by one call to `func' out of `repeat' calls.
+	"""
+
+	times = []
+	for i in range( repeat ):
+		start = time.perf_counter()
+		func()
+		times.append( time.perf_counter() - start )
+	return min( times )
@@ -0,0 +1,52 @@
+# Comparison of two runs of the benchmark suite of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Prints the ratio of the best times of the benchmarks present in both result files written by benchmarks/suite.py.
+# Usage: python benchmarks/compare.py old.json new.json [threshold]
+# The exit status is 1 if a benchmark got slower by more than `threshold' (by default 1.1, that is 10%).
+
+import json
+import sys
+
+def main( argv ):
+	if len( argv ) < 3:
+		print( "Usage: {:s} old.json new.json [threshold]".format( argv[ 0 ] ), file = sys.stderr )
+		return 2
+
+	with open( argv[ 1 ] ) as fp:
+		old = json.load( fp )[ "results" ]
+	with open( argv[ 2 ] ) as fp:
+		new = json.load( fp )[ "results" ]
+	threshold = float( argv[ 3 ] ) if len( argv ) > 3 else 1.1
+
+	slower = False
+	for name in sorted( set( old ) & set( new ) ):
+		ratio = new[ name ][ "best" ] / old[ name ][ "best" ]
+		mark = ""
+		if ratio > threshold:
+			mark = "  slower"
+			slower = True
+		elif ratio < 1. / threshold:
+			mark = "  faster"
+		print( "{:30s} {:12.3f} us {:12.3f} us {:8.2f}x{:s}".format( name, old[ name ][ "best" ] * 1e6, new[ name ][ "best" ] * 1e6, ratio, mark ) )
+
+	for name in sorted( set( old ) ^ set( new ) ):
+		print( "{:30s} only in {:s}".format( name, argv[ 1 ] if name in old else argv[ 2 ] ) )
+
+	return 1 if slower else 0
+
+if __name__ == "__main__":
+	sys.exit( main( sys.argv ) )
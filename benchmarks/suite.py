@@ -0,0 +1,190 @@
+# Benchmark suite for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the time taken by the lexer, the parser and the evaluation of expressions, and writes the results as JSON.
+# Two result files can then be compared with benchmarks/compare.py.
+# Usage: python benchmarks/suite.py [-o results.json] [-k filter] [--quick]
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+import common
+import maexpa
+from maexpa import namespace, parser, tokens
+
+from bench_lexer import generate
+
+def _deep( depth ):
+	text = "x"
+	for i in range( depth ):
+		text = "({:s}+{:d})*y".format( text, i )
+	return text
+
+def _long( terms ):
+	return "+".join( "x*{:d}-y/{:d}".format( i, i + 1 ) for i in range( terms ) )
+
+_scalar = "sqrt(x*x+y*y)*exp(-z)/(1+x)"
+
+def _providers( count ):
+	"""
+	Get a chain of `count' variable callbacks, where only the last one knows the variables.
+	"""
+
+	def miss( name ):
+		raise maexpa.exception.NoVarException( name )
+
+	def hit( name ):
+		if name == "x":
+			return 1.5
+		if name == "y":
+			return 2.5
+		if name == "z":
+			return 0.5
+		raise maexpa.exception.NoVarException( name )
+
+	return [ miss ] * ( count - 1 ) + [ hit ]
+
+def cases( quick, pools ):
+	"""
+	Generate the benchmarks as tuples of the name and of the function to time.
+
+	Expressions to evaluate are created beforehand, so that only their evaluation is timed.
+	The process pools that are created are appended to `pools', for the caller to close them.
+	"""
+
+	maexpa.lib( "std" )
+
+	for name, text in [ ( "short", _scalar ), ( "long_1000", _long( 1000 ) ), ( "deep_100", _deep( 100 ) ) ]:
+		yield "lexer/" + name, lambda text = text: tokens.lexer( text )
+
+		tklist = tokens.lexer( text )
+		yield "parser/" + name, lambda tklist = tklist: parser.Parser( tklist ).parse()
+
+		yield "compile/" + name, lambda text = text: maexpa.Expression( text )
+
+	# The time per token should not depend on the length
+	for terms in ( [ 100, 1000, 10000 ] if quick else [ 100, 1000, 10000, 100000 ] ):
+		formula = generate( terms )
+		yield "lexer/scaling/{:d}".format( terms ), lambda formula = formula: tokens.lexer( formula )
+
+	values = { "x": 1.5, "y": 2.5, "z": 0.5 }
+	for name, text in [ ( "short", _scalar ), ( "long_1000", _long( 1000 ) ), ( "deep_100", _deep( 100 ) ) ]:
+		obj = maexpa.Expression( text )
+		yield "std/" + name, lambda obj = obj: obj( var = values )
+
+	for count in [ 1, 2, 3 ]:
+		chain = _providers( count )
+		yield "providers/lookup/{:d}".format( count ), lambda chain = chain: namespace.get_variable( chain, "x" )
+
+	# The callbacks of the call are tried before those of the expression
+	obj = maexpa.Expression( _scalar, var = _providers( 1 )[ 0 ] )
+	miss = _providers( 2 )[ 0 ]
+	yield "providers/eval/1", lambda: obj()
+	yield "providers/eval/2", lambda: obj( var = miss )
+
+	try:
+		import numpy
+	except ImportError:
+		return
+
+	from maexpa import parallel
+
+	maexpa.lib( "numpy" )
+
+	counts = sorted( { 2, os.cpu_count() or 1 } )
+	for count in counts:
+		pools.append( parallel.ProcessPool( count ) )
+
+	sizes = [ 100, 10000 ] if quick else [ 100, 10000, 1000000 ]
+	for size in sizes:
+		rng = numpy.random.default_rng( 0 )
+		arrays = { name: rng.random( size ) for name in "xyz" }
+		for backend in [ None, "numpy", "vm" ]:
+			obj = maexpa.Expression( _scalar, backend = backend )
+			yield "numpy/{:s}/{:d}".format( backend or "tree", size ), lambda obj = obj, arrays = arrays: obj( var = arrays )
+
+		obj = maexpa.Expression( _scalar )
+		yield "numpy/blocked/{:d}".format( size ), lambda obj = obj, arrays = arrays: obj.blocked( var = arrays )
+
+		for count in counts:
+			yield "numpy/threads/{:d}/{:d}".format( count, size ), lambda obj = obj, arrays = arrays, count = count: obj.blocked( var = arrays, threads = count )
+
+		# The arrays are either copied to shared memory at each evaluation, or allocated there by the pool
+		for count, pool in zip( counts, pools ):
+			shared = { name: pool.empty( size ) for name in arrays }
+			for name, value in shared.items():
+				value[ ... ] = arrays[ name ]
+			out = pool.empty( size )
+			yield "numpy/copied/{:d}/{:d}".format( count, size ), lambda obj = obj, arrays = arrays, pool = pool: obj.parallel( var = arrays, pool = pool )
+			yield "numpy/shared/{:d}/{:d}".format( count, size ), lambda obj = obj, shared = shared, out = out, pool = pool: obj.parallel( var = shared, out = out, pool = pool )
+
+def measure( func, repeat ):
+	"""
+	Time `func', returning the number of calls per measurement and the time per call of each measurement.
+	"""
+
+	timer = timeit.Timer( func )
+	number, _ = timer.autorange()
+	return number, [ value / number for value in timer.repeat( repeat = repeat, number = number ) ]
+
+def main( argv ):
+	args = argparse.ArgumentParser( description = "Benchmark suite for MaExPa" )
+	args.add_argument( "-o", "--output", help = "file to write the results to, instead of the standard output" )
+	args.add_argument( "-k", "--filter", default = "", help = "only run the benchmarks whose name contains this text" )
+	args.add_argument( "--repeat", type = int, default = 5, help = "number of measurements of each benchmark" )
+	args.add_argument( "--quick", action = "store_true", help = "skip the largest arrays" )
+	opts = args.parse_args( argv[ 1: ] )
+
+	results = {}
+	pools = []
+	try:
+		for name, func in cases( opts.quick, pools ):
+			if not opts.filter in name:
+				continue
+
+			number, times = measure( func, opts.repeat )
+			results[ name ] = { "best": min( times ), "mean": sum( times ) / len( times ), "number": number, "repeat": len( times ) }
+			print( "{:30s} {:12.3f} us".format( name, min( times ) * 1e6 ), file = sys.stderr )
+	finally:
+		for pool in pools:
+			pool.close()
+
+	meta = {
+		"time": time.strftime( "%Y-%m-%dT%H:%M:%S" ),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"machine": platform.machine(),
+	}
+	try:
+		import numpy
+		meta[ "numpy" ] = numpy.__version__
+	except ImportError:
+		pass
+
+	text = json.dumps( { "meta": meta, "results": results }, indent = 1, sort_keys = True )
+	if opts.output is None:
+		print( text )
+	else:
+		with open( opts.output, "w" ) as out:
+			out.write( text + "\n" )
+
+if __name__ == "__main__":
+	main( sys.argv )
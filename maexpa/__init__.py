@@ -15,6 +15,8 @@
 # limitations under the License.
 
 from .expression import Expression
-from . import selection, exception
+from .expressionset import ExpressionSet
+from . import selection, exception, namespace, nodes, codegen, cache, profiling, metrics
 
 lib = selection.Selection()
+compile = cache.ExpressionCache()
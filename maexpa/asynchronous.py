@@ -0,0 +1,129 @@
+# Evaluation with asynchronous callbacks for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Callbacks may be coroutine functions, in which case a missing name is only reported when the coroutine is awaited.
+# All the variables of the expression are retrieved at once with asyncio.gather() before the evaluation starts.
+# If some of the functions are coroutine functions too, the tree is evaluated with the arguments of each call computed concurrently; otherwise it is evaluated as usual.
+
+import asyncio
+import inspect
+
+from . import exception, namespace, nodes
+
+def _is_async( func ):
+	return inspect.iscoroutinefunction( func ) or inspect.iscoroutinefunction( getattr( func, "__call__", None ) )
+
+async def _result( value ):
+	if inspect.isawaitable( value ):
+		return await value
+	return value
+
+async def get_variable( cbs, name ):
+	"""
+	Get the value of variable `name' from the first of `cbs' that provides it, awaiting the callbacks that are coroutine functions.
+	"""
+
+	for cb in cbs:
+		if namespace.is_namespace( cb ):
+			if name in cb:
+				return await _result( cb[ name ] )
+		else:
+			try:
+				return await _result( cb( name ) )
+			except exception.NoVarException:
+				continue
+
+	raise exception.NoVarException( name )
+
+async def call_function( cbs, name, args ):
+	"""
+	Call function `name' with `args' through the first of `cbs' that provides it, awaiting the result if needed.
+	"""
+
+	for cb in cbs:
+		if namespace.is_namespace( cb ):
+			if name in cb:
+				namespace.check_arity( cb, name, len( args ) )
+				return await _result( cb[ name ]( *args ) )
+		else:
+			try:
+				return await _result( cb( name, args ) )
+			except exception.NoFuncException:
+				continue
+
+	raise exception.NoFuncException( name )
+
+async def fetch( tree, scope ):
+	"""
+	Retrieve all the variables of the tree concurrently, returning a dict mapping their name to their value.
+	"""
+
+	found = {}
+	for node in nodes.walk( tree ):
+		if isinstance( node, nodes.NodeVariable ) and not node.name in found:
+			found[ node.name ] = node
+
+	values = await asyncio.gather( *[ get_variable( scope.var_cbs + node.providers, name ) for name, node in found.items() ] )
+
+	return dict( zip( found.keys(), values ) )
+
+def has_async_functions( tree, scope ):
+	"""
+	Whether any of the functions that the tree calls may be a coroutine function.
+	"""
+
+	for node in nodes.walk( tree ):
+		if isinstance( node, nodes.NodeCall ):
+			for cb in scope.func_cbs + node.providers:
+				if namespace.is_namespace( cb ):
+					if node.name in cb and _is_async( cb[ node.name ] ):
+						return True
+				elif _is_async( cb ):
+					return True
+
+	return False
+
+async def evaluate( node, scope ):
+	"""
+	Evaluate the tree starting at `node', awaiting the results of the functions and evaluating the arguments of each operation concurrently.
+	"""
+
+	if isinstance( node, nodes.NodeShared ):
+		if not node in scope.memo:
+			scope.memo[ node ] = asyncio.ensure_future( evaluate( node.node, scope ) )
+		return await scope.memo[ node ]
+
+	if isinstance( node, nodes.NodeCall ):
+		args = await asyncio.gather( *[ evaluate( arg, scope ) for arg in node.args ] )
+		return await call_function( scope.func_cbs + node.providers, node.name, list( args ) )
+
+	if isinstance( node, nodes.NodeUnary ):
+		return node.func( await evaluate( node.operand, scope ) )
+
+	if isinstance( node, nodes.NodeBinary ):
+		# Chains such as a+b+c+... are handled at once rather than recursively, all their operands being computed concurrently
+		chain = [ node ]
+		while type( chain[ -1 ].left ) is nodes.NodeBinary:
+			chain.append( chain[ -1 ].left )
+		chain.reverse()
+
+		values = await asyncio.gather( evaluate( chain[ 0 ].left, scope ), *[ evaluate( current.right, scope ) for current in chain ] )
+		value = values[ 0 ]
+		for current, right in zip( chain, values[ 1: ] ):
+			value = current.func( value, right )
+		return value
+
+	return node.evaluate( scope )
@@ -0,0 +1,160 @@
+# Chunked evaluation over large NumPy arrays for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Evaluating an expression node by node over arrays larger than the CPU caches makes every operator stream its operands from and to the main memory.
+# Instead, the arrays are cut into chunks small enough for all the intermediate results of one chunk to stay in the cache, and the whole expression is evaluated chunk by chunk.
+# This is only valid for expressions made of element-wise operations, which is the case of the operators and of the functions of the standard libraries.
+# Since NumPy releases the GIL while it computes ufuncs, the chunks can also be evaluated by several threads at once.
+
+import concurrent.futures
+import itertools
+
+import numpy
+
+from . import buffers, nodes
+from .expression import Scope
+
+# Amount of memory that the arrays of one chunk should fit in
+_cache_bytes = 2 * 1024 * 1024
+
+def auto_chunk_size( count, itemsize = 8 ):
+	"""
+	Get the number of elements per chunk so that `count' arrays of such chunks fit in the cache.
+	"""
+
+	size = _cache_bytes // ( itemsize * max( count, 1 ) )
+	return max( 16384, min( size, 262144 ) )
+
+def prepare( tree, scope, broadcast = True ):
+	"""
+	Retrieve the variables of the tree, and replace the arrays it holds as literals by variables.
+
+	Returns the new tree, a dict of the values of all the variables, with arrays broadcast to a common shape if `broadcast' is set, and that shape, which is None if there is no array.
+	"""
+
+	values = {}
+
+	def replace( node ):
+		if isinstance( node, nodes.NodeLiteral ) and isinstance( node.value, numpy.ndarray ):
+			# Such a name cannot come from an expression
+			name = "<literal {:d}>".format( len( values ) )
+			values[ name ] = node.value
+			return nodes.NodeVariable( node.get_column(), name )
+		return None
+
+	tree = nodes.copy_tree( tree, replace )
+
+	for node in nodes.walk( tree ):
+		if isinstance( node, nodes.NodeVariable ) and not node.name in values:
+			values[ node.name ] = node.evaluate( scope )
+
+	arrays = [ value for value in values.values() if isinstance( value, numpy.ndarray ) ]
+	if len( arrays ) == 0:
+		return tree, values, None
+
+	shape = buffers.broadcast_shape( [ value.shape for value in arrays ] )
+	if not broadcast:
+		return tree, values, shape
+
+	# Broadcast once so that chunks are plain indices
+	for name, value in values.items():
+		if isinstance( value, numpy.ndarray ) and value.shape != shape:
+			values[ name ] = numpy.broadcast_to( value, shape )
+
+	return tree, values, shape
+
+def slices( shape, chunk_size ):
+	"""
+	Cut the arrays of the given shape into chunks of about `chunk_size' elements that are consecutive in the flattened index, whatever the number of axes.
+
+	Each chunk is an index made of single positions along the leading axes and of a slice along the first axis after which the remaining axes hold at most `chunk_size' elements, so that it selects a view of the arrays.
+	"""
+
+	# Find the axis to slice: the remaining axes, which are taken whole, must fit in a chunk
+	axis = 0
+	inner = 1
+	for dim in shape[ 1: ]:
+		inner *= dim
+	while inner > chunk_size and axis < len( shape ) - 1:
+		axis += 1
+		inner //= shape[ axis ]
+
+	step = max( 1, chunk_size // max( inner, 1 ) )
+	cuts = [ slice( start, min( start + step, shape[ axis ] ) ) for start in range( 0, shape[ axis ], step ) ]
+
+	return [ lead + ( sl, ) for lead in itertools.product( *[ range( dim ) for dim in shape[ :axis ] ] ) for sl in cuts ]
+
+def chunk_values( values, sl ):
+	"""
+	Get the values of the variables restricted to the chunk `sl'.
+	"""
+
+	return { name: value[ sl ] if isinstance( value, numpy.ndarray ) else value for name, value in values.items() }
+
+def evaluate_chunk( tree, scope, values, sl, out ):
+	"""
+	Evaluate the tree over the chunk `sl', writing the result into `out[ sl ]'.
+	"""
+
+	buffers.evaluate( tree, Scope( ( chunk_values( values, sl ), ), scope.func_cbs ), out[ sl ] )
+
+def evaluate( tree, scope, out = None, chunk_size = None, threads = None, executor = None ):
+	"""
+	Evaluate the tree chunk by chunk, with chunks of `chunk_size' elements; if it is None, the size is chosen to fit in the CPU cache.
+
+	The chunks are evaluated concurrently by `executor' if given, or else by a pool of `threads' threads if it is more than one.
+	"""
+
+	tree, values, shape = prepare( tree, scope )
+
+	if shape is None or len( shape ) == 0 or 0 in shape:
+		# Nothing worth cutting
+		return buffers.evaluate( tree, Scope( ( values, ), scope.func_cbs ), out )
+
+	if chunk_size is None:
+		itemsize = max( value.dtype.itemsize for value in values.values() if isinstance( value, numpy.ndarray ) )
+		chunk_size = auto_chunk_size( len( values ) + 2, itemsize )
+
+	parts = slices( shape, chunk_size )
+
+	if out is None:
+		# The type of the result is only known once a chunk has been evaluated
+		first = buffers.evaluate( tree, Scope( ( chunk_values( values, parts[ 0 ] ), ), scope.func_cbs ) )
+		out = numpy.empty( shape, dtype = numpy.result_type( first ) )
+		out[ parts[ 0 ] ] = first
+		parts = parts[ 1: ]
+
+	if executor is None and not threads is None and threads > 1 and len( parts ) > 1:
+		with concurrent.futures.ThreadPoolExecutor( max_workers = threads ) as executor:
+			return evaluate_parts( tree, scope, values, parts, out, executor )
+
+	return evaluate_parts( tree, scope, values, parts, out, executor )
+
+def evaluate_parts( tree, scope, values, parts, out, executor ):
+	"""
+	Evaluate the chunks `parts' into `out', concurrently if `executor' is not None.
+	"""
+
+	if executor is None:
+		for sl in parts:
+			evaluate_chunk( tree, scope, values, sl, out )
+	else:
+		# Each chunk has its own scope and writes to its own part of `out'
+		futures = [ executor.submit( evaluate_chunk, tree, scope, values, sl, out ) for sl in parts ]
+		for future in futures:
+			future.result()
+
+	return out
@@ -0,0 +1,138 @@
+# NumPy evaluation with re-use of temporary arrays for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Every operator or function applied to arrays normally allocates a new array for its result.
+# Here, the result of an operation that is only used by its parent is known to be dead once the parent has been computed, so the parent writes its own result into it with the `out' argument of the ufunc.
+# Only arrays allocated during the evaluation are re-used this way; variables, literals and the values of shared subtrees never are.
+
+import numpy
+
+from . import metrics, nodes
+
+_binary = {
+	"**": numpy.power,
+	"//": numpy.floor_divide,
+	"*": numpy.multiply,
+	"/": numpy.true_divide,
+	"+": numpy.add,
+	"-": numpy.subtract,
+}
+
+_unary = {
+	"+": numpy.positive,
+	"-": numpy.negative,
+}
+
+def broadcast_shape( shapes ):
+	"""
+	Get the shape resulting from broadcasting arrays of `shapes' together.
+
+	Equivalent to numpy.broadcast_shapes(), which requires NumPy 1.20.
+	"""
+
+	if hasattr( numpy, "broadcast_shapes" ):
+		return numpy.broadcast_shapes( *shapes )
+
+	# Arrays of a type without fields take no memory whatever their shape
+	shape = ()
+	for other in shapes:
+		shape = numpy.broadcast( numpy.empty( shape, dtype = [] ), numpy.empty( other, dtype = [] ) ).shape
+	return shape
+
+def _reusable( buf, values ):
+	"""
+	Whether array `buf' can receive the result of a ufunc applied to `values' without changing the type or shape of the result.
+	"""
+
+	if not isinstance( buf, numpy.ndarray ) or not buf.dtype.kind in "fc" or not buf.flags.writeable:
+		return False
+
+	for value in values:
+		if isinstance( value, ( numpy.ndarray, numpy.generic ) ):
+			if value.dtype != buf.dtype:
+				return False
+		elif type( value ) is bool or not isinstance( value, ( int, float ) ):
+			# Python numbers do not change the type of floating-point arrays, but other objects might
+			return False
+
+	return broadcast_shape( [ numpy.shape( value ) for value in values ] ) == buf.shape
+
+def _apply( ufunc, op, args, out ):
+	values = [ value for value, _ in args ]
+
+	if not any( isinstance( value, numpy.ndarray ) for value in values ):
+		# Keep the exact same types as the standard evaluation for scalars
+		return op( *values ), False
+
+	if out is None:
+		for value, owned in args:
+			if owned and _reusable( value, values ):
+				out = value
+				break
+		else:
+			return ufunc( *values ), True
+
+	return ufunc( *values, out = out ), True
+
+def _evaluate( node, scope, out ):
+	"""
+	Evaluate `node', returning its value and whether the value is a temporary array that can be overwritten.
+	"""
+
+	if isinstance( node, nodes.NodeShared ):
+		if not node in scope.memo:
+			scope.memo[ node ] = _evaluate( node.node, scope, None )[ 0 ]
+		return scope.memo[ node ], False
+
+	if isinstance( node, nodes.NodeCall ):
+		args = [ _evaluate( arg, scope, None ) for arg in node.args ]
+		if isinstance( node.impl, numpy.ufunc ) and not scope.func_cbs:
+			if metrics.active is None:
+				return _apply( node.impl, node.impl, args, out )
+			return metrics.active.callback( "function", node.name, _apply, node.impl, node.impl, args, out )
+		return node.call( scope, [ value for value, _ in args ] ), False
+
+	if isinstance( node, nodes.NodeUnary ):
+		return _apply( _unary[ node.op ], node.func, [ _evaluate( node.operand, scope, None ) ], out )
+
+	if isinstance( node, nodes.NodeBinary ):
+		# Chains such as a+b+c+... are evaluated without recursing down the left operands
+		chain = [ node ]
+		while type( chain[ -1 ].left ) is nodes.NodeBinary:
+			chain.append( chain[ -1 ].left )
+
+		value = _evaluate( chain[ -1 ].left, scope, None )
+		for current in reversed( chain ):
+			# Not kept in a variable, which would hold the operands alive while the next one is computed
+			value = _apply( _binary[ current.op ], current.func, [ value, _evaluate( current.right, scope, None ) ], out if current is node else None )
+		return value
+
+	return node.evaluate( scope ), False
+
+def evaluate( root, scope, out = None ):
+	"""
+	Evaluate the tree starting at `root', re-using temporary arrays for intermediate results.
+
+	If `out' is given, the result is written into it and it is returned.
+	"""
+
+	value, _ = _evaluate( root, scope, out )
+
+	if not out is None and not value is out:
+		out[ ... ] = value
+		return out
+
+	return value
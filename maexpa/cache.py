@@ -0,0 +1,113 @@
+# Cache of compiled expressions for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+
+from . import metrics
+from .expression import Expression
+
+def _key_part( obj ):
+	try:
+		hash( obj )
+	except TypeError:
+		# The cached expression keeps a reference to the object, so its id cannot be reused while the entry exists
+		return ( "id", id( obj ) )
+
+	return obj
+
+class ExpressionCache( object ):
+	"""
+	Bounded LRU cache of compiled expressions.
+
+	Calling the instance returns an Expression for the given text, re-using a previous one if the same text was compiled with the same library selection and callbacks.
+	"""
+
+	def __init__( self, limit = 1024 ):
+		self._lock = threading.Lock()
+		self._entries = collections.OrderedDict()
+		self._limit = limit
+		self.hits = 0
+		self.misses = 0
+
+	def __call__( self, expr, var = None, func = None ):
+		# This has to be imported as run time to prevent circular reference
+		from . import lib
+
+		key = ( expr, _key_part( lib.get_var_cb() ), _key_part( lib.get_func_cb() ), _key_part( var ), _key_part( func ) )
+
+		with self._lock:
+			obj = self._entries.get( key )
+			if not obj is None:
+				self._entries.move_to_end( key )
+				self.hits += 1
+				if not metrics.active is None:
+					metrics.active.cache( True )
+				return obj
+			self.misses += 1
+			if not metrics.active is None:
+				metrics.active.cache( False )
+
+		# Compile outside of the lock so that other threads are not held up
+		obj = Expression( expr, var = var, func = func )
+
+		with self._lock:
+			self._entries[ key ] = obj
+			self._entries.move_to_end( key )
+			self._shrink()
+
+		return obj
+
+	def __len__( self ):
+		return len( self._entries )
+
+	def _shrink( self ):
+		if not self._limit is None:
+			while len( self._entries ) > self._limit:
+				self._entries.popitem( last = False )
+
+	def get_limit( self ):
+		"""
+		Get the maximum number of expressions kept in the cache; None means no limit.
+		"""
+		return self._limit
+
+	def set_limit( self, limit ):
+		"""
+		Set the maximum number of expressions kept in the cache; None means no limit and 0 disables caching.
+		"""
+
+		with self._lock:
+			self._limit = limit
+			self._shrink()
+
+	def clear( self ):
+		"""
+		Remove all the expressions from the cache and reset the counters.
+		"""
+
+		with self._lock:
+			self._entries.clear()
+			self.hits = 0
+			self.misses = 0
+
+	def stats( self ):
+		"""
+		Get a snapshot of the size, limit and hit/miss counters of the cache as a dict.
+		"""
+
+		with self._lock:
+			return { "size": len( self._entries ), "limit": self._limit, "hits": self.hits, "misses": self.misses }
@@ -14,35 +14,40 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import exception
+from . import exception, namespace
 
 import math
 import numpy
 
 _func_defs = {
-	"min": { "func": numpy.minimum, "args": 2 },
-	"max": { "func": numpy.maximum, "args": 2 },
-	"pow": { "func": numpy.power, "args": 2 },
+	"min": { "func": numpy.minimum, "args": 2, "pure": True },
+	"max": { "func": numpy.maximum, "args": 2, "pure": True },
+	"pow": { "func": numpy.power, "args": 2, "pure": True },
 
-	"abs": { "func": numpy.fabs, "args": 1 },
-	"floor": { "func": numpy.floor, "args": 1 },
-	"ceil": { "func": numpy.ceil, "args": 1 },
+	"abs": { "func": numpy.fabs, "args": 1, "pure": True },
+	"floor": { "func": numpy.floor, "args": 1, "pure": True },
+	"ceil": { "func": numpy.ceil, "args": 1, "pure": True },
 
-	"exp": { "func": numpy.exp, "args": 1 },
-	"log": { "func": numpy.log, "args": 1 },
-	"log2": { "func": numpy.log2, "args": 1 },
-	"log10": { "func": numpy.log10, "args": 1 },
+	"exp": { "func": numpy.exp, "args": 1, "pure": True },
+	"expm1": { "func": numpy.expm1, "args": 1, "pure": True },
+	"log": { "func": numpy.log, "args": 1, "pure": True },
+	"log1p": { "func": numpy.log1p, "args": 1, "pure": True },
+	"log2": { "func": numpy.log2, "args": 1, "pure": True },
+	"log10": { "func": numpy.log10, "args": 1, "pure": True },
 
-	"sqrt": { "func": numpy.sqrt, "args": 1 },
-	"cbrt": { "func": numpy.cbrt, "args": 1 },
+	"sqrt": { "func": numpy.sqrt, "args": 1, "pure": True },
+	"cbrt": { "func": numpy.cbrt, "args": 1, "pure": True },
 }
 
 _var_defs = {
-	"e": math.e,
-	"pi": math.pi,
-	"tau": math.tau,
+	"e": { "value": math.e, "const": True },
+	"pi": { "value": math.pi, "const": True },
+	"tau": { "value": math.tau, "const": True },
 }
 
+variables = namespace.Variables( _var_defs, library = "numpy" )
+functions = namespace.Functions( _func_defs, library = "numpy" )
+
 def func( name, args ):
 	'''
 	Standard callback function to call methods in Python's math module.
@@ -64,4 +69,4 @@ def var( name ):
 	if not name in _var_defs:
 		raise exception.NoVarException( name )
 
-	return _var_defs[ name ]
+	return _var_defs[ name ][ "value" ]
@@ -14,36 +14,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import exception
+from . import exception, namespace
 
 import math
 
 _func_defs = {
 	# Built-in module
-	"min": { "func": min, "args": 2 },
-	"max": { "func": max, "args": 2 },
-	"pow": { "func": pow, "args": 2 },
+	"min": { "func": min, "args": 2, "pure": True },
+	"max": { "func": max, "args": 2, "pure": True },
+	"pow": { "func": pow, "args": 2, "pure": True },
 
 	# math module
-	"abs": { "func": math.fabs, "args": 1 },
-	"floor": { "func": math.floor, "args": 1 },
-	"ceil": { "func": math.ceil, "args": 1 },
+	"abs": { "func": math.fabs, "args": 1, "pure": True },
+	"floor": { "func": math.floor, "args": 1, "pure": True },
+	"ceil": { "func": math.ceil, "args": 1, "pure": True },
 
-	"exp": { "func": math.exp, "args": 1 },
-	"log": { "func": math.log, "args": 1 },
-	"log2": { "func": math.log2, "args": 1 },
-	"log10": { "func": math.log10, "args": 1 },
+	"exp": { "func": math.exp, "args": 1, "pure": True },
+	"expm1": { "func": math.expm1, "args": 1, "pure": True },
+	"log": { "func": math.log, "args": 1, "pure": True },
+	"log1p": { "func": math.log1p, "args": 1, "pure": True },
+	"log2": { "func": math.log2, "args": 1, "pure": True },
+	"log10": { "func": math.log10, "args": 1, "pure": True },
 
-	"sqrt": { "func": math.sqrt, "args": 1 },
-	"cbrt": { "func": lambda x: math.copysign( math.fabs( x ) ** ( 1. / 3. ), x ), "args": 1 },
+	"sqrt": { "func": math.sqrt, "args": 1, "pure": True },
+	"cbrt": { "func": lambda x: math.copysign( math.fabs( x ) ** ( 1. / 3. ), x ), "args": 1, "pure": True },
 }
 
 _var_defs = {
-	"e": math.e,
-	"pi": math.pi,
-	"tau": math.tau,
+	"e": { "value": math.e, "const": True },
+	"pi": { "value": math.pi, "const": True },
+	"tau": { "value": math.tau, "const": True },
 }
 
+variables = namespace.Variables( _var_defs, library = "std" )
+functions = namespace.Functions( _func_defs, library = "std" )
+
 def func( name, args ):
 	'''
 	Standard callback function to call methods in Python's math module.
@@ -65,4 +70,4 @@ def var( name ):
 	if not name in _var_defs:
 		raise exception.NoVarException( name )
 
-	return _var_defs[ name ]
+	return _var_defs[ name ][ "value" ]
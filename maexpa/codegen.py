@@ -0,0 +1,155 @@
+# Python code generation backend for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import keyword
+import math
+
+from . import exception, namespace, nodes
+
+class _Generator( object ):
+	def __init__( self, expr, params ):
+		self.expr = expr
+		self.params = params
+		self.args = {}
+		self.bound = {}
+		self.funcs = {}
+		self.locals = {}
+
+	def bind( self, value ):
+		name = "_k{:d}".format( len( self.bound ) )
+		self.bound[ name ] = value
+		return name
+
+	def arg( self, name ):
+		if not name in self.args:
+			if name.isidentifier() and not keyword.iskeyword( name ) and not name.startswith( "_" ):
+				self.args[ name ] = name
+			else:
+				self.args[ name ] = "_v{:d}".format( len( self.args ) )
+
+		return self.args[ name ]
+
+	def leaf( self, node ):
+		if isinstance( node, nodes.NodeShared ):
+			return self.locals.get( node )
+
+		if isinstance( node, nodes.NodeLiteral ):
+			if type( node.value ) in ( int, float ) and math.isfinite( node.value ):
+				return repr( node.value )
+			return self.bind( node.value )
+
+		if isinstance( node, nodes.NodeVariable ):
+			if node.name in self.params:
+				return self.arg( node.name )
+			return self.bind( self.expr.variable( node.name ) )
+
+		key = ( node.name, len( node.args ) )
+		if not key in self.funcs:
+			self.funcs[ key ] = self.bind( namespace.function_impl( namespace.resolve( self.expr.func_cbs, node.name ), node.name, len( node.args ), eager = True ) )
+		return self.funcs[ key ]
+
+	def body( self, tree ):
+		'''
+		Generate the statements computing `tree', with the shared subtrees stored in local variables.
+		'''
+
+		# Post-order puts each subtree before the ones containing it
+		order = [ node for node in nodes.postorder( tree ) if isinstance( node, nodes.NodeShared ) and not isinstance( node.node, ( nodes.NodeLiteral, nodes.NodeVariable ) ) ]
+
+		lines = []
+		for node in order:
+			text = nodes.format( node.node, self.leaf )
+			self.locals[ node ] = "_s{:d}".format( len( self.locals ) )
+			lines.append( "{:s} = {:s}".format( self.locals[ node ], text ) )
+		lines.append( "return " + nodes.format( tree, self.leaf ) )
+
+		return lines
+
+# Depth of nested operations beyond which a subtree is computed in a statement of its own, since Python cannot compile deeply nested expressions
+_max_depth = 100
+
+def split( tree ):
+	'''
+	Get a copy of the tree where the subtrees that would be nested too deeply in the generated code are wrapped in NodeShared instances, so that they are computed in statements of their own.
+
+	The tree itself is returned if it is not too deep.
+	'''
+
+	depth = {}
+	new = {}
+	changed = False
+
+	for node in nodes.postorder( tree ):
+		children = [ new[ child ] for child in node.children() ]
+		depth[ node ] = 1 + max( [ depth[ child ] for child in node.children() ], default = 0 )
+
+		if children != node.children():
+			new[ node ] = copy.copy( node )
+			new[ node ].set_children( children )
+		else:
+			new[ node ] = node
+
+		if depth[ node ] >= _max_depth and not isinstance( node, nodes.NodeShared ):
+			new[ node ] = nodes.NodeShared( new[ node ] )
+			depth[ node ] = 1
+			changed = True
+
+	return new[ tree ] if changed else tree
+
+def free_variables( expr ):
+	'''
+	Names of the variables of `expr' that cannot be resolved by its callbacks, in order of first appearance.
+	'''
+
+	names = []
+
+	for node in nodes.walk( expr.tree ):
+		if isinstance( node, nodes.NodeVariable ) and not node.name in names:
+			try:
+				expr.variable( node.name )
+			except exception.NoVarException:
+				names.append( node.name )
+
+	return names
+
+def lambdify( expr, params = None ):
+	'''
+	Turn `expr' into a native Python function taking the variables listed in `params' as arguments.
+
+	Variables that are not in `params' are retrieved once through the callbacks of `expr' and bound in the function, as are the library functions.
+	If `params' is None, all the variables that cannot be resolved by the callbacks are taken as arguments.
+	'''
+
+	if params is None:
+		params = free_variables( expr )
+
+	gen = _Generator( expr, params )
+	for name in params:
+		gen.arg( name )
+	body = "".join( "\t\t" + line + "\n" for line in gen.body( split( expr.tree ) ) )
+
+	args = ", ".join( gen.args[ name ] for name in params )
+	source = "def _factory( {bound:s} ):\n\tdef expression( {args:s} ):\n{body:s}\treturn expression\n".format( bound = ", ".join( gen.bound ), args = args, body = body )
+
+	env = {}
+	exec( compile( source, "<maexpa: {:s}>".format( expr.expr ), "exec" ), env )
+
+	fn = env[ "_factory" ]( **gen.bound )
+	fn.__doc__ = expr.expr
+	fn.source = source
+
+	return fn
@@ -0,0 +1,129 @@
+# Common subexpression elimination for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import namespace, nodes
+
+def _literal_key( value ):
+	try:
+		hash( value )
+	except TypeError:
+		# Arrays and the like are only equal to themselves
+		return ( "id", id( value ) )
+
+	# repr() tells apart 0. and -0., which compare equal
+	return ( type( value ), repr( value ) if type( value ) is float else value )
+
+def _providers_key( providers ):
+	# Namespaces such as dicts are not hashable, but they live as long as the expression anyway
+	return tuple( id( provider ) for provider in providers )
+
+class _Table( object ):
+	def __init__( self ):
+		self.nodes = {}
+		self.keys = {}
+		self.shareable = {}
+
+	def visit( self, root ):
+		"""
+		Return the canonical node that is structurally identical to `root', registering the nodes of its tree that are the first of their kind.
+		"""
+
+		canonical = {}
+
+		for node in nodes.postorder( root ):
+			if isinstance( node, nodes.NodeShared ):
+				# Already processed by an earlier pass
+				canonical[ node ] = canonical[ node.node ]
+			else:
+				canonical[ node ] = self.canonical( node, [ canonical[ child ] for child in node.children() ] )
+
+		return canonical[ root ]
+
+	def canonical( self, node, children ):
+		# The children are canonical already, so that they are identical if they are equivalent; this also keeps the keys flat for deep trees
+		child_keys = tuple( id( child ) for child in children )
+
+		if isinstance( node, nodes.NodeLiteral ):
+			key = ( "literal", _literal_key( node.value ) )
+			shareable = True
+		elif isinstance( node, nodes.NodeVariable ):
+			key = ( "variable", node.name, _providers_key( node.providers ) )
+			shareable = True
+		elif isinstance( node, nodes.NodeCall ):
+			key = ( "call", node.name, _providers_key( node.providers ), child_keys )
+			# Calling an impure function fewer times than written would change the result
+			shareable = namespace.is_pure( node.providers, node.name )
+		else:
+			key = ( type( node ).__name__, node.op, child_keys )
+			shareable = True
+
+		shareable = shareable and all( self.shareable[ child ] for child in children )
+
+		if shareable and key in self.nodes:
+			return self.nodes[ key ]
+
+		node.set_children( children )
+		self.keys[ node ] = key
+		self.shareable[ node ] = shareable
+		if shareable:
+			self.nodes[ key ] = node
+
+		return node
+
+def eliminate( roots ):
+	"""
+	Merge the structurally identical subtrees of the trees in `roots', which are modified in place.
+
+	Each subtree used more than once is wrapped in a NodeShared instance so that it is only evaluated once per evaluation; literals are merged but not wrapped since they cost nothing to evaluate.
+	Calls are only merged if the function is known to be pure.
+	Returns the list of new roots.
+	"""
+
+	table = _Table()
+	roots = [ table.visit( root ) for root in roots ]
+
+	# Count the references to each node of the resulting graph
+	uses = dict.fromkeys( table.keys, 0 )
+	for root in roots:
+		uses[ root ] += 1
+	for node in table.keys:
+		for child in node.children():
+			uses[ child ] += 1
+
+	wrappers = {}
+	for node, count in uses.items():
+		if count > 1 and not isinstance( node, nodes.NodeLiteral ):
+			wrappers[ node ] = nodes.NodeShared( node )
+
+	def wrap( node ):
+		return wrappers.get( node, node )
+
+	for node in table.keys:
+		node.set_children( [ wrap( child ) for child in node.children() ] )
+
+	return [ wrap( root ) for root in roots ]
+
+def shared( root ):
+	"""
+	Get the list of the shared subtrees of the tree starting at `root', in order of first appearance.
+	"""
+
+	found = []
+	for node in nodes.walk( root ):
+		if isinstance( node, nodes.NodeShared ) and not node in found:
+			found.append( node )
+
+	return found
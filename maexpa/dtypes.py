@@ -0,0 +1,79 @@
+# Type policy for the evaluation over NumPy arrays for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# By default, NumPy's promotion rules decide the type of each intermediate result, so that a single float64 constant or input makes the rest of the evaluation float64.
+# With a type policy, the literals of the tree are converted once to the chosen floating-point type, after constant folding so that this includes the folded library constants such as pi.
+# The variables are retrieved before the evaluation and converted as well, so that the operators and the ufuncs only ever see values of that type.
+# Functions provided by callbacks are expected to keep the type of their arguments, as NumPy's ufuncs do.
+
+import numpy
+
+from . import nodes
+from .expression import Scope
+
+def check( dtype ):
+	"""
+	Get the numpy.dtype of `dtype', which must be a floating-point type.
+	"""
+
+	try:
+		dtype = numpy.dtype( dtype )
+	except TypeError:
+		dtype = None
+
+	if dtype is None or dtype.kind != "f":
+		raise Exception( "Invalid dtype passed to maexpa.Expression(): {:s}".format( str( dtype ) ) )
+
+	return dtype
+
+def cast( value, dtype ):
+	"""
+	Convert `value' to `dtype' if it is a real number or an array of them, or return it as is otherwise.
+	"""
+
+	if isinstance( value, numpy.ndarray ):
+		if value.dtype.kind in "biuf" and value.dtype != dtype:
+			return value.astype( dtype )
+		return value
+
+	if isinstance( value, ( bool, int, float, numpy.bool_, numpy.integer, numpy.floating ) ):
+		return dtype.type( value )
+
+	return value
+
+def cast_literals( tree, dtype ):
+	"""
+	Get a copy of the tree with its literals converted to `dtype'.
+	"""
+
+	def replace( node ):
+		if isinstance( node, nodes.NodeLiteral ):
+			return nodes.NodeLiteral( node.get_column(), cast( node.value, dtype ) )
+		return None
+
+	return nodes.copy_tree( tree, replace )
+
+def cast_variables( tree, scope, dtype ):
+	"""
+	Retrieve all the variables of the tree with the callbacks of `scope', returning a new scope that provides their values converted to `dtype'.
+	"""
+
+	values = {}
+	for node in nodes.postorder( tree ):
+		if isinstance( node, nodes.NodeVariable ) and not node.name in values:
+			values[ node.name ] = cast( node.evaluate( scope ), dtype )
+
+	return Scope( ( values, ), scope.func_cbs )
@@ -14,12 +14,89 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from . import exception, tokens
+import copy
+import itertools
+
+from . import codegen, cse, folding, metrics, namespace, nodes, parser, tokens
+from . import rewrite as rewriting
+
+class Scope( object ):
+	"""
+	State of a single evaluation of an expression.
+
+	The expression itself is never modified while being evaluated, so that the same instance can be used from several threads at once.
+	"""
+
+	def __init__( self, var_cbs, func_cbs ):
+		# Only the callbacks passed for this evaluation; those of the expression are resolved in the tree
+		self.var_cbs = var_cbs
+		self.func_cbs = func_cbs
+		# Values of the shared subtrees
+		self.memo = {}
+
+	def function( self, name, args, providers = () ):
+		return namespace.call_function( self.func_cbs + providers, name, args )
+
+	def variable( self, name, providers = () ):
+		return namespace.get_variable( self.var_cbs + providers, name )
+
+	def overrides( self, names, callbacks = False ):
+		'''
+		Whether the callbacks of this evaluation provide any of `names': namespaces that contain one of them, and with `callbacks', any callback that is not a namespace, since it may provide any name.
+		'''
+
+		if not names:
+			return False
+
+		for cb in self.var_cbs + self.func_cbs:
+			if namespace.is_namespace( cb ):
+				if any( name in cb for name in names ):
+					return True
+			elif callbacks:
+				return True
+
+		return False
+
+	def prefetch( self, tree, executor ):
+		'''
+		Retrieve all the variables of `tree' concurrently on `executor', returning a new scope that provides their values.
+
+		If some variables cannot be retrieved, the exception of the first one in the expression is raised.
+		'''
+
+		found = {}
+		for node in nodes.walk( tree ):
+			if isinstance( node, nodes.NodeVariable ) and not node.name in found:
+				found[ node.name ] = node
+
+		futures = { name: executor.submit( node.evaluate, self ) for name, node in found.items() }
+		try:
+			values = { name: future.result() for name, future in futures.items() }
+		finally:
+			# Do not wait for the lookups that have not started after an error
+			for future in futures.values():
+				future.cancel()
+
+		return Scope( ( values, ), self.func_cbs )
 
 class Expression( object ):
-	def __init__( self, expr, var = None, func = None ):
+	def __init__( self, expr, var = None, func = None, fold = True, backend = None, dtype = None, rewrite = None, overrides = False ):
+		if not backend in ( None, "numpy", "vm" ):
+			raise Exception( "Invalid backend passed to maexpa.Expression(): {:s}".format( backend ) )
+		if not rewrite is None and not rewrite in rewriting.modes:
+			raise Exception( "Invalid rewrite mode passed to maexpa.Expression(): {:s}".format( rewrite ) )
+		if not dtype is None:
+			from . import dtypes
+			dtype = dtypes.check( dtype )
+
 		self.expr = expr
-		self.tokens = tokens.lexer( expr )
+		try:
+			self.tokens = tokens.lexer( expr )
+			tree = parser.Parser( self.tokens ).parse()
+		except Exception as exc:
+			if not metrics.active is None:
+				metrics.active.exception( exc )
+			raise
 
 		# This has to be imported as run time to prevent circular reference
 		from . import lib
@@ -38,138 +115,307 @@ class Expression( object ):
 		if not func is None:
 			self.func_cbs.append( func )
 
-		self.cur = None
-		self.value = None
+		self.fold = fold
+		self.rewrite = rewrite
+		self.overrides = overrides
+		self.backend = backend
+		self.dtype = dtype
+		self.program = None
+		self.plain_program = None
+		self.plain = None
+		self.names = frozenset()
+
+		self.tree = tree
+		self.resolve()
+		self.optimize()
+
+	def __reduce__( self ):
+		# The tree is stored so that it does not have to be built again, flattened so that its depth does not matter; the namespaces of the libraries are stored by name
+		return ( _rebuild, ( self.expr, self.var_cbs, self.func_cbs, self.fold, self.backend, nodes.flatten( self.tree ), self.dtype, self.rewrite, None if self.plain is None else nodes.flatten( self.plain ), self.names, self.overrides ) )
+
+	def optimize( self, bound = () ):
+		'''
+		Run the compile-time passes over the tree.
+
+		Folding and rewriting remove or add names of variables and functions, which namespaces passed at evaluation take precedence for, and so do callbacks with `overrides'.
+		If they do, the tree without these passes is kept in `plain', to be evaluated when they provide one of these names; `names' is the set of these names.
+		The literals `bound' were set by bind() and cannot be replaced at evaluation; what only depends on them is computed in `plain' as well.
+		'''
+
+		names = set()
+		plain = None
+		if self.fold or not self.rewrite is None:
+			plain = self.tree
+			self.tree = nodes.copy_tree( plain )
+			if self.fold and bound:
+				plain = folding.fold( plain, fixed = set( bound ) )
+
+		if self.fold:
+			self.tree = folding.fold( self.tree, names )
+		if not self.rewrite is None:
+			self.tree = rewriting.rewrite( self.tree, self.func_cbs, self.rewrite, names )
+
+		self.plain = plain if names else None
+		self.names = frozenset( names )
+
+		if not self.dtype is None:
+			from . import dtypes
+			self.tree = dtypes.cast_literals( self.tree, self.dtype )
+			if not self.plain is None:
+				self.plain = dtypes.cast_literals( self.plain, self.dtype )
+
+		self.tree, = cse.eliminate( [ self.tree ] )
+		if not self.plain is None:
+			self.plain, = cse.eliminate( [ self.plain ] )
+
+		if self.backend == "vm":
+			from . import vm
+			self.program = vm.compile( self.tree )
+			self.plain_program = None if self.plain is None else vm.compile( self.plain )
+
+	def resolve( self ):
+		'''
+		Bind each variable and function of the tree to the callbacks or namespaces that can provide it.
+
+		Unless `overrides' is set, functions of namespaces called with the wrong number of arguments are reported here rather than at evaluation.
+		'''
+
+		for node in nodes.walk( self.tree ) if self.plain is None else itertools.chain( nodes.walk( self.tree ), nodes.walk( self.plain ) ):
+			if isinstance( node, nodes.NodeVariable ):
+				node.resolve( self.var_cbs )
+			elif isinstance( node, nodes.NodeCall ):
+				node.resolve( self.func_cbs, self.overrides )
+
+	def __call__( self, var = None, func = None, out = None, prefetch = None ):
+		'''
+		Evaluate the expression. If `out' is given, the result is written into it and it is returned.
+
+		If `prefetch' is a concurrent.futures executor, all the variables are first retrieved concurrently on it.
+		'''
+
+		if not metrics.active is None:
+			return metrics.active.evaluate( self.expr, self._evaluate, var, func, out, prefetch )
+		return self._evaluate( var, func, out, prefetch )
+
+	def _evaluate( self, var, func, out, prefetch ):
+		scope = self.scope( var, func )
+		tree = self.select( scope )
+		if not prefetch is None:
+			scope = scope.prefetch( tree, prefetch )
+		scope = self.cast( scope, tree )
+
+		program = self.program if tree is self.tree else self.plain_program
+		if self.backend == "vm" and not program is None and not scope.func_cbs:
+			from . import vm
+			return vm.evaluate( program, tree, scope, out )
+
+		if self.backend in ( "numpy", "vm" ):
+			# Also for the expressions that the virtual machine cannot run
+			from . import buffers
+			return buffers.evaluate( tree, scope, out )
+
+		value = tree.evaluate( scope )
+		if out is None:
+			return value
 
-	def next_val( self, s ):
-		if self.cur < len( self.tokens ) and self.tokens[ self.cur ].get_type() == s:
-			self.value = self.tokens[ self.cur ].get_value()
-			self.cur += 1
-			return True
-		else:
-			return False
+		out[ ... ] = value
+		return out
 
-	def next_is( self, s ):
-		if self.cur < len( self.tokens ) and self.tokens[ self.cur ].get_type() == s:
-			self.value = None
-			self.cur += 1
-			return True
-		else:
-			return False
+	async def evaluate_async( self, var = None, func = None, out = None ):
+		'''
+		Evaluate the expression with callbacks that may be coroutine functions.
 
-	def next_must( self, s ):
-		if not self.next_is( s ):
-			self.error()
+		All the variables are retrieved concurrently before the evaluation starts; if some functions are coroutine functions, the arguments of each call are computed concurrently too.
+		'''
 
-	def operator( self, allowed ):
-		if self.cur < len( self.tokens ) and self.tokens[ self.cur ].get_type() == "operator":
-			if self.tokens[ self.cur ].get_value() in allowed:
-				self.value = self.tokens[ self.cur ]
-				self.cur += 1
-				return True
-		return False
+		if not metrics.active is None:
+			return await metrics.active.evaluate_async( self.expr, self._evaluate_async, var, func, out )
+		return await self._evaluate_async( var, func, out )
 
-	def error( self ):
-		if self.cur >= len( self.tokens ):
-			raise exception.ParseEndException( None, -1 )
-		else:
-			raise exception.ParseException( self.tokens[ self.cur ].get_type(), self.tokens[ self.cur ].get_column() + 1 )
+	async def _evaluate_async( self, var, func, out ):
+		from . import asynchronous
 
-	def __call__( self, var = None, func = None ):
-		self.cur = 0
-		self.value = None
+		scope = self.scope( var, func )
+		tree = self.select( scope )
+		values = await asynchronous.fetch( tree, scope )
 
-		if not var is None:
-			self.var_cbs.insert( 0, var )
-		if not func is None:
-			self.func_cbs.insert( 0, func )
+		if not asynchronous.has_async_functions( tree, scope ):
+			return self._evaluate( values, func, out, None )
 
-		try:
-			value = self.expression()
-		finally:
-			if not var is None:
-				self.var_cbs.pop( 0 )
-			if not func is None:
-				self.func_cbs.pop( 0 )
-
-		if self.cur != len( self.tokens ):
-			self.error()
-
-		return value
-
-	def expression( self ):
-		self.operator( [ "+", "-" ] )
-		oper = self.value
-		value = self.term()
-		if oper:
-			value = oper.unary( value )
-
-		while self.operator( [ "+", "-" ] ):
-			oper = self.value
-			value = oper.binary( value, self.term() )
-
-		return value
-
-	def term( self ):
-		value = self.factor()
-
-		while self.operator( [ "*", "/", "//" ] ):
-			oper = self.value
-			value = oper.binary( value, self.factor() )
-
-		return value
-
-	def factor( self ):
-		# This one is right associative :(
-		bases = [ self.base() ]
-		while self.operator( [ "**" ] ):
-			bases.append( self.base() )
-
-		ret = bases[ -1 ]
-		for i in range( 1, len( bases ) ):
-			ret = bases[ len( bases ) - i - 1 ] ** ret
-
-		return ret
-
-	def base( self ):
-		if self.next_val( "name" ):
-			name = self.value
-			if self.next_is( "(" ):
-				args = [ self.expression() ]
-				while self.next_is( "," ):
-					args.append( self.expression() )
-				self.next_must( ")" )
-				return self.function( name, args )
-			else:
-				return self.variable( name )
-
-		if self.next_val( "float" ):
-			return self.value
-
-		if self.next_val( "integer" ):
-			return self.value
-
-		if self.next_is( "(" ):
-			value = self.expression()
-			self.next_must( ")" )
+		value = await asynchronous.evaluate( tree, self.cast( Scope( ( values, ), scope.func_cbs ), tree ) )
+		if out is None:
 			return value
 
-		self.error()
+		out[ ... ] = value
+		return out
+
+	def blocked( self, var = None, func = None, out = None, chunk_size = None, threads = None, executor = None ):
+		'''
+		Evaluate the expression over NumPy arrays chunk by chunk, so that intermediate results stay in the CPU cache.
+
+		The chunks have `chunk_size' elements, or a size suited to the cache if it is None.
+		They are evaluated concurrently by the concurrent.futures `executor' if given, or else by `threads' threads.
+		This requires all the functions of the expression to work element-wise, and to be thread-safe for concurrent evaluation.
+		'''
+
+		if not metrics.active is None:
+			return metrics.active.evaluate( self.expr, self._blocked, var, func, out, chunk_size, threads, executor )
+		return self._blocked( var, func, out, chunk_size, threads, executor )
+
+	def _blocked( self, var, func, out, chunk_size, threads, executor ):
+		from . import blocked
+		scope = self.scope( var, func )
+		tree = self.select( scope )
+		return blocked.evaluate( tree, self.cast( scope, tree ), out = out, chunk_size = chunk_size, threads = threads, executor = executor )
 
-	def function( self, name, args ):
-		for cb in self.func_cbs:
-			try:
-				return cb( name, args )
-			except exception.NoFuncException:
-				continue
+	def parallel( self, var = None, func = None, out = None, pool = None ):
+		'''
+		Evaluate the expression over NumPy arrays with several processes, each computing a part of the result.
 
-		raise exception.NoFuncException( name )
+		The processes are those of `pool', a maexpa.parallel.ProcessPool, or of a pool with one process per core if it is None; they are kept alive between evaluations.
+		This requires all the functions of the expression to work element-wise and to be picklable.
+		Arrays allocated with the pool's empty() method, as variables or as `out', are used in place rather than copied to and from shared memory.
+		'''
 
-	def variable( self, name ):
-		for cb in self.var_cbs:
-			try:
-				return cb( name )
-			except exception.NoVarException:
-				continue
+		if not metrics.active is None:
+			return metrics.active.evaluate( self.expr, self._parallel, var, func, out, pool )
+		return self._parallel( var, func, out, pool )
+
+	def _parallel( self, var, func, out, pool ):
+		from . import parallel
+		if pool is None:
+			pool = parallel.default_pool()
+		scope = self.scope( var, func )
+		tree = self.select( scope )
+		return pool.evaluate( tree, self.cast( scope, tree ), out = out )
+
+	def profile( self, var = None, func = None, number = 1 ):
+		'''
+		Evaluate the expression `number' times while measuring the wall time, the number of calls and the size of the result of each variable lookup, function call and operator.
+
+		Returns a maexpa.profiling.Profile, whose entries give the column of the expression where each operation appears; str() of it writes them as a table.
+		The tree is evaluated node by node whatever the backend, so that the time of each operation can be measured separately.
+		If the expression has a type, the variables are retrieved and converted once before the measured evaluations, so that their entries only time reading the converted values.
+		'''
+
+		from . import profiling
+		scope = self.scope( var, func )
+		tree = self.select( scope )
+		return profiling.evaluate( tree, self.cast( scope, tree ), number )
+
+	def scope( self, var = None, func = None ):
+		'''
+		Create the call-local scope for one evaluation, with the `var' and `func' callbacks taking precedence over the ones of the expression.
+		'''
+
+		return Scope( () if var is None else ( var, ), () if func is None else ( func, ) )
+
+	def select( self, scope ):
+		'''
+		Get the tree to evaluate with `scope': the optimized tree, unless a namespace of `scope' provides a name that folding or rewriting removed or added, or with `overrides', a callback of `scope' may provide it.
+		'''
+
+		if self.plain is None or not scope.overrides( self.names, self.overrides ):
+			return self.tree
+		return self.plain
+
+	def cast( self, scope, tree = None ):
+		'''
+		Get a scope providing the variables of `tree', by default the optimized tree, retrieved with `scope' and converted to the type of the expression, or `scope' itself if the expression has no type.
+		'''
+
+		if self.dtype is None:
+			return scope
+
+		from . import dtypes
+		return dtypes.cast_variables( self.tree if tree is None else tree, scope, self.dtype )
+
+	def bind( self, **values ):
+		'''
+		Create a new expression where the variables given as keyword arguments are replaced by their value.
+
+		The parts of the expression that only depend on these values are computed once here, so that only the remaining variables are retrieved when evaluating the new expression.
+		'''
+
+		bound = []
+		def replace( node ):
+			if isinstance( node, nodes.NodeVariable ) and node.name in values:
+				bound.append( nodes.NodeLiteral( node.get_column(), values[ node.name ] ) )
+				return bound[ -1 ]
+			return None
+
+		obj = copy.copy( self )
+		# Folding and rewriting are run again from the tree without them
+		obj.tree = nodes.copy_tree( self.tree if self.plain is None else self.plain, replace )
+		obj.optimize( bound )
 
-		raise exception.NoVarException( name )
+		return obj
+
+	def shared( self ):
+		'''
+		Get the text of the subtrees that appear more than once in the expression and are evaluated only once per evaluation.
+		'''
+
+		return [ str( node ) for node in cse.shared( self.tree ) ]
+
+	def variables( self ):
+		'''
+		Get the set of the names of the variables that the evaluation of the expression uses.
+
+		Variables replaced by bind() or removed by constant folding are not included.
+		'''
+
+		return nodes.variables( self.tree )
+
+	def functions( self ):
+		'''
+		Get the set of the functions that the evaluation of the expression calls, as tuples of the name and of the number of arguments.
+
+		Calls removed by constant folding are not included.
+		'''
+
+		return nodes.functions( self.tree )
+
+	def lambdify( self, *params ):
+		'''
+		Generate a native Python function computing this expression.
+
+		The arguments of the function are the variables named in `params', or if none is given, all the variables that the callbacks cannot provide.
+		'''
+
+		return codegen.lambdify( self, list( params ) if params else None )
+
+	def function( self, name, args ):
+		return namespace.call_function( self.func_cbs, name, args )
+
+	def variable( self, name ):
+		return namespace.get_variable( self.var_cbs, name )
+
+def _rebuild( expr, var_cbs, func_cbs, fold, backend, flat, dtype = None, rewrite = None, plain = None, names = frozenset(), overrides = False ):
+	'''
+	Create an expression from its compiled tree, when unpickling.
+	'''
+
+	obj = Expression.__new__( Expression )
+	obj.expr = expr
+	# Only needed to build the tree
+	obj.tokens = None
+	obj.var_cbs = var_cbs
+	obj.func_cbs = func_cbs
+	obj.fold = fold
+	obj.rewrite = rewrite
+	obj.overrides = overrides
+	obj.backend = backend
+	obj.dtype = dtype
+	obj.tree = nodes.unflatten( flat )
+	obj.plain = None if plain is None else nodes.unflatten( plain )
+	obj.names = names
+
+	obj.program = None
+	obj.plain_program = None
+	if backend == "vm":
+		from . import vm
+		obj.program = vm.compile( obj.tree )
+		obj.plain_program = None if obj.plain is None else vm.compile( obj.plain )
+
+	return obj
@@ -0,0 +1,94 @@
+# Evaluation of several expressions at once for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import cse, metrics, nodes
+from .expression import Expression, Scope
+
+class ExpressionSet( object ):
+	"""
+	Several expressions evaluated together against the same variables.
+
+	Subexpressions common to several expressions are only evaluated once, and each variable is retrieved only once per evaluation.
+	"""
+
+	def __init__( self, exprs, var = None, func = None, fold = True, overrides = False ):
+		'''
+		Compile `exprs', which is either a dict mapping names to the text of the expressions, or a list of texts in which case they are their own name.
+		'''
+
+		if not hasattr( exprs, "items" ):
+			exprs = { expr: expr for expr in exprs }
+
+		names = list( exprs.keys() )
+		compiled = [ Expression( exprs[ name ], var = var, func = func, fold = fold, overrides = overrides ) for name in names ]
+
+		self.exprs = dict( exprs )
+		# Key of the set in the metrics
+		self.expr = "; ".join( exprs[ name ] for name in names )
+		self.trees = dict( zip( names, cse.eliminate( [ obj.tree for obj in compiled ] ) ) )
+
+		# Trees without folding, for callbacks at evaluation that provide folded names
+		self.overrides = overrides
+		self.names = frozenset().union( *[ obj.names for obj in compiled ] )
+		self.plain = None
+		if self.names:
+			self.plain = dict( zip( names, cse.eliminate( [ nodes.copy_tree( obj.tree if obj.plain is None else obj.plain ) for obj in compiled ] ) ) )
+
+	def __call__( self, var = None, func = None ):
+		'''
+		Evaluate all the expressions, returning a dict mapping their name to their value.
+		'''
+
+		if not metrics.active is None:
+			return metrics.active.evaluate( self.expr, self._evaluate, var, func )
+		return self._evaluate( var, func )
+
+	def _evaluate( self, var, func ):
+		scope = Scope( () if var is None else ( var, ), () if func is None else ( func, ) )
+
+		trees = self.plain if not self.plain is None and scope.overrides( self.names, self.overrides ) else self.trees
+
+		return { name: tree.evaluate( scope ) for name, tree in trees.items() }
+
+	def __len__( self ):
+		return len( self.trees )
+
+	def variables( self ):
+		'''
+		Get the set of the names of the variables that the evaluation of any of the expressions uses.
+		'''
+
+		return set().union( *[ nodes.variables( tree ) for tree in self.trees.values() ] )
+
+	def functions( self ):
+		'''
+		Get the set of the functions that the evaluation of any of the expressions calls, as tuples of the name and of the number of arguments.
+		'''
+
+		return set().union( *[ nodes.functions( tree ) for tree in self.trees.values() ] )
+
+	def shared( self ):
+		'''
+		Get the text of the subtrees that are evaluated only once per evaluation although they appear several times.
+		'''
+
+		found = []
+		for tree in self.trees.values():
+			for node in cse.shared( tree ):
+				if not node in found:
+					found.append( node )
+
+		return [ str( node ) for node in found ]
@@ -0,0 +1,79 @@
+# Constant folding for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import namespace, nodes
+
+def _fold_node( node, folded, fixed ):
+	if isinstance( node, nodes.NodeLiteral ):
+		return node
+
+	if isinstance( node, nodes.NodeShared ):
+		# A shared constant is no longer worth sharing
+		return node.node if isinstance( node.node, nodes.NodeLiteral ) else node
+
+	if isinstance( node, nodes.NodeVariable ):
+		if fixed is None and namespace.is_const( node.providers, node.name ):
+			folded.add( node.name )
+			return nodes.NodeLiteral( node.get_column(), node.getter() )
+		return node
+
+	if not all( isinstance( child, nodes.NodeLiteral ) for child in node.children() ):
+		return node
+
+	values = [ child.value for child in node.children() ]
+
+	try:
+		if isinstance( node, nodes.NodeCall ):
+			if not namespace.is_pure( node.providers, node.name ):
+				return node
+			if not fixed is None and not any( child in fixed for child in node.children() ):
+				return node
+			value = node.impl( *values )
+		else:
+			value = node.func( *values )
+	except Exception:
+		# Leave the error to be raised at evaluation, as it would have been without folding
+		return node
+
+	if isinstance( node, nodes.NodeCall ) and fixed is None:
+		folded.add( node.name )
+
+	new = nodes.NodeLiteral( node.get_column(), value )
+	if not fixed is None and any( child in fixed for child in node.children() ):
+		fixed.add( new )
+	return new
+
+def fold( root, folded = None, fixed = None ):
+	"""
+	Replace the subtrees of the tree starting at `root' whose value is known at compile time with literals.
+
+	This covers operators applied to literals, constants provided by namespaces (see namespace.is_const) and pure functions called with literals.
+	The tree is modified in place; the new root is returned.
+	If `folded' is given, the names of the variables and functions replaced by their value are added to this set.
+
+	If `fixed' is given, it is a set of literals whose value cannot be replaced at evaluation, such as those set by Expression.bind(), and only the names that callbacks cannot replace are folded: the operators applied to literals, and the pure functions called with at least one of these literals or of the literals computed from them, which are added to `fixed'.
+	"""
+
+	if folded is None:
+		folded = set()
+
+	memo = {}
+
+	for node in nodes.postorder( root ):
+		node.set_children( [ memo[ child ] for child in node.children() ] )
+		memo[ node ] = _fold_node( node, folded, fixed )
+
+	return memo[ root ]
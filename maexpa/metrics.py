@@ -0,0 +1,218 @@
+# Runtime metrics for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Metrics are off by default. The instrumented code only checks whether `active' is None, so that there is close to no cost when they are disabled.
+# Once enabled, the following are counted until reset() is called:
+# - the evaluations of each expression, with their total time, whether through Expression.__call__, evaluate_async(), blocked() or parallel();
+#   those of an ExpressionSet are counted once for the whole set, under the texts of its expressions joined by "; ";
+# - the latency of the variable lookups and function calls, by name, as histograms, whether they are provided by callbacks or by namespaces such as the libraries;
+#   only the callback or namespace that provides the name is measured, not those that were asked before it, and constants removed by folding are not looked up;
+# - the exceptions raised by the evaluations and by the parsing of expressions, by type;
+# - the hits and misses of the caches of compiled expressions, such as maexpa.compile.
+
+import threading
+import time
+
+from . import exception
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+buckets = ( 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1., float( "inf" ) )
+
+class Histogram( object ):
+	"""
+	Distribution of durations over fixed buckets.
+	"""
+
+	def __init__( self ):
+		self.counts = [ 0 ] * len( buckets )
+		self.total = 0.
+
+	def add( self, value ):
+		for index, bound in enumerate( buckets ):
+			if value <= bound:
+				self.counts[ index ] += 1
+				break
+		self.total += value
+
+	def snapshot( self ):
+		"""
+		Get the histogram as a dict with the number of values, their sum, and the cumulative count of each bucket as tuples of the upper bound and of the count.
+		"""
+
+		cumulative = []
+		count = 0
+		for bound, value in zip( buckets, self.counts ):
+			count += value
+			cumulative.append( ( bound, count ) )
+
+		return { "count": count, "sum": self.total, "buckets": cumulative }
+
+class Registry( object ):
+	"""
+	Storage of the metrics, safe to update from several threads.
+	"""
+
+	def __init__( self ):
+		self._lock = threading.Lock()
+		self.reset()
+
+	def reset( self ):
+		with self._lock:
+			self.expressions = {}
+			self.variables = {}
+			self.functions = {}
+			self.exceptions = {}
+			self.cache_hits = 0
+			self.cache_misses = 0
+
+	def evaluate( self, expr, func, *args ):
+		"""
+		Call `func' with `args' to evaluate the expression of text `expr', counting the evaluation, its time and its exception if any.
+		"""
+
+		start = time.perf_counter()
+		try:
+			return func( *args )
+		except Exception as exc:
+			self.exception( exc )
+			with self._lock:
+				self.expressions.setdefault( expr, [ 0, 0., 0 ] )[ 2 ] += 1
+			raise
+		finally:
+			elapsed = time.perf_counter() - start
+			with self._lock:
+				entry = self.expressions.setdefault( expr, [ 0, 0., 0 ] )
+				entry[ 0 ] += 1
+				entry[ 1 ] += elapsed
+
+	async def evaluate_async( self, expr, func, *args ):
+		"""
+		Await coroutine function `func' with `args' to evaluate the expression of text `expr', counting it as evaluate() does.
+		"""
+
+		start = time.perf_counter()
+		try:
+			return await func( *args )
+		except Exception as exc:
+			self.exception( exc )
+			with self._lock:
+				self.expressions.setdefault( expr, [ 0, 0., 0 ] )[ 2 ] += 1
+			raise
+		finally:
+			elapsed = time.perf_counter() - start
+			with self._lock:
+				entry = self.expressions.setdefault( expr, [ 0, 0., 0 ] )
+				entry[ 0 ] += 1
+				entry[ 1 ] += elapsed
+
+	def exception( self, exc ):
+		"""
+		Count exception `exc' by its type.
+		"""
+
+		with self._lock:
+			name = type( exc ).__name__
+			self.exceptions[ name ] = self.exceptions.get( name, 0 ) + 1
+
+	def callback( self, kind, name, cb, *args ):
+		"""
+		Call callback `cb' with `args' for the variable or function, according to `kind', `name', recording its latency.
+
+		Nothing is recorded if the callback does not provide the name, that is if it raises a NoVarException or a NoFuncException.
+		"""
+
+		start = time.perf_counter()
+		try:
+			return cb( *args )
+		except ( exception.NoVarException, exception.NoFuncException ):
+			start = None
+			raise
+		finally:
+			if not start is None:
+				self.record( kind, name, time.perf_counter() - start )
+
+	def record( self, kind, name, elapsed ):
+		"""
+		Add duration `elapsed' to the latency of the variable or function, according to `kind', `name'.
+		"""
+
+		table = self.variables if kind == "variable" else self.functions
+		with self._lock:
+			if not name in table:
+				table[ name ] = Histogram()
+			table[ name ].add( elapsed )
+
+	def cache( self, hit ):
+		with self._lock:
+			if hit:
+				self.cache_hits += 1
+			else:
+				self.cache_misses += 1
+
+	def snapshot( self ):
+		with self._lock:
+			lookups = self.cache_hits + self.cache_misses
+			return {
+				"expressions": { expr: { "evaluations": count, "time": total, "errors": errors } for expr, ( count, total, errors ) in self.expressions.items() },
+				"variables": { name: hist.snapshot() for name, hist in self.variables.items() },
+				"functions": { name: hist.snapshot() for name, hist in self.functions.items() },
+				"exceptions": dict( self.exceptions ),
+				"cache": { "hits": self.cache_hits, "misses": self.cache_misses, "hit_rate": self.cache_hits / lookups if lookups > 0 else None },
+			}
+
+_registry = Registry()
+
+# The registry while the metrics are enabled, None otherwise
+active = None
+
+def enable():
+	"""
+	Start recording the metrics, adding to those already recorded.
+	"""
+
+	global active
+	active = _registry
+
+def disable():
+	"""
+	Stop recording the metrics; those already recorded are kept until reset() is called.
+	"""
+
+	global active
+	active = None
+
+def is_enabled():
+	"""
+	Whether the metrics are being recorded.
+	"""
+
+	return not active is None
+
+def stats():
+	"""
+	Get a snapshot of the recorded metrics as a dict.
+
+	It has an "expressions" entry mapping the text of each expression, or the texts of the expressions of a set joined by "; ", to its number of evaluations, their total time in seconds and the number of them that failed; a "variables" and a "functions" entry mapping each name to the histogram of the latency of its lookups or calls; an "exceptions" entry mapping the names of the types of exceptions raised by evaluations or by parsing to their number; and a "cache" entry with the hits, misses and hit rate of the caches of compiled expressions.
+	"""
+
+	return _registry.snapshot()
+
+def reset():
+	"""
+	Forget all the recorded metrics.
+	"""
+
+	_registry.reset()
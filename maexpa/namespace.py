@@ -0,0 +1,266 @@
+# Name resolution for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Variables and functions can be provided either by callbacks, which signal a missing name by raising an exception, or by namespaces.
+# A namespace is any mapping-like object supporting `name in ns' and `ns[ name ]'; for variables the latter is the value of the variable and for functions it is a callable receiving the arguments.
+# Namespaces may also provide an `arity( name )' method returning the number of arguments that a function expects, and a `pure( name )' method telling whether it always gives the same result for the same arguments.
+# Likewise, namespaces of variables may provide a `const( name )' method telling whether the value of a variable never changes.
+# Since a namespace can tell whether it knows a name without being asked for its value, names are resolved once when the expression is compiled.
+# Which names a namespace knows is therefore a snapshot taken at that time: a name added later is not seen until the expression is resolved again, while a variable removed later is reported with a NoVarException as if it had never been there.
+
+from . import exception, metrics
+
+def is_namespace( obj ):
+	"""
+	Whether `obj' follows the namespace protocol rather than the callback one.
+	"""
+	return hasattr( obj, "__contains__" )
+
+def resolve( cbs, name ):
+	"""
+	Get the providers among `cbs' that may provide `name'.
+
+	Namespaces that do not know `name' are skipped, and the search stops at the first namespace that knows it since it will always be the one providing it.
+	"""
+
+	providers = []
+
+	for cb in cbs:
+		if is_namespace( cb ):
+			if name in cb:
+				providers.append( cb )
+				break
+		else:
+			providers.append( cb )
+
+	return tuple( providers )
+
+def is_pure( providers, name ):
+	"""
+	Whether function `name' is known to always give the same result for the same arguments, according to the resolved `providers'.
+
+	This is only the case for functions provided by a namespace whose `pure( name )' method says so; callbacks are assumed to be impure.
+	"""
+
+	if len( providers ) == 1 and is_namespace( providers[ 0 ] ) and hasattr( providers[ 0 ], "pure" ):
+		return bool( providers[ 0 ].pure( name ) )
+
+	return False
+
+def is_const( providers, name ):
+	"""
+	Whether variable `name' is known to never change, according to the resolved `providers'.
+
+	This is only the case for variables provided by a namespace whose `const( name )' method says so.
+	"""
+
+	if len( providers ) == 1 and is_namespace( providers[ 0 ] ) and hasattr( providers[ 0 ], "const" ):
+		return bool( providers[ 0 ].const( name ) )
+
+	return False
+
+def library_of( providers ):
+	"""
+	Get the name of the library of maexpa whose namespace is the only one of the resolved `providers', or None if there is no such library.
+	"""
+
+	if len( providers ) == 1 and isinstance( providers[ 0 ], ( Variables, Functions ) ):
+		return providers[ 0 ]._library
+
+	return None
+
+def get_variable( cbs, name ):
+	"""
+	Get the value of variable `name' from the first of `cbs' that provides it.
+	"""
+
+	for cb in cbs:
+		# Inlined is_namespace(), this is on the hot path
+		if hasattr( cb, "__contains__" ):
+			if name in cb:
+				if metrics.active is None:
+					return cb[ name ]
+				return metrics.active.callback( "variable", name, cb.__getitem__, name )
+		else:
+			try:
+				if metrics.active is None:
+					return cb( name )
+				return metrics.active.callback( "variable", name, cb, name )
+			except exception.NoVarException:
+				continue
+
+	raise exception.NoVarException( name )
+
+def check_arity( ns, name, nargs ):
+	"""
+	Raise a FuncArgsNumException if namespace `ns' knows that function `name' does not take `nargs' arguments.
+	"""
+
+	if hasattr( ns, "arity" ):
+		expected = ns.arity( name )
+		if not expected is None and expected != nargs:
+			raise exception.FuncArgsNumException( name, expected, nargs )
+
+def call_function( cbs, name, args ):
+	"""
+	Call function `name' with `args' through the first of `cbs' that provides it.
+	"""
+
+	for cb in cbs:
+		if is_namespace( cb ):
+			if name in cb:
+				check_arity( cb, name, len( args ) )
+				if metrics.active is None:
+					return cb[ name ]( *args )
+				return metrics.active.callback( "function", name, cb[ name ], *args )
+		else:
+			try:
+				if metrics.active is None:
+					return cb( name, args )
+				return metrics.active.callback( "function", name, cb, name, args )
+			except exception.NoFuncException:
+				continue
+
+	raise exception.NoFuncException( name )
+
+def variable_getter( providers, name ):
+	"""
+	Get a function without arguments returning the value of variable `name' from the resolved `providers'.
+	"""
+
+	if len( providers ) == 1 and is_namespace( providers[ 0 ] ):
+		ns = providers[ 0 ]
+
+		def getter():
+			try:
+				if metrics.active is None:
+					return ns[ name ]
+				return metrics.active.callback( "variable", name, ns.__getitem__, name )
+			except KeyError:
+				# Removed from the namespace since it was resolved, reported as when the namespace is searched
+				raise exception.NoVarException( name ) from None
+
+		return getter
+
+	return lambda: get_variable( providers, name )
+
+def function_impl( providers, name, nargs, eager = False, overrides = False ):
+	"""
+	Get a function implementing `name' with `nargs' arguments from the resolved `providers'.
+
+	A wrong number of arguments is reported immediately if the namespace providing the function knows it; with `overrides', it is raised when the returned function is called instead, since a callback passed at evaluation may still provide the function.
+	With `eager', a missing function is reported immediately as well; otherwise the error is raised when the returned function is called.
+	"""
+
+	if len( providers ) == 1 and is_namespace( providers[ 0 ] ):
+		try:
+			check_arity( providers[ 0 ], name, nargs )
+		except exception.FuncArgsNumException as exc:
+			if not overrides:
+				raise
+			error = exc
+			def fail( *args ):
+				raise error
+			return fail
+		return providers[ 0 ][ name ]
+
+	if eager and len( providers ) == 0:
+		raise exception.NoFuncException( name )
+
+	return lambda *args: call_function( providers, name, list( args ) )
+
+def library( name, kind ):
+	"""
+	Get the namespace of the variables or of the functions, according to `kind', of the library `name' as selected by maexpa.lib().
+	"""
+
+	if name == "std":
+		from . import callback_std as module
+	elif name == "numpy":
+		from . import callback_numpy as module
+	else:
+		raise Exception( "Invalid library name: {:s}".format( name ) )
+
+	return getattr( module, kind )
+
+class Variables( object ):
+	"""
+	Namespace of variables backed by a dict of definitions, each having a "value" and optionally a "const" entry.
+
+	Instances can also be used as a variable callback.
+	If `library' is given, the instance is the namespace of that library of maexpa and it is pickled by name.
+	"""
+
+	def __init__( self, defs, library = None ):
+		self._defs = defs
+		self._library = library
+
+	def __reduce_ex__( self, protocol ):
+		if self._library is None:
+			return object.__reduce_ex__( self, protocol )
+		return ( library, ( self._library, "variables" ) )
+
+	def __contains__( self, name ):
+		return name in self._defs
+
+	def __getitem__( self, name ):
+		return self._defs[ name ][ "value" ]
+
+	def const( self, name ):
+		return self._defs[ name ].get( "const", False )
+
+	def __call__( self, name ):
+		if not name in self._defs:
+			raise exception.NoVarException( name )
+
+		return self._defs[ name ][ "value" ]
+
+class Functions( object ):
+	"""
+	Namespace of functions backed by a dict of definitions, each having a "func" and an "args" entry.
+
+	Instances can also be used as a function callback.
+	If `library' is given, the instance is the namespace of that library of maexpa and it is pickled by name.
+	"""
+
+	def __init__( self, defs, library = None ):
+		self._defs = defs
+		self._library = library
+
+	def __reduce_ex__( self, protocol ):
+		if self._library is None:
+			return object.__reduce_ex__( self, protocol )
+		return ( library, ( self._library, "functions" ) )
+
+	def __contains__( self, name ):
+		return name in self._defs
+
+	def __getitem__( self, name ):
+		return self._defs[ name ][ "func" ]
+
+	def arity( self, name ):
+		return self._defs[ name ][ "args" ]
+
+	def pure( self, name ):
+		return self._defs[ name ].get( "pure", False )
+
+	def __call__( self, name, args ):
+		if not name in self._defs:
+			raise exception.NoFuncException( name )
+
+		check_arity( self, name, len( args ) )
+
+		return self._defs[ name ][ "func" ]( *args )
@@ -0,0 +1,492 @@
+# Expression tree for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+from . import metrics, namespace, tokens
+
+class NodeBase( object ):
+	"""
+	Base class for nodes of the expression tree.
+	"""
+
+	__slots__ = ( "col", )
+
+	def __init__( self, col ):
+		self.col = col
+
+	def get_column( self ):
+		"""
+		Get the column (or character number) of the token that produced this node.
+		"""
+		return self.col
+
+	def children( self ):
+		"""
+		Get the list of the direct sub-nodes of this node.
+		"""
+		return []
+
+	def set_children( self, children ):
+		"""
+		Replace the direct sub-nodes of this node, in the same order as returned by children().
+		"""
+		pass
+
+	def evaluate( self, scope ):
+		"""
+		Compute the value of this node, using the callbacks of the given evaluation scope.
+		"""
+		raise NotImplementedError
+
+	def __str__( self ):
+		return format( self )
+
+class NodeLiteral( NodeBase ):
+	"""
+	Node representing a litteral number.
+	"""
+
+	__slots__ = ( "value", )
+
+	def __init__( self, col, value ):
+		NodeBase.__init__( self, col )
+		self.value = value
+
+	def __reduce__( self ):
+		return ( NodeLiteral, ( self.col, self.value ) )
+
+	def evaluate( self, scope ):
+		return self.value
+
+class NodeVariable( NodeBase ):
+	"""
+	Node representing a reference to a variable.
+	"""
+
+	__slots__ = ( "name", "providers", "getter" )
+
+	def __init__( self, col, name ):
+		NodeBase.__init__( self, col )
+		self.name = name
+		self.resolve( [] )
+
+	def resolve( self, cbs ):
+		"""
+		Find which of the callbacks or namespaces `cbs' can provide this variable.
+		"""
+		self.providers = namespace.resolve( cbs, self.name )
+		self.getter = namespace.variable_getter( self.providers, self.name )
+
+	def __getstate__( self ):
+		# The getter is rebuilt from the providers when unpickling
+		return ( self.col, self.name, self.providers )
+
+	def __setstate__( self, state ):
+		self.col, self.name, self.providers = state
+		self.getter = namespace.variable_getter( self.providers, self.name )
+
+	def evaluate( self, scope ):
+		if scope.var_cbs:
+			return scope.variable( self.name, self.providers )
+		return self.getter()
+
+class NodeCall( NodeBase ):
+	"""
+	Node representing a function call.
+	"""
+
+	__slots__ = ( "name", "args", "providers", "impl" )
+
+	def __init__( self, col, name, args ):
+		NodeBase.__init__( self, col )
+		self.name = name
+		self.args = args
+		self.resolve( [] )
+
+	def resolve( self, cbs, overrides = False ):
+		"""
+		Find which of the callbacks or namespaces `cbs' can provide this function.
+
+		A wrong number of arguments is reported immediately, unless `overrides' allows callbacks at evaluation to provide the function instead, see namespace.function_impl().
+		"""
+		self.providers = namespace.resolve( cbs, self.name )
+		self.impl = namespace.function_impl( self.providers, self.name, len( self.args ), overrides = overrides )
+
+	def __getstate__( self ):
+		# The implementation may be a wrapper that cannot be pickled; it is retrieved again from the providers
+		return ( self.col, self.name, self.args, self.providers )
+
+	def __setstate__( self, state ):
+		self.col, self.name, self.args, self.providers = state
+		# The number of arguments was already checked when the tree was built, if it had to be
+		self.impl = namespace.function_impl( self.providers, self.name, len( self.args ), overrides = True )
+
+	def children( self ):
+		return self.args
+
+	def set_children( self, children ):
+		self.args = list( children )
+
+	def call( self, scope, args ):
+		"""
+		Call the function with the already evaluated arguments `args'.
+		"""
+		if scope.func_cbs:
+			return scope.function( self.name, args, self.providers )
+		if metrics.active is None or len( self.providers ) != 1 or not namespace.is_namespace( self.providers[ 0 ] ):
+			# Otherwise the implementation goes through namespace.call_function(), which records the call
+			return self.impl( *args )
+		return metrics.active.callback( "function", self.name, self.impl, *args )
+
+	def evaluate( self, scope ):
+		return self.call( scope, [ arg.evaluate( scope ) for arg in self.args ] )
+
+class NodeUnary( NodeBase ):
+	"""
+	Node representing an unary operator.
+	"""
+
+	__slots__ = ( "op", "func", "operand" )
+
+	def __init__( self, col, op, operand ):
+		NodeBase.__init__( self, col )
+		self.op = op
+		self.func = tokens.TokenOperator._map[ op ][ 1 ]
+		self.operand = operand
+
+	def __reduce__( self ):
+		return ( NodeUnary, ( self.col, self.op, self.operand ) )
+
+	def children( self ):
+		return [ self.operand ]
+
+	def set_children( self, children ):
+		self.operand, = children
+
+	def evaluate( self, scope ):
+		return self.func( self.operand.evaluate( scope ) )
+
+class NodeBinary( NodeBase ):
+	"""
+	Node representing a binary operator.
+	"""
+
+	__slots__ = ( "op", "func", "left", "right" )
+
+	def __init__( self, col, op, left, right ):
+		NodeBase.__init__( self, col )
+		self.op = op
+		self.func = tokens.TokenOperator._map[ op ][ 0 ]
+		self.left = left
+		self.right = right
+
+	def __reduce__( self ):
+		return ( NodeBinary, ( self.col, self.op, self.left, self.right ) )
+
+	def children( self ):
+		return [ self.left, self.right ]
+
+	def set_children( self, children ):
+		self.left, self.right = children
+
+	def evaluate( self, scope ):
+		left = self.left
+		if not type( left ) is NodeBinary:
+			return self.func( left.evaluate( scope ), self.right.evaluate( scope ) )
+
+		# Chains such as a+b+c+... are evaluated without recursing down the left operands, so that their length is not limited by the recursion limit
+		chain = [ self ]
+		while type( left ) is NodeBinary:
+			chain.append( left )
+			left = left.left
+
+		value = left.evaluate( scope )
+		for node in reversed( chain ):
+			value = node.func( value, node.right.evaluate( scope ) )
+		return value
+
+class NodeShared( NodeBase ):
+	"""
+	Node wrapping a subtree that appears several times in the expression, so that it is evaluated only once per evaluation.
+	"""
+
+	__slots__ = ( "node", )
+
+	def __init__( self, node ):
+		NodeBase.__init__( self, node.get_column() )
+		self.node = node
+
+	def __reduce__( self ):
+		return ( NodeShared, ( self.node, ) )
+
+	def children( self ):
+		return [ self.node ]
+
+	def set_children( self, children ):
+		self.node, = children
+
+	def evaluate( self, scope ):
+		memo = scope.memo
+		if self in memo:
+			return memo[ self ]
+
+		value = self.node.evaluate( scope )
+		memo[ self ] = value
+		return value
+
+# Precedence of the operators when writing an expression, from loosest to tightest binding
+_prec = {
+	"+": 1,
+	"-": 1,
+	"*": 2,
+	"/": 2,
+	"//": 2,
+	"unary": 3,
+	"**": 4,
+	"atom": 5,
+}
+
+def _leaf( node ):
+	if isinstance( node, NodeShared ):
+		return None
+
+	if isinstance( node, NodeLiteral ):
+		value = node.value
+		if hasattr( value, "shape" ) and value.shape == ():
+			# NumPy scalar
+			value = value.item()
+		if isinstance( value, float ):
+			return float.__repr__( value )
+		if isinstance( value, int ):
+			return int.__repr__( value )
+		if isinstance( value, complex ):
+			return complex.__repr__( value )
+		return "<{:s}>".format( type( value ).__name__ )
+
+	return node.name
+
+def format( node, leaf = _leaf ):
+	"""
+	Write the tree starting at `node' as text, with only the necessary parentheses.
+
+	The text of literals and variables, and the name of called functions, is given by `leaf', which receives the node; by default the value or name is used as is.
+	`leaf' also receives the shared nodes, and may return None to have the shared subtree written out.
+	"""
+
+	texts = {}
+
+	# Explicit stack rather than recursion, so that the depth of the tree is not limited
+	stack = [ ( node, False ) ]
+	while stack:
+		current, ready = stack.pop()
+
+		if current in texts:
+			continue
+
+		if ready:
+			texts[ current ] = _format( current, leaf, [ texts[ child ] for child in current.children() ] )
+			continue
+
+		if isinstance( current, NodeShared ):
+			text = leaf( current )
+			if not text is None:
+				texts[ current ] = ( text, _prec[ "atom" ] )
+				continue
+
+		stack.append( ( current, True ) )
+		stack.extend( ( child, False ) for child in reversed( current.children() ) )
+
+	return texts[ node ][ 0 ]
+
+def _format( node, leaf, children ):
+	"""
+	Write `node' as text, given the text and precedence of its children as tuples in `children'.
+	"""
+
+	if isinstance( node, NodeShared ):
+		return children[ 0 ]
+
+	if isinstance( node, ( NodeLiteral, NodeVariable ) ):
+		text = leaf( node )
+		# Negative numbers behave like an unary operator
+		return text, _prec[ "unary" ] if text.startswith( "-" ) else _prec[ "atom" ]
+
+	if isinstance( node, NodeCall ):
+		return "{:s}({:s})".format( leaf( node ), ", ".join( text for text, _ in children ) ), _prec[ "atom" ]
+
+	if isinstance( node, NodeUnary ):
+		text, prec = children[ 0 ]
+		if prec < _prec[ "**" ]:
+			text = "(" + text + ")"
+		return node.op + text, _prec[ "unary" ]
+
+	if isinstance( node, NodeBinary ):
+		prec = _prec[ node.op ]
+		( left, left_prec ), ( right, right_prec ) = children
+		if node.op == "**":
+			# Right associative
+			if left_prec <= prec:
+				left = "(" + left + ")"
+			if right_prec < prec:
+				right = "(" + right + ")"
+		else:
+			if left_prec < prec:
+				left = "(" + left + ")"
+			if right_prec <= prec:
+				right = "(" + right + ")"
+		return "{:s} {:s} {:s}".format( left, node.op, right ), prec
+
+	raise TypeError( "Unknown node type {:s}".format( type( node ).__name__ ) )
+
+def copy_tree( root, replace = None ):
+	"""
+	Copy the tree starting at `root', keeping its shared subtrees shared.
+
+	If given, `replace' is called with each node of the original tree before it is copied, and its return value is used instead of the copy unless it is None.
+	"""
+
+	memo = {}
+	pending = set()
+
+	# Explicit stack rather than recursion, so that the depth of the tree is not limited
+	stack = [ ( root, False ) ]
+	while stack:
+		node, ready = stack.pop()
+
+		if ready:
+			new = copy.copy( node )
+			new.set_children( [ memo[ child ] for child in node.children() ] )
+			memo[ node ] = new
+			continue
+
+		if node in memo or node in pending:
+			continue
+
+		new = None if replace is None else replace( node )
+		if not new is None:
+			memo[ node ] = new
+			continue
+
+		pending.add( node )
+		stack.append( ( node, True ) )
+		stack.extend( ( child, False ) for child in reversed( node.children() ) )
+
+	return memo[ root ]
+
+def postorder( root ):
+	"""
+	Iterate over the distinct nodes of the tree starting at `root', children first and from left to right.
+	"""
+
+	seen = set()
+	stack = [ ( root, False ) ]
+	while stack:
+		node, ready = stack.pop()
+		if ready:
+			yield node
+		elif not node in seen:
+			seen.add( node )
+			stack.append( ( node, True ) )
+			stack.extend( ( child, False ) for child in reversed( node.children() ) )
+
+def flatten( root ):
+	"""
+	Get a flat description of the tree starting at `root', as a list of tuples each describing a node, with its children given by their position in the list.
+
+	Unlike the tree itself, this can be pickled whatever the depth of the tree.
+	"""
+
+	index = {}
+	flat = []
+
+	for node in postorder( root ):
+		children = tuple( index[ child ] for child in node.children() )
+
+		if isinstance( node, NodeLiteral ):
+			item = ( "literal", node.col, node.value )
+		elif isinstance( node, NodeVariable ):
+			item = ( "variable", node.col, node.name, node.providers )
+		elif isinstance( node, NodeCall ):
+			item = ( "call", node.col, node.name, node.providers, children )
+		elif isinstance( node, NodeUnary ):
+			item = ( "unary", node.col, node.op, children )
+		elif isinstance( node, NodeBinary ):
+			item = ( "binary", node.col, node.op, children )
+		elif isinstance( node, NodeShared ):
+			item = ( "shared", children )
+		else:
+			raise TypeError( "Unknown node type {:s}".format( type( node ).__name__ ) )
+
+		index[ node ] = len( flat )
+		flat.append( item )
+
+	return flat
+
+def unflatten( flat ):
+	"""
+	Build the tree described by `flat', as returned by flatten(), and return its root.
+	"""
+
+	built = []
+
+	for item in flat:
+		kind = item[ 0 ]
+
+		if kind == "literal":
+			node = NodeLiteral( item[ 1 ], item[ 2 ] )
+		elif kind == "variable":
+			node = NodeVariable.__new__( NodeVariable )
+			node.__setstate__( ( item[ 1 ], item[ 2 ], item[ 3 ] ) )
+		elif kind == "call":
+			node = NodeCall.__new__( NodeCall )
+			node.__setstate__( ( item[ 1 ], item[ 2 ], [ built[ idx ] for idx in item[ 4 ] ], item[ 3 ] ) )
+		elif kind == "unary":
+			node = NodeUnary( item[ 1 ], item[ 2 ], built[ item[ 3 ][ 0 ] ] )
+		elif kind == "binary":
+			node = NodeBinary( item[ 1 ], item[ 2 ], built[ item[ 3 ][ 0 ] ], built[ item[ 3 ][ 1 ] ] )
+		else:
+			node = NodeShared( built[ item[ 1 ][ 0 ] ] )
+
+		built.append( node )
+
+	# The root comes last
+	return built[ -1 ]
+
+def walk( node ):
+	"""
+	Iterate over all the nodes of the tree starting at `node', parents first.
+	"""
+
+	stack = [ node ]
+	while stack:
+		node = stack.pop()
+		yield node
+		stack.extend( reversed( node.children() ) )
+
+def variables( root ):
+	"""
+	Get the set of the names of the variables of the tree starting at `root'.
+	"""
+
+	return { node.name for node in walk( root ) if isinstance( node, NodeVariable ) }
+
+def functions( root ):
+	"""
+	Get the set of the functions called in the tree starting at `root', as tuples of the name and of the number of arguments.
+	"""
+
+	return { ( node.name, len( node.args ) ) for node in walk( root ) if isinstance( node, NodeCall ) }
@@ -0,0 +1,282 @@
+# Multi-process evaluation over shared memory for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# A single process only uses one core, however large the arrays the expression is evaluated over.
+# Here the flattened broadcast index is cut into as many parts as there are worker processes, and each part is evaluated by a worker of a pool.
+# The inputs and the result are stored in shared memory blocks, so that only the names of the blocks go through pickling, not the data.
+# Arrays allocated with ProcessPool.empty() already are in shared memory: they are used in place, whereas other arrays are copied into blocks by the calling process.
+# The tree of the expression is pickled once per evaluation; the functions it calls must therefore be picklable, which is the case of NumPy's ufuncs.
+
+import atexit
+import concurrent.futures
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+
+import numpy
+
+try:
+	from multiprocessing import shared_memory
+except ImportError:
+	# Python before 3.8: the evaluation stays in the calling process
+	shared_memory = None
+
+from . import blocked, buffers, nodes
+from .expression import Scope
+
+def _address( value ):
+	return value.__array_interface__[ "data" ][ 0 ]
+
+def _bounds( value ):
+	"""
+	Get the range of addresses of the memory holding the elements of array `value'.
+	"""
+
+	low = high = _address( value )
+	if value.size == 0:
+		return low, high
+
+	for dim, stride in zip( value.shape, value.strides ):
+		if stride < 0:
+			low += stride * ( dim - 1 )
+		else:
+			high += stride * ( dim - 1 )
+
+	return low, high + value.itemsize
+
+def _run( tree, func_cbs, values, shape, out, sl ):
+	values = { name: numpy.broadcast_to( value, shape )[ sl ] if isinstance( value, numpy.ndarray ) else value for name, value in values.items() }
+
+	blocked.evaluate( tree, Scope( ( values, ), func_cbs ), out = out[ sl ] )
+
+def _work( payload, func_cbs, arrays, scalars, shape, result, sl ):
+	"""
+	Evaluate the pickled tree `payload' over part `sl' of the arrays, in a worker process.
+
+	The arrays and the result are given as tuples of the name of their block, the offset of their first element in it, their shape, their strides, which are None for C order, and their type.
+	"""
+
+	tree = nodes.unflatten( pickle.loads( payload ) )
+
+	blocks = {}
+	def attach( spec ):
+		name, offset, array_shape, strides, dtype = spec
+		if not name in blocks:
+			blocks[ name ] = shared_memory.SharedMemory( name = name )
+		return numpy.ndarray( array_shape, dtype, buffer = blocks[ name ].buf, offset = offset, strides = strides )
+
+	try:
+		values = dict( scalars )
+		for name, spec in arrays.items():
+			values[ name ] = attach( spec )
+
+		_run( tree, func_cbs, values, shape, attach( result ), sl )
+	finally:
+		# The arrays must be gone before the blocks can be closed
+		values = None
+		for block in blocks.values():
+			try:
+				block.close()
+			except BufferError:
+				# Still used by the traceback of an error, the memory is released with it
+				pass
+
+def _detach( tree ):
+	"""
+	Copy the tree with its variables no longer bound to their providers, since their values are given to the workers.
+	"""
+
+	def replace( node ):
+		if isinstance( node, nodes.NodeVariable ):
+			return nodes.NodeVariable( node.get_column(), node.name )
+		return None
+
+	return nodes.copy_tree( tree, replace )
+
+class ProcessPool( object ):
+	"""
+	Pool of worker processes evaluating expressions over parts of NumPy arrays.
+
+	The processes are started when first needed and kept until close() is called, so that the same pool serves many evaluations.
+	They are started with the multiprocessing start method `context', by default "forkserver" where available and "spawn" otherwise, rather than by forking the calling process.
+	"""
+
+	def __init__( self, workers = None, context = None ):
+		self.workers = os.cpu_count() if workers is None else workers
+		# Processes forked from a process with threads may inherit locks held by these threads
+		if context is None:
+			context = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+		self.context = context
+		self._executor = None
+		self._lock = threading.Lock()
+		# Blocks allocated by empty(), with the address where they are mapped in this process
+		self._shared = []
+
+	def __enter__( self ):
+		return self
+
+	def __exit__( self, exc_type, exc_value, traceback ):
+		self.close()
+
+	def executor( self ):
+		'''
+		Get the executor of the pool, starting the processes if needed.
+		'''
+
+		with self._lock:
+			if self._executor is None:
+				if sys.version_info < ( 3, 7 ):
+					# No choice of the start method
+					self._executor = concurrent.futures.ProcessPoolExecutor( max_workers = self.workers )
+				else:
+					self._executor = concurrent.futures.ProcessPoolExecutor( max_workers = self.workers, mp_context = multiprocessing.get_context( self.context ) )
+			return self._executor
+
+	def close( self ):
+		'''
+		Stop the worker processes and release the arrays allocated by empty(). The pool starts new processes if it is used again.
+		'''
+
+		with self._lock:
+			if not self._executor is None:
+				self._executor.shutdown()
+				self._executor = None
+
+			for block, _ in self._shared:
+				try:
+					block.close()
+				except BufferError:
+					# Arrays still refer to it; the memory is released with them
+					pass
+				block.unlink()
+			self._shared = []
+
+	def empty( self, shape, dtype = float ):
+		'''
+		Allocate an uninitialized array in shared memory.
+
+		When it, or a view of it, is a variable or `out' of evaluate(), the worker processes read or write it in place instead of a copy.
+		The memory is released by close(), after which the array must not be used anymore.
+		Without shared memory, that is before Python 3.8, this is a plain array.
+		'''
+
+		dtype = numpy.dtype( dtype )
+		if shared_memory is None:
+			return numpy.empty( shape, dtype )
+
+		block = shared_memory.SharedMemory( create = True, size = max( int( numpy.prod( shape ) ) * dtype.itemsize, 1 ) )
+		array = numpy.ndarray( shape, dtype, buffer = block.buf )
+		with self._lock:
+			self._shared.append( ( block, _address( array ) ) )
+
+		return array
+
+	def _locate( self, value ):
+		'''
+		Get the description of array `value' for the workers if it lies in a block allocated by empty(), None otherwise.
+		'''
+
+		low, high = _bounds( value )
+		with self._lock:
+			for block, start in self._shared:
+				if start <= low and high <= start + block.size:
+					return ( block.name, _address( value ) - start, value.shape, value.strides, value.dtype.str )
+
+		return None
+
+	def evaluate( self, tree, scope, out = None ):
+		'''
+		Evaluate the tree with the variables and functions of `scope', splitting the arrays between the worker processes.
+
+		If `out' is given, the result is written into it and it is returned; the workers write directly into it if it was allocated by empty() with the shape and type of the result.
+		'''
+
+		tree, values, shape = blocked.prepare( tree, scope, broadcast = False )
+
+		arrays = { name: value for name, value in values.items() if isinstance( value, numpy.ndarray ) }
+		if shared_memory is None or shape is None or int( numpy.prod( shape ) ) < 2 or self.workers < 2 or any( value.dtype.hasobject for value in arrays.values() ):
+			# Nothing worth splitting, or nothing that can be put in shared memory
+			return blocked.evaluate( tree, Scope( ( values, ), scope.func_cbs ), out )
+
+		# The type of the result is only known once a part of it has been evaluated
+		head = ( 0, ) * ( len( shape ) - 1 ) + ( slice( 0, 1 ), )
+		first = buffers.evaluate( tree, Scope( ( { name: numpy.broadcast_to( value, shape )[ head ] if name in arrays else value for name, value in values.items() }, ), scope.func_cbs ) )
+		dtype = numpy.result_type( first )
+		if dtype.hasobject:
+			return blocked.evaluate( tree, Scope( ( values, ), scope.func_cbs ), out )
+
+		payload = pickle.dumps( nodes.flatten( _detach( tree ) ) )
+		scalars = { name: value for name, value in values.items() if not name in arrays }
+
+		blocks = []
+		def allocate( array_shape, array_dtype ):
+			blocks.append( shared_memory.SharedMemory( create = True, size = max( int( numpy.prod( array_shape ) ) * array_dtype.itemsize, 1 ) ) )
+			return ( blocks[ -1 ].name, 0, array_shape, None, array_dtype.str )
+
+		try:
+			specs = {}
+			for name, value in arrays.items():
+				specs[ name ] = self._locate( value )
+				if specs[ name ] is None:
+					specs[ name ] = allocate( value.shape, value.dtype )
+					numpy.ndarray( value.shape, value.dtype, buffer = blocks[ -1 ].buf )[ ... ] = value
+
+			result = None
+			if not out is None and out.shape == shape and out.dtype == dtype:
+				result = self._locate( out )
+			direct = not result is None
+			if not direct:
+				result = allocate( shape, dtype )
+
+			parts = blocked.slices( shape, -( -int( numpy.prod( shape ) ) // self.workers ) )
+
+			executor = self.executor()
+			futures = [ executor.submit( _work, payload, scope.func_cbs, specs, scalars, shape, result, sl ) for sl in parts ]
+			for future in futures:
+				future.result()
+
+			if direct:
+				return out
+
+			if out is None:
+				out = numpy.empty( shape, dtype = dtype )
+			out[ ... ] = numpy.ndarray( shape, dtype, buffer = blocks[ -1 ].buf )
+
+			return out
+		finally:
+			for block in blocks:
+				block.close()
+				block.unlink()
+
+_default = None
+_default_lock = threading.Lock()
+
+def default_pool():
+	'''
+	Get the pool used when none is given, with one process per core.
+
+	It is closed when the interpreter exits, stopping its processes and releasing its shared memory.
+	'''
+
+	global _default
+
+	with _default_lock:
+		if _default is None:
+			_default = ProcessPool()
+			atexit.register( _default.close )
+		return _default
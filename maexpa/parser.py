@@ -0,0 +1,137 @@
+# Recursive-descent parser for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from . import exception, nodes
+
+class Parser( object ):
+	"""
+	Builds the expression tree from a list of tokens.
+	"""
+
+	def __init__( self, tklist ):
+		self.tokens = tklist
+		self.cur = 0
+		self.value = None
+
+	def parse( self ):
+		"""
+		Parse the whole token list and return the root node of the tree.
+		"""
+
+		tree = self.expression()
+		if self.cur != len( self.tokens ):
+			self.error()
+
+		return tree
+
+	def next_val( self, s ):
+		if self.cur < len( self.tokens ) and self.tokens[ self.cur ].get_type() == s:
+			self.value = self.tokens[ self.cur ].get_value()
+			self.cur += 1
+			return True
+		else:
+			return False
+
+	def next_is( self, s ):
+		if self.cur < len( self.tokens ) and self.tokens[ self.cur ].get_type() == s:
+			self.value = None
+			self.cur += 1
+			return True
+		else:
+			return False
+
+	def next_must( self, s ):
+		if not self.next_is( s ):
+			self.error()
+
+	def operator( self, allowed ):
+		if self.cur < len( self.tokens ) and self.tokens[ self.cur ].get_type() == "operator":
+			if self.tokens[ self.cur ].get_value() in allowed:
+				self.value = self.tokens[ self.cur ]
+				self.cur += 1
+				return True
+		return False
+
+	def error( self ):
+		if self.cur >= len( self.tokens ):
+			raise exception.ParseEndException( None, -1 )
+		else:
+			raise exception.ParseException( self.tokens[ self.cur ].get_type(), self.tokens[ self.cur ].get_column() + 1 )
+
+	def expression( self ):
+		self.operator( [ "+", "-" ] )
+		oper = self.value
+		node = self.term()
+		if oper:
+			node = nodes.NodeUnary( oper.get_column(), oper.get_value(), node )
+
+		while self.operator( [ "+", "-" ] ):
+			oper = self.value
+			node = nodes.NodeBinary( oper.get_column(), oper.get_value(), node, self.term() )
+
+		return node
+
+	def term( self ):
+		node = self.factor()
+
+		while self.operator( [ "*", "/", "//" ] ):
+			oper = self.value
+			node = nodes.NodeBinary( oper.get_column(), oper.get_value(), node, self.factor() )
+
+		return node
+
+	def factor( self ):
+		# This one is right associative :(
+		bases = [ self.base() ]
+		opers = []
+		while self.operator( [ "**" ] ):
+			opers.append( self.value )
+			bases.append( self.base() )
+
+		ret = bases[ -1 ]
+		for i in range( 1, len( bases ) ):
+			oper = opers[ len( bases ) - i - 1 ]
+			ret = nodes.NodeBinary( oper.get_column(), oper.get_value(), bases[ len( bases ) - i - 1 ], ret )
+
+		return ret
+
+	def base( self ):
+		if self.cur < len( self.tokens ):
+			col = self.tokens[ self.cur ].get_column()
+
+		if self.next_val( "name" ):
+			name = self.value
+			if self.next_is( "(" ):
+				args = [ self.expression() ]
+				while self.next_is( "," ):
+					args.append( self.expression() )
+				self.next_must( ")" )
+				return nodes.NodeCall( col, name, args )
+			else:
+				return nodes.NodeVariable( col, name )
+
+		if self.next_val( "float" ):
+			return nodes.NodeLiteral( col, self.value )
+
+		if self.next_val( "integer" ):
+			return nodes.NodeLiteral( col, self.value )
+
+		if self.next_is( "(" ):
+			node = self.expression()
+			self.next_must( ")" )
+			return node
+
+		self.error()
@@ -0,0 +1,146 @@
+# Per-node profiling of the evaluation for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The tree is evaluated children first, so that the time measured for each node only covers its own operation: the lookup of a variable, the call of a function with its arguments already computed, or an operator applied to its operands.
+# Literals and the wrappers of shared subtrees cost nothing and are not reported; a shared subtree is computed once per evaluation, and reported at the column where it first appears.
+
+import time
+
+from . import nodes
+
+class Entry( object ):
+	"""
+	Measurements of one operation of the expression.
+	"""
+
+	def __init__( self, node ):
+		self.node = node
+		if isinstance( node, nodes.NodeVariable ):
+			self.kind = "variable"
+			self.name = node.name
+		elif isinstance( node, nodes.NodeCall ):
+			self.kind = "call"
+			self.name = node.name
+		else:
+			self.kind = "operator"
+			self.name = node.op
+		# Counted from 1, as in the error messages
+		self.column = node.get_column() + 1
+		# Number of times the operation was run
+		self.calls = 0
+		# Total wall time in seconds
+		self.time = 0.
+		# Number of elements of the last result, 1 for scalars
+		self.size = None
+
+	def text( self ):
+		"""
+		Get the text of the subexpression computed by this operation.
+		"""
+		return str( self.node )
+
+class Profile( object ):
+	"""
+	Measurements of all the operations of an expression, in the order in which they are run.
+	"""
+
+	def __init__( self, entries, value ):
+		self.entries = entries
+		# Result of the last evaluation
+		self.value = value
+
+	def total( self ):
+		"""
+		Get the time spent in all the operations, in seconds.
+		"""
+		return sum( entry.time for entry in self.entries )
+
+	def slowest( self, count = None ):
+		"""
+		Get the entries sorted from the slowest to the fastest, only the `count' first ones if it is given.
+		"""
+		entries = sorted( self.entries, key = lambda entry: entry.time, reverse = True )
+		return entries if count is None else entries[ :count ]
+
+	def report( self, count = None, width = 40 ):
+		"""
+		Write the slowest operations as a table, one per line, with the text of their subexpression cut to `width' characters.
+		"""
+
+		total = self.total()
+		lines = [ "{:>6s} {:8s} {:10s} {:>6s} {:>12s} {:>6s} {:>10s}  {:s}".format( "column", "kind", "name", "calls", "time (us)", "%", "size", "expression" ) ]
+		for entry in self.slowest( count ):
+			text = entry.text()
+			if len( text ) > width:
+				text = text[ :width - 3 ] + "..."
+			lines.append( "{:6d} {:8s} {:10s} {:6d} {:12.3f} {:6.1f} {:10d}  {:s}".format( entry.column, entry.kind, entry.name, entry.calls, entry.time * 1e6, 100. * entry.time / total if total > 0. else 0., entry.size, text ) )
+
+		return "\n".join( lines )
+
+	def __str__( self ):
+		return self.report()
+
+def _size( value ):
+	size = getattr( value, "size", 1 )
+	return size if isinstance( size, int ) else 1
+
+def evaluate( tree, scope, number = 1 ):
+	"""
+	Evaluate the tree `number' times with the callbacks of `scope', measuring each of its operations, and return a Profile.
+	"""
+
+	order = list( nodes.postorder( tree ) )
+	entries = {}
+	clock = time.perf_counter
+
+	value = None
+	for _ in range( number ):
+		values = {}
+		for node in order:
+			if isinstance( node, nodes.NodeLiteral ):
+				values[ node ] = node.value
+				continue
+			if isinstance( node, nodes.NodeShared ):
+				values[ node ] = values[ node.node ]
+				continue
+
+			args = [ values[ child ] for child in node.children() ]
+
+			if isinstance( node, nodes.NodeVariable ):
+				start = clock()
+				result = node.evaluate( scope )
+				elapsed = clock() - start
+			elif isinstance( node, nodes.NodeCall ):
+				start = clock()
+				result = node.call( scope, args )
+				elapsed = clock() - start
+			else:
+				start = clock()
+				result = node.func( *args )
+				elapsed = clock() - start
+
+			if not node in entries:
+				entries[ node ] = Entry( node )
+			entry = entries[ node ]
+			entry.calls += 1
+			entry.time += elapsed
+			entry.size = _size( result )
+
+			values[ node ] = result
+
+		value = values[ tree ]
+
+	return Profile( [ entries[ node ] for node in order if node in entries ], value )
@@ -0,0 +1,188 @@
+# Algebraic rewrites of the expression tree for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Powers and divisions by constants are replaced with cheaper operations, in one of two modes:
+# - "strict" only applies the rewrites that give exactly the same result, of the same type, for real and integer operands: x**2 with an integer exponent, and the division by a power of two;
+#   boolean NumPy operands are the exception, since x*x stays boolean whereas x**2 is an integer;
+#   pow(x,2) is only rewritten with the standard library, whose pow is Python's: NumPy's turns Python integers into fixed-size ones, whose product may overflow where that of Python integers does not;
+# - "fast" also applies those that may change the last bits of the result: other small integer powers as repeated multiplications, the division by any other constant as a multiplication by its reciprocal, x**0.5 as sqrt(x) with NumPy's functions, and exp(x)-1 and log(1+x) as expm1(x) and log1p(x), which are more accurate.
+#   It also assumes real results: the square root of a negative Python number is then nan instead of a complex number.
+# Only the operators, and the pow, exp and log functions of the libraries of maexpa, are rewritten; the functions that replace them come from the same library.
+# The base of a power that becomes a product appears several times in the new tree; it is then shared by the common subexpression pass, so that it is still computed once.
+
+import math
+
+from . import namespace, nodes
+
+modes = ( "strict", "fast" )
+
+# Largest integer exponent written as multiplications in fast mode
+max_power = 4
+
+def _number( node ):
+	"""
+	Get the value of `node' if it is a literal real number, or None.
+	"""
+
+	if isinstance( node, nodes.NodeLiteral ) and type( node.value ) in ( int, float ):
+		return node.value
+	return None
+
+def _library( node, name ):
+	"""
+	Get the library of maexpa providing the function called by `node' if it is `name', or None.
+	"""
+
+	if isinstance( node, nodes.NodeCall ) and node.name == name:
+		return namespace.library_of( node.providers )
+	return None
+
+def _call( col, name, args, func_cbs, library ):
+	"""
+	Create a call to function `name' of `library', or return None if the callbacks `func_cbs' do not resolve it to that library.
+	"""
+
+	node = nodes.NodeCall( col, name, args )
+	node.resolve( func_cbs )
+	if namespace.library_of( node.providers ) != library:
+		return None
+	return node
+
+def _power( base, exponent, col, fast ):
+	"""
+	Get base**exponent as a product, or None.
+
+	Only integer exponents are rewritten, since the product of integers stays an integer while their power with a float exponent does not.
+	"""
+
+	if type( exponent ) is not int:
+		return None
+
+	# x**1 is not replaced by x, whose value may be an input array that the result must not alias
+
+	if exponent == 2:
+		return nodes.NodeBinary( col, "*", base, base )
+
+	if fast and 2 < exponent <= max_power:
+		half = base if exponent // 2 == 1 else _power( base, exponent // 2, col, fast )
+		node = nodes.NodeBinary( col, "*", half, half )
+		if exponent % 2 == 1:
+			node = nodes.NodeBinary( col, "*", node, base )
+		return node
+
+	return None
+
+def _reciprocal( value, fast ):
+	"""
+	Get the reciprocal of `value' if the multiplication by it may replace the division by `value', or None.
+	"""
+
+	if value == 0 or not math.isfinite( value ):
+		return None
+
+	try:
+		inverse = 1. / value
+	except OverflowError:
+		return None
+
+	if inverse == 0. or not math.isfinite( inverse ):
+		return None
+
+	# The multiplication by the reciprocal of a power of two is exact
+	if not fast and ( math.frexp( abs( value ) )[ 0 ] != 0.5 or inverse * value != 1. ):
+		return None
+
+	return inverse
+
+def _rewrite_node( node, func_cbs, fast, names ):
+	col = node.get_column()
+
+	# Powers, with an operator or the pow function
+	if isinstance( node, nodes.NodeBinary ) and node.op == "**":
+		base, exponent = node.left, _number( node.right )
+		library = None
+	elif not _library( node, "pow" ) is None:
+		base, exponent = node.args[ 0 ], _number( node.args[ 1 ] )
+		library = _library( node, "pow" )
+	else:
+		base, exponent = None, None
+
+	if not exponent is None and ( fast or library != "numpy" ):
+		new = _power( base, exponent, col, fast )
+		if not new is None:
+			if not library is None:
+				names.add( "pow" )
+			return new
+
+		if fast and exponent == 0.5:
+			# Only NumPy's sqrt behaves as the power for negative numbers, giving nan rather than an error
+			new = _call( col, "sqrt", [ base ], func_cbs, "numpy" )
+			if not new is None and library in ( None, "numpy" ):
+				names.update( [ "pow", "sqrt" ] if not library is None else [ "sqrt" ] )
+				return new
+
+	if isinstance( node, nodes.NodeBinary ) and node.op == "/":
+		value = _number( node.right )
+		if not value is None:
+			inverse = _reciprocal( value, fast )
+			if not inverse is None:
+				return nodes.NodeBinary( col, "*", node.left, nodes.NodeLiteral( node.right.get_column(), inverse ) )
+
+	if fast and isinstance( node, nodes.NodeBinary ) and node.op == "-" and _number( node.right ) == 1:
+		library = _library( node.left, "exp" )
+		if not library is None:
+			new = _call( col, "expm1", list( node.left.args ), func_cbs, library )
+			if not new is None:
+				names.update( [ "exp", "expm1" ] )
+				return new
+
+	if fast and not _library( node, "log" ) is None and isinstance( node.args[ 0 ], nodes.NodeBinary ) and node.args[ 0 ].op == "+":
+		total = node.args[ 0 ]
+		if _number( total.left ) == 1:
+			other = total.right
+		elif _number( total.right ) == 1:
+			other = total.left
+		else:
+			other = None
+
+		if not other is None:
+			new = _call( col, "log1p", [ other ], func_cbs, _library( node, "log" ) )
+			if not new is None:
+				names.update( [ "log", "log1p" ] )
+				return new
+
+	return node
+
+def rewrite( root, func_cbs, mode, names = None ):
+	"""
+	Replace the powers and divisions by constants of the tree starting at `root' by cheaper operations, as allowed by `mode', either "strict" or "fast".
+
+	New function calls are resolved with the callbacks `func_cbs'.
+	The tree is modified in place; the new root is returned.
+	If `names' is given, the names of the functions whose calls were removed or added are added to this set.
+	"""
+
+	if names is None:
+		names = set()
+
+	fast = mode == "fast"
+	memo = {}
+
+	for node in nodes.postorder( root ):
+		node.set_children( [ memo[ child ] for child in node.children() ] )
+		memo[ node ] = _rewrite_node( node, func_cbs, fast, names )
+
+	return memo[ root ]
@@ -29,14 +29,14 @@ class Selection( object ):
 			# Python's standard library
 			from . import callback_std
 
-			self._var = callback_std.var
-			self._func = callback_std.func
+			self._var = callback_std.variables
+			self._func = callback_std.functions
 		elif name == "numpy":
 			# NumPy
 			from . import callback_numpy
 
-			self._var = callback_numpy.var
-			self._func = callback_numpy.func
+			self._var = callback_numpy.variables
+			self._func = callback_numpy.functions
 		else:
 			raise Exception( "Invalid value passed to maexpa.use(): {:s}".format( name ) )
 
@@ -16,18 +16,30 @@
 
 import re
 import operator
+import sys
 
 from . import exception
 
-_re_int = re.compile( "[0-9]+" )
-_re_float = re.compile( "([0-9]*)([.][0-9]*)?([eE][+-]?[0-9]+)?" )
-_re_name = re.compile( "[a-zA-Z_][a-zA-Z_0-9]*" )
+# All the tokens are recognised by a single regular expression, the name of the matching group giving the type of the token.
+# Floating-point numbers must come before integers, since an integer is the beginning of a float.
+_re_token = re.compile( "|".join( [
+	"(?P<float>[0-9]+[.][0-9]*(?:[eE][+-]?[0-9]+)?|[.][0-9]+(?:[eE][+-]?[0-9]+)?|[0-9]+[eE][+-]?[0-9]+)",
+	"(?P<integer>[0-9]+)",
+	"(?P<name>[a-zA-Z_][a-zA-Z_0-9]*)",
+	"(?P<operator>[*][*]|//|[*/+-])",
+	"(?P<lpar>[(])",
+	"(?P<rpar>[)])",
+	"(?P<comma>,)",
+	"(?P<space> +)",
+] ) )
 
 class TokenBase( object ):
 	"""
 	Base class for lexical tokens.
 	"""
 
+	__slots__ = ( "col", )
+
 	def __init__( self, col ):
 		self.col = col
 
@@ -54,9 +66,12 @@ class TokenName( TokenBase ):
 	Token representing a variable or function reference.
 	"""
 
+	__slots__ = ( "value", )
+
 	def __init__( self, col, value ):
 		TokenBase.__init__( self, col )
-		self.value = value
+		# Names are repeated across many expressions
+		self.value = sys.intern( value )
 
 	def get_type( self ):
 		return "name"
@@ -69,36 +84,42 @@ class TokenInt( TokenBase ):
 	Token representing a litteral integer.
 	"""
 
+	__slots__ = ( "value", )
+
 	def __init__( self, col, value ):
 		TokenBase.__init__( self, col )
-		self.value = value
+		self.value = int( value )
 
 	def get_type( self ):
 		return "integer"
 
 	def get_value( self ):
-		return int( self.value )
+		return self.value
 
 class TokenFloat( TokenBase ):
 	"""
 	Token representing a litteral floating-point number.
 	"""
 
+	__slots__ = ( "value", )
+
 	def __init__( self, col, value ):
 		TokenBase.__init__( self, col )
-		self.value = value
+		self.value = float( value )
 
 	def get_type( self ):
 		return "float"
 
 	def get_value( self ):
-		return float( self.value )
+		return self.value
 
 class TokenOperator( TokenBase ):
 	"""
 	Token representing a mathematical operator.
 	"""
 
+	__slots__ = ( "value", )
+
 	_map = {
 		"**": ( operator.pow, ),
 		"//": ( operator.floordiv, ),
@@ -132,6 +153,8 @@ class TokenLPar( TokenBase ):
 	Token representing a litteral "(".
 	"""
 
+	__slots__ = ()
+
 	def get_type( self ):
 		return "("
 
@@ -140,6 +163,8 @@ class TokenRPar( TokenBase ):
 	Token representing a litteral ")".
 	"""
 
+	__slots__ = ()
+
 	def get_type( self ):
 		return ")"
 
@@ -148,59 +173,40 @@ class TokenComma( TokenBase ):
 	Token representing a litteral ",".
 	"""
 
+	__slots__ = ()
+
 	def get_type( self ):
 		return ","
 
+_factories = {
+	"float": TokenFloat,
+	"integer": TokenInt,
+	"name": TokenName,
+	"operator": TokenOperator,
+	"lpar": lambda col, value: TokenLPar( col ),
+	"rpar": lambda col, value: TokenRPar( col ),
+	"comma": lambda col, value: TokenComma( col ),
+}
+
 def lexer( formula ):
 	"""
 	Lexical analysis.
 	"""
 
+	match = _re_token.match
 	start = 0
 	tot = len( formula )
 
 	tklist = []
 
 	while start < tot:
-		if formula[ start ] == " ":
-			start += 1
-			continue
-
-		match = _re_float.match( formula, start )
-		if match:
-			if ( not match.group( 2 ) is None and len( match.group( 2 ) ) > 1 ) or ( len( match.group( 1 ) ) > 0 and ( not match.group( 2 ) is None or not match.group( 3 ) is None ) ):
-				tklist.append( TokenFloat( start, match.group() ) )
-				_, start = match.span()
-				continue
-
-		match = _re_int.match( formula, start )
-		if match:
-			tklist.append( TokenInt( start, match.group() ) )
-			_, start = match.span()
-			continue
-
-		match = _re_name.match( formula, start )
-		if match:
-			tklist.append( TokenName( start, match.group() ) )
-			_, start = match.span()
-			continue
-
-		for op in [ "**", "//", "*", "/", "+", "-" ]:
-			if formula[ start : start+len( op ) ] == op:
-				tklist.append( TokenOperator( start, op ) )
-				start += len( op )
-				break
-		else:
-			if formula[ start ] == "(":
-				tklist.append( TokenLPar( start ) )
-				start += 1
-			elif formula[ start ] == ")":
-				tklist.append( TokenRPar( start ) )
-				start += 1
-			elif formula[ start ] == ",":
-				tklist.append( TokenComma( start ) )
-				start += 1
-			else:
-				raise exception.LexicalException( formula[ start ], start + 1 )
+		found = match( formula, start )
+		if found is None:
+			raise exception.LexicalException( formula[ start ], start + 1 )
+
+		kind = found.lastgroup
+		if kind != "space":
+			tklist.append( _factories[ kind ]( start, found.group() ) )
+		start = found.end()
 
 	return tklist
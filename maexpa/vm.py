@@ -0,0 +1,285 @@
+# Register-based virtual machine backend for MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# The tree is compiled once into a flat list of instructions, each applying a NumPy ufunc to inputs, constants or registers and storing its result in a register.
+# The instructions are then run block by block over the input arrays, with registers the size of a block that are re-used as soon as their value is no longer needed.
+# Apart from the inputs and the result, memory is therefore only needed for a few blocks, which stay in the CPU cache.
+# Only the operators and functions implemented by ufuncs can be compiled; other expressions are evaluated by the buffers backend instead.
+
+import time
+
+import numpy
+
+from . import buffers, metrics, nodes
+from .expression import Scope
+
+# Number of elements per block
+block_size = 16384
+
+# Operands of the instructions
+_INPUT = 0
+_CONST = 1
+_REGISTER = 2
+
+class _Unsupported( Exception ):
+	pass
+
+class Program( object ):
+	"""
+	Instructions computing an expression.
+	"""
+
+	def __init__( self ):
+		# Nodes giving the value of the inputs, variables or array literals
+		self.inputs = []
+		# Tuples of the ufunc, the function to use if all the operands are scalars, the operands and the register receiving the result
+		self.code = []
+		# Names of the functions computing the registers, for the metrics
+		self.calls = {}
+		self.registers = 0
+		self.result = None
+
+	def emit( self, ufunc, func, operands ):
+		reg = self.registers
+		self.registers += 1
+		self.code.append( ( ufunc, func, operands, reg ) )
+		return ( _REGISTER, reg )
+
+class _Compiler( object ):
+	def __init__( self ):
+		self.program = Program()
+		self.names = {}
+
+	def operand( self, node, args ):
+		"""
+		Get the operand holding the value of `node', given the operands of its children in `args', emitting the instruction computing it if needed.
+		"""
+
+		if isinstance( node, nodes.NodeShared ):
+			return args[ 0 ]
+
+		if isinstance( node, nodes.NodeLiteral ):
+			if isinstance( node.value, numpy.ndarray ):
+				self.program.inputs.append( node )
+				return ( _INPUT, len( self.program.inputs ) - 1 )
+			if isinstance( node.value, ( int, float, complex, numpy.number ) ):
+				return ( _CONST, node.value )
+			raise _Unsupported()
+
+		if isinstance( node, nodes.NodeVariable ):
+			if not node.name in self.names:
+				self.program.inputs.append( node )
+				self.names[ node.name ] = len( self.program.inputs ) - 1
+			return ( _INPUT, self.names[ node.name ] )
+
+		if isinstance( node, nodes.NodeUnary ):
+			return self.program.emit( buffers._unary[ node.op ], node.func, args )
+
+		if isinstance( node, nodes.NodeBinary ):
+			return self.program.emit( buffers._binary[ node.op ], node.func, args )
+
+		if isinstance( node, nodes.NodeCall ):
+			if isinstance( node.impl, numpy.ufunc ) and node.impl.nin == len( node.args ) and node.impl.nout == 1:
+				reg = self.program.emit( node.impl, node.impl, args )
+				self.program.calls[ reg[ 1 ] ] = node.name
+				return reg
+			raise _Unsupported()
+
+		raise _Unsupported()
+
+def compile( tree ):
+	"""
+	Compile the tree into a Program, or return None if it contains operations that the virtual machine cannot run.
+	"""
+
+	comp = _Compiler()
+	operands = {}
+	try:
+		# Children first, so that the instructions come in the order they have to be run
+		for node in nodes.postorder( tree ):
+			operands[ node ] = comp.operand( node, [ operands[ child ] for child in node.children() ] )
+	except _Unsupported:
+		return None
+
+	result = operands[ tree ]
+
+	if result[ 0 ] != _REGISTER:
+		# Nothing to compute
+		return None
+
+	comp.program.result = result[ 1 ]
+	return comp.program
+
+def _plan( program, values ):
+	"""
+	Compute the instructions that only involve scalars, and find the type of the registers holding arrays.
+
+	Returns the values of the scalar registers, the instructions left to run over the arrays, and the type of each register.
+	"""
+
+	scalars = {}
+	samples = {}
+	dtypes = {}
+	code = []
+
+	for index, value in enumerate( values ):
+		if isinstance( value, numpy.ndarray ):
+			samples[ ( _INPUT, index ) ] = numpy.full( 1, value[ ( 0, ) * value.ndim ], dtype = value.dtype )
+
+	def scalar( operand ):
+		if operand[ 0 ] == _INPUT:
+			return values[ operand[ 1 ] ]
+		if operand[ 0 ] == _CONST:
+			return operand[ 1 ]
+		return scalars[ operand[ 1 ] ]
+
+	for ufunc, func, operands, reg in program.code:
+		if all( not operand in samples for operand in operands ):
+			# Keep the exact same types as the standard evaluation for scalars
+			if metrics.active is None or not reg in program.calls:
+				scalars[ reg ] = func( *[ scalar( operand ) for operand in operands ] )
+			else:
+				scalars[ reg ] = metrics.active.callback( "function", program.calls[ reg ], func, *[ scalar( operand ) for operand in operands ] )
+			continue
+
+		with numpy.errstate( all = "ignore" ):
+			sample = ufunc( *[ samples[ operand ] if operand in samples else scalar( operand ) for operand in operands ] )
+		samples[ ( _REGISTER, reg ) ] = sample
+		dtypes[ reg ] = sample.dtype
+		code.append( ( ufunc, operands, reg ) )
+
+	return scalars, code, dtypes
+
+def _allocate( program, code, dtypes ):
+	"""
+	Assign the registers to buffers, re-using the buffers of registers whose value is no longer needed.
+
+	Returns the index of the buffer of each register, and the type of each buffer.
+	"""
+
+	last = {}
+	for index, ( ufunc, operands, reg ) in enumerate( code ):
+		for operand in operands:
+			if operand[ 0 ] == _REGISTER:
+				last[ operand[ 1 ] ] = index
+
+	assigned = {}
+	kinds = []
+	free = {}
+
+	for index, ( ufunc, operands, reg ) in enumerate( code ):
+		for operand in operands:
+			if operand[ 0 ] == _REGISTER and operand[ 1 ] in assigned and last[ operand[ 1 ] ] == index:
+				free.setdefault( kinds[ assigned[ operand[ 1 ] ] ], [] ).append( assigned[ operand[ 1 ] ] )
+				# Only free it once if it appears several times
+				last[ operand[ 1 ] ] = None
+
+		if reg == program.result:
+			# Written directly into the output
+			continue
+
+		if free.get( dtypes[ reg ] ):
+			assigned[ reg ] = free[ dtypes[ reg ] ].pop()
+		else:
+			assigned[ reg ] = len( kinds )
+			kinds.append( dtypes[ reg ] )
+
+	return assigned, kinds
+
+def evaluate( program, tree, scope, out = None ):
+	"""
+	Run `program', compiled from `tree', with the variables and functions of `scope'.
+
+	If no variable is an array, or if the program cannot be run, `tree' is evaluated by the buffers backend instead.
+	If `out' is given, the result is written into it and it is returned.
+	"""
+
+	values = [ node.evaluate( scope ) for node in program.inputs ]
+	arrays = [ index for index, value in enumerate( values ) if isinstance( value, numpy.ndarray ) ]
+
+	if len( arrays ) == 0 or len( arrays ) >= 32 or any( values[ index ].size == 0 or values[ index ].dtype.hasobject for index in arrays ):
+		# The variables were already retrieved
+		known = { node.name: value for node, value in zip( program.inputs, values ) if isinstance( node, nodes.NodeVariable ) }
+		return buffers.evaluate( tree, Scope( ( known, ), scope.func_cbs ), out )
+
+	scalars, code, dtypes = _plan( program, values )
+	assigned, kinds = _allocate( program, code, dtypes )
+
+	dtype = dtypes[ program.result ]
+	shape = buffers.broadcast_shape( [ values[ index ].shape for index in arrays ] )
+	if out is None:
+		out = numpy.empty( shape, dtype = dtype )
+
+	# All the operands are looked up in a single list, whose first items are updated for each block
+	env = [ None ] * ( len( arrays ) + 1 ) + [ None ] * len( kinds )
+	slots = { ( _INPUT, index ): pos for pos, index in enumerate( arrays ) }
+	slots[ ( _REGISTER, program.result ) ] = len( arrays )
+	for reg, buf in assigned.items():
+		slots[ ( _REGISTER, reg ) ] = len( arrays ) + 1 + buf
+
+	def slot( operand ):
+		if not operand in slots:
+			slots[ operand ] = len( env )
+			if operand[ 0 ] == _INPUT:
+				env.append( values[ operand[ 1 ] ] )
+			elif operand[ 0 ] == _CONST:
+				env.append( operand[ 1 ] )
+			else:
+				env.append( scalars[ operand[ 1 ] ] )
+		return slots[ operand ]
+
+	steps = [ ( ufunc, [ slot( operand ) for operand in operands ], slot( ( _REGISTER, reg ) ) ) for ufunc, operands, reg in code ]
+
+	full = [ numpy.empty( block_size, dtype = kind ) for kind in kinds ]
+	base = len( arrays ) + 1
+
+	iterator = numpy.nditer(
+		[ values[ index ] for index in arrays ] + [ out ],
+		flags = [ "external_loop", "buffered", "zerosize_ok" ],
+		op_flags = [ [ "readonly" ] ] * len( arrays ) + [ [ "writeonly" ] ],
+		op_dtypes = [ None ] * len( arrays ) + [ dtype ],
+		casting = "unsafe",
+		buffersize = block_size,
+	)
+
+	# With the metrics, the time of each function call is summed over the blocks
+	registry = metrics.active
+	timed = None if registry is None else [ program.calls.get( reg ) for ufunc, operands, reg in code ]
+	elapsed = [ 0. ] * len( steps )
+
+	size = None
+	with iterator:
+		for chunk in iterator:
+			env[ :base ] = chunk
+			if len( chunk[ -1 ] ) != size:
+				size = len( chunk[ -1 ] )
+				env[ base:base + len( full ) ] = [ buf[ :size ] for buf in full ]
+
+			if timed is None:
+				for ufunc, args, dest in steps:
+					ufunc( *[ env[ arg ] for arg in args ], out = env[ dest ] )
+			else:
+				for index, ( ufunc, args, dest ) in enumerate( steps ):
+					start = time.perf_counter()
+					ufunc( *[ env[ arg ] for arg in args ], out = env[ dest ] )
+					elapsed[ index ] += time.perf_counter() - start
+
+	if not timed is None:
+		for name, value in zip( timed, elapsed ):
+			if not name is None:
+				registry.record( "function", name, value )
+
+	return out
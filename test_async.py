@@ -0,0 +1,87 @@
+# Test suite for the evaluation with asynchronous callbacks in MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import math
+
+import unittest
+
+import maexpa
+
+def run( coro ):
+	# Same as asyncio.run(), which requires Python 3.7
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete( coro )
+	finally:
+		loop.close()
+
+class AsyncTestCase( unittest.TestCase ):
+	def setUp( self ):
+		maexpa.lib( "std" )
+		self.calls = []
+		self.pending = 0
+		self.max_pending = 0
+
+	async def var_cb( self, name ):
+		self.calls.append( name )
+		self.pending += 1
+		self.max_pending = max( self.max_pending, self.pending )
+		await asyncio.sleep( 0.01 )
+		self.pending -= 1
+
+		if name == "x":
+			return 2.
+		if name == "y":
+			return 3.
+		if name == "z":
+			return 4.
+		raise maexpa.exception.NoVarException( name )
+
+	async def func_cb( self, name, args ):
+		await asyncio.sleep( 0.01 )
+		if name == "double":
+			return 2 * args[ 0 ]
+		raise maexpa.exception.NoFuncException( name )
+
+	def test_variables( self ):
+		obj = maexpa.Expression( "x*y+sqrt(z)*x+pi" )
+		self.assertAlmostEqual( run( obj.evaluate_async( var = self.var_cb ) ), 2. * 3. + 2. * 2. + math.pi )
+
+		# Each variable is retrieved once, all at the same time
+		self.assertEqual( sorted( self.calls ), [ "x", "y", "z" ] )
+		self.assertEqual( self.max_pending, 3 )
+
+	def test_functions( self ):
+		obj = maexpa.Expression( "double(x)+double(y)*sqrt(z)", var = self.var_cb, func = self.func_cb )
+		self.assertAlmostEqual( run( obj.evaluate_async() ), 4. + 6. * 2. )
+
+		# Synchronous callbacks are accepted as well
+		obj = maexpa.Expression( "double(x)+a" )
+		res = run( obj.evaluate_async( var = { "x": 1., "a": 2. }, func = self.func_cb ) )
+		self.assertEqual( res, 4. )
+
+	def test_errors( self ):
+		obj = maexpa.Expression( "x+w" )
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			run( obj.evaluate_async( var = self.var_cb ) )
+
+		obj = maexpa.Expression( "triple(x)" )
+		with self.assertRaises( maexpa.exception.NoFuncException ):
+			run( obj.evaluate_async( var = self.var_cb, func = self.func_cb ) )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,103 @@
+# Test suite for the cache of compiled expressions in MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+
+import unittest
+
+import maexpa
+import maexpa.cache
+
+class CacheTestCase( unittest.TestCase ):
+	def setUp( self ):
+		maexpa.lib( None )
+		self.cache = maexpa.cache.ExpressionCache( limit = 4 )
+
+	def test_hit( self ):
+		first = self.cache( "1+2" )
+		self.assertIs( self.cache( "1+2" ), first )
+		self.assertEqual( first(), 3 )
+		self.assertEqual( self.cache.stats(), { "size": 1, "limit": 4, "hits": 1, "misses": 1 } )
+
+	def test_key_lib( self ):
+		maexpa.lib( "std" )
+		std = self.cache( "pi" )
+		maexpa.lib( "numpy" )
+		self.assertIsNot( self.cache( "pi" ), std )
+		maexpa.lib( "std" )
+		self.assertIs( self.cache( "pi" ), std )
+
+	def test_key_callbacks( self ):
+		def var_cb( name ):
+			return 2
+
+		obj = self.cache( "a*3", var = var_cb )
+		self.assertIsNot( self.cache( "a*3" ), obj )
+		self.assertIs( self.cache( "a*3", var = var_cb ), obj )
+		self.assertEqual( obj(), 6 )
+
+	def test_lru( self ):
+		objs = [ self.cache( str( idx ) ) for idx in range( 4 ) ]
+		self.cache( "0" )
+		self.cache( "4" )
+		self.assertEqual( len( self.cache ), 4 )
+		self.assertIs( self.cache( "0" ), objs[ 0 ] )
+		self.assertIsNot( self.cache( "1" ), objs[ 1 ] )
+
+	def test_limit( self ):
+		for idx in range( 4 ):
+			self.cache( str( idx ) )
+		self.cache.set_limit( 2 )
+		self.assertEqual( len( self.cache ), 2 )
+		self.cache.set_limit( 0 )
+		self.assertEqual( len( self.cache ), 0 )
+		self.cache( "1" )
+		self.assertEqual( len( self.cache ), 0 )
+		self.cache.set_limit( None )
+		for idx in range( 10 ):
+			self.cache( str( idx ) )
+		self.assertEqual( len( self.cache ), 10 )
+		self.cache.clear()
+		self.assertEqual( self.cache.stats(), { "size": 0, "limit": None, "hits": 0, "misses": 0 } )
+
+	def test_errors( self ):
+		with self.assertRaises( maexpa.exception.ParseException ):
+			self.cache( "1+*2" )
+		self.assertEqual( len( self.cache ), 0 )
+
+	def test_threads( self ):
+		texts = [ "{:d}*x".format( idx ) for idx in range( 8 ) ]
+
+		def run( idx ):
+			return self.cache( texts[ idx % len( texts ) ] )( var = lambda name: idx )
+
+		with concurrent.futures.ThreadPoolExecutor( max_workers = 8 ) as executor:
+			results = list( executor.map( run, range( 1000 ) ) )
+
+		for idx, res in enumerate( results ):
+			self.assertEqual( res, ( idx % len( texts ) ) * idx )
+		stats = self.cache.stats()
+		self.assertEqual( stats[ "hits" ] + stats[ "misses" ], 1000 )
+		self.assertLessEqual( stats[ "size" ], 4 )
+
+	def test_default( self ):
+		maexpa.compile.clear()
+		self.assertIs( maexpa.compile( "2**10" ), maexpa.compile( "2**10" ) )
+		self.assertEqual( maexpa.compile( "2**10" )(), 1024 )
+		self.assertEqual( maexpa.compile.stats()[ "hits" ], 2 )
+
+if __name__ == '__main__':
+	unittest.main()
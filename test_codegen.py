@@ -0,0 +1,73 @@
+# Test suite for the code generation backend of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import unittest
+
+import maexpa
+
+class CodegenTestCase( unittest.TestCase ):
+	def setUp( self ):
+		maexpa.lib( "std" )
+
+	def var_cb( self, name ):
+		if name == "x":
+			return 1.5
+		if name == "y":
+			return -2.5
+		if name == "lambda":
+			return 4
+		raise maexpa.exception.NoVarException( name )
+
+	def test_same_as_tree( self ):
+		for text in [ "x*y+3", "-x**2", "(-x)**2", "2**3**2", "x-(y-1)", "x-y-1", "x/(y*2)", "x//y", "-(x+y)*3", "sqrt(x*x+y*y)/(x*x+y*y)", "2*pi*x", "max(x,y)**(-2)", "lambda*x" ]:
+			with self.subTest( "Generated function agrees with the tree", text = text ):
+				obj = maexpa.Expression( text )
+				names = maexpa.codegen.free_variables( obj )
+				values = [ self.var_cb( name ) for name in names ]
+				self.assertEqual( obj.lambdify()( *values ), obj( var = self.var_cb ) )
+
+	def test_params( self ):
+		obj = maexpa.Expression( "x*y+pi" )
+		fn = obj.lambdify( "y", "x" )
+		self.assertAlmostEqual( fn( 2., 3. ), 6. + math.pi )
+		self.assertAlmostEqual( fn( x = 1., y = 2. ), 2. + math.pi )
+
+	def test_bound_vars( self ):
+		obj = maexpa.Expression( "x*y", var = self.var_cb )
+		self.assertEqual( obj.lambdify()(), -3.75 )
+		self.assertEqual( obj.lambdify( "y" )( 2. ), 3. )
+
+	def test_user_func( self ):
+		def func_cb( name, args ):
+			if name == "twice":
+				return 2 * args[ 0 ]
+			raise maexpa.exception.NoFuncException( name )
+
+		obj = maexpa.Expression( "twice(sqrt(x))", func = func_cb )
+		self.assertEqual( obj.lambdify()( 16. ), 8. )
+
+	def test_errors( self ):
+		with self.assertRaises( maexpa.exception.NoFuncException ):
+			maexpa.Expression( "nope(x)" ).lambdify()
+		with self.assertRaises( maexpa.exception.FuncArgsNumException ):
+			maexpa.Expression( "sqrt(x,2)" ).lambdify()
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			maexpa.Expression( "x*y" ).lambdify( "x" )
+
+if __name__ == '__main__':
+	unittest.main()
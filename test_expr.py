@@ -14,8 +14,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import math
 import unittest
 import maexpa
+from maexpa import tokens
+
+def ulp( value ):
+	"""
+	Get the unit in the last place of float `value', as math.ulp(), which requires Python 3.9.
+	"""
+
+	if hasattr( math, "ulp" ):
+		return math.ulp( value )
+
+	value = abs( value )
+	if value == 0.:
+		return math.ldexp( 1., -1074 )
+	return math.ldexp( 1., max( math.frexp( value )[ 1 ] - 53, -1074 ) )
 
 class MaExPaTestCase( unittest.TestCase ):
 	def setUp( self ):
@@ -243,6 +258,17 @@ class MaExPaTestCase( unittest.TestCase ):
 				self.assertIs( type( res ), float )
 				self.assertAlmostEqual( res, comp )
 
+	def test_parse_once( self ):
+		for text in [ "1+", "(1", "1)", "2*/3", "f(1,)" ]:
+			with self.subTest( "Syntax errors reported at construction", text = text ):
+				with self.assertRaises( maexpa.exception.CommonException ):
+					maexpa.Expression( text )
+
+		obj = maexpa.Expression( "1+2*3" )
+		obj.tokens = []
+		self.assertEqual( obj(), 7 )
+		self.assertEqual( obj(), 7 )
+
 	def test_no_var( self ):
 		for text in [ "1+e", "0*int", "float**2", "nan*45.", "inf/1000", "none(no)" ]:
 			with self.subTest( "Reference to undefined variables", text = text ):
@@ -314,5 +340,370 @@ class MaExPaTestCase( unittest.TestCase ):
 				self.assertIs( type( res_second ), float )
 				self.assertAlmostEqual( res_second, comp_second )
 
+	def test_namespaces( self ):
+		obj = maexpa.Expression( "a*b+twice(c)", var = { "a": 2, "c": 5 }, func = { "twice": lambda x: 2 * x } )
+		self.assertEqual( obj( var = { "b": 3 } ), 16 )
+		self.assertEqual( obj( var = { "a": 1, "b": 3 } ), 13 )
+		self.assertEqual( obj( var = { "b": 1 }, func = { "twice": lambda x: 3 * x } ), 17 )
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			obj()
+
+		# Names are resolved when the expression is built
+		values = { "x": 2 }
+		obj = maexpa.Expression( "x*2+y", var = values )
+		values[ "y" ] = 1
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			obj()
+		obj.resolve()
+		self.assertEqual( obj(), 5 )
+
+		del values[ "x" ]
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			obj()
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			obj( var = { "z": 0 } )
+
+	def test_resolve_once( self ):
+		maexpa.lib( "std" )
+
+		calls = []
+		def consts( name ):
+			calls.append( name )
+			if name == "x":
+				return 3.
+			raise maexpa.exception.NoVarException( name )
+
+		# Library names never reach the callback, user names never go through the library
+		obj = maexpa.Expression( "sqrt(x)*pi+x", var = consts )
+		for node in maexpa.nodes.walk( obj.tree ):
+			if isinstance( node, maexpa.nodes.NodeVariable ):
+				self.assertEqual( node.providers, ( consts, ) if node.name == "x" else ( maexpa.lib.get_var_cb(), ) )
+		self.assertAlmostEqual( obj(), 3.**0.5 * math.pi + 3. )
+		self.assertAlmostEqual( obj(), 3.**0.5 * math.pi + 3. )
+		self.assertEqual( calls, [ "x", "x" ] )
+
+	def test_func_args_num( self ):
+		# Reported at compile time for namespaces that know the number of arguments
+		funcs = maexpa.namespace.Functions( { "f": { "func": min, "args": 1 } } )
+		with self.assertRaises( maexpa.exception.FuncArgsNumException ):
+			maexpa.Expression( "f(1,2)", func = funcs )
+		maexpa.lib( "std" )
+		with self.assertRaises( maexpa.exception.FuncArgsNumException ):
+			maexpa.Expression( "sqrt(1,2)" )
+
+		# Unless callbacks at evaluation may still provide the function
+		obj = maexpa.Expression( "f(1,2)", func = funcs, overrides = True )
+		with self.assertRaises( maexpa.exception.FuncArgsNumException ):
+			obj()
+		self.assertEqual( obj( func = { "f": max } ), 2 )
+
+	def test_shared( self ):
+		maexpa.lib( "std" )
+
+		calls = []
+		def consts( name ):
+			calls.append( name )
+			return { "x": 3., "y": 4., "a": .5, "t": 2. }[ name ]
+
+		tests = [
+			( "sqrt(x*x+y*y)/(x*x+y*y)", [ "x * x + y * y", "x", "y" ], 5. / 25. ),
+			( "exp(-a*t)*(1-exp(-a*t))", [ "exp(-(a * t))" ], math.exp( -1. ) * ( 1. - math.exp( -1. ) ) ),
+			( "x*y+(x*y)**2-x", [ "x * y", "x" ], 12. + 144. - 3. ),
+			( "max(x,x)+2**2", [ "x" ], 7. ),
+			( "x+y", [], 7. ),
+		]
+
+		for expr, shared, comp in tests:
+			with self.subTest( "Common subexpressions", expr = expr ):
+				calls.clear()
+				obj = maexpa.Expression( expr )
+				self.assertEqual( obj.shared(), shared )
+				self.assertAlmostEqual( obj( var = consts ), comp )
+				self.assertEqual( sorted( calls ), sorted( set( calls ) ) )
+
+	def test_shared_impure( self ):
+		counter = []
+		def func_cb( name, args ):
+			counter.append( name )
+			return len( counter )
+
+		obj = maexpa.Expression( "rand(0)*10+rand(0)", func = func_cb )
+		self.assertEqual( obj.shared(), [] )
+		self.assertEqual( obj(), 12 )
+
+	def test_fold( self ):
+		maexpa.lib( "std" )
+
+		tests = [
+			( "x*2*pi/360", "x * 2 * 3.141592653589793 / 360", math.pi / 90. ),
+			( "x*(2*pi/360)", "x * 0.017453292519943295", math.pi / 90. ),
+			( "pow(2,10)+x", "1024 + x", 1026. ),
+			( "log(10)*x", "2.302585092994046 * x", math.log( 10. ) * 2. ),
+			( "-(3-5)**2", "-4", -4 ),
+			( "sqrt(-1)+x", "sqrt(-1) + x", None ),
+			( "x/(1-1)", "x / 0", None ),
+		]
+
+		for expr, text, comp in tests:
+			with self.subTest( "Constant folding", expr = expr ):
+				obj = maexpa.Expression( expr )
+				self.assertEqual( str( obj.tree ), text )
+				if comp is None:
+					with self.assertRaises( ( ValueError, ZeroDivisionError ) ):
+						obj( var = { "x": 2. } )
+				else:
+					self.assertAlmostEqual( obj( var = { "x": 2. } ), comp )
+
+		obj = maexpa.Expression( "2*pi", fold = False )
+		self.assertEqual( str( obj.tree ), "2 * pi" )
+		self.assertEqual( obj( var = { "pi": 3 } ), 6 )
+
+	def test_fold_override( self ):
+		maexpa.lib( "std" )
+
+		# Namespaces passed at evaluation take precedence over the folded library names
+		self.assertEqual( maexpa.Expression( "e*2" )( var = { "e": 3 } ), 6 )
+		self.assertEqual( maexpa.Expression( "sqrt(4)" )( func = { "sqrt": lambda x: -x } ), -4 )
+
+		# Callbacks may provide any name; they only take precedence when asked for, so that folding is kept otherwise
+		def var_cb( name ):
+			if name == "e":
+				return 1.
+			raise maexpa.exception.NoVarException( name )
+
+		def func_cb( name, args ):
+			if name == "sqrt":
+				return -args[ 0 ]
+			raise maexpa.exception.NoFuncException( name )
+
+		self.assertEqual( maexpa.Expression( "e*2" )( var = var_cb ), 2. * math.e )
+		self.assertEqual( maexpa.Expression( "sqrt(4)" )( func = func_cb ), 2. )
+		self.assertEqual( maexpa.Expression( "e", overrides = True )( var = var_cb ), 1. )
+		self.assertEqual( maexpa.Expression( "e*2", overrides = True )( var = var_cb ), 2. )
+		self.assertEqual( maexpa.Expression( "sqrt(4)", overrides = True )( func = func_cb ), -4 )
+		self.assertEqual( maexpa.Expression( "sqrt(4,1)", overrides = True )( func = func_cb ), -4 )
+
+		# The folded constants are not looked up through the callbacks
+		calls = []
+		def tracing_cb( name ):
+			calls.append( name )
+			return 90.
+		self.assertAlmostEqual( maexpa.Expression( "x*(2*pi/360)" )( var = tracing_cb ), math.pi / 2. )
+		self.assertEqual( calls, [ "x" ] )
+
+		# Without them, or with namespaces that do not have these names, the folded tree is used
+		obj = maexpa.Expression( "x*e" )
+		self.assertEqual( obj( var = { "x": 2. } ), 2. * math.e )
+		self.assertIs( obj.select( maexpa.expression.Scope( ( { "x": 2. }, ), () ) ), obj.tree )
+		self.assertEqual( maexpa.ExpressionSet( [ "e*2", "x+1" ] )( var = { "e": 1, "x": 1 } ), { "e*2": 2, "x+1": 2 } )
+		self.assertEqual( maexpa.ExpressionSet( [ "e*2" ] )( var = { "x": 1 } ), { "e*2": 2 * math.e } )
+		self.assertEqual( maexpa.ExpressionSet( [ "e*2" ] )( var = var_cb ), { "e*2": 2 * math.e } )
+		self.assertEqual( maexpa.ExpressionSet( [ "e*2" ], overrides = True )( var = var_cb ), { "e*2": 2. } )
+
+	def test_fold_impure( self ):
+		counter = []
+		def func_cb( name, args ):
+			counter.append( name )
+			return len( counter )
+
+		obj = maexpa.Expression( "rand(0)+1", func = func_cb )
+		self.assertEqual( obj(), 2 )
+		self.assertEqual( obj(), 3 )
+
+		obj = maexpa.Expression( "f(1)+x", func = { "f": lambda x: x + 1 }, var = { "x": 1 } )
+		self.assertEqual( str( obj.tree ), "f(1) + x" )
+
+	def test_bind( self ):
+		maexpa.lib( "std" )
+
+		calls = []
+		def var_cb( name ):
+			calls.append( name )
+			return { "a": 1.5, "b": 2., "x": 3. }[ name ]
+
+		obj = maexpa.Expression( "exp(-a*x)*b+a*b", var = var_cb )
+		bound = obj.bind( a = 1.5, b = 2. )
+		self.assertEqual( str( bound.tree ), "exp(-(1.5 * x)) * 2.0 + 3.0" )
+		self.assertAlmostEqual( bound(), obj() )
+		calls.clear()
+		bound()
+		self.assertEqual( calls, [ "x" ] )
+
+		# The original expression is unchanged
+		self.assertEqual( str( obj.tree ), "exp(-(a * x)) * b + a * b" )
+		self.assertAlmostEqual( obj.bind( x = 3. ).bind( a = 1.5 )( var = { "b": 2. } ), obj() )
+		self.assertEqual( obj.bind( a = 1., b = 1., x = 0. )(), 2. )
+
+		# What only depends on the bound values is computed once even when callbacks may replace the library names
+		obj = maexpa.Expression( "exp(-a)*x+pi", overrides = True ).bind( a = 0. )
+		self.assertEqual( str( obj.plain ), "1.0 * x + pi" )
+		self.assertEqual( obj( var = lambda name: { "x": 2., "pi": 3. }[ name ] ), 5. )
+
+	def test_lexer( self ):
+		def lex( formula ):
+			return [ ( tk.get_type(), tk.get_column(), tk.get_value() if hasattr( tk, "value" ) else None ) for tk in tokens.lexer( formula ) ]
+
+		self.assertEqual( lex( "1.5e3*x_1 //(2, .5)" ), [ ( "float", 0, 1.5e3 ), ( "operator", 5, "*" ), ( "name", 6, "x_1" ), ( "operator", 10, "//" ), ( "(", 12, None ), ( "integer", 13, 2 ), ( ",", 14, None ), ( "float", 16, .5 ), ( ")", 18, None ) ] )
+		self.assertEqual( lex( "1.+2e5**3" ), [ ( "float", 0, 1. ), ( "operator", 2, "+" ), ( "float", 3, 2e5 ), ( "operator", 6, "**" ), ( "integer", 8, 3 ) ] )
+		# An exponent without digits is not part of the number
+		self.assertEqual( lex( "2e" ), [ ( "integer", 0, 2 ), ( "name", 1, "e" ) ] )
+
+		for formula, col in [ ( "1 + .", 5 ), ( "a $ b", 3 ), ( "x\t", 2 ) ]:
+			with self.assertRaises( maexpa.exception.LexicalException ) as cm:
+				tokens.lexer( formula )
+			self.assertEqual( cm.exception.column, col )
+
+	def test_compact( self ):
+		tklist = tokens.lexer( "abc*2+1.5" )
+		for tk in tklist:
+			self.assertFalse( hasattr( tk, "__dict__" ) )
+		self.assertIs( type( tklist[ 2 ].value ), int )
+		self.assertIs( type( tklist[ 4 ].value ), float )
+		self.assertIs( tklist[ 0 ].value, tokens.lexer( "".join( [ "a", "bc" ] ) )[ 0 ].value )
+
+		obj = maexpa.Expression( "sqrt(abc)*2+1.5*(-x)", fold = False )
+		for node in maexpa.nodes.walk( obj.tree ):
+			self.assertFalse( hasattr( node, "__dict__" ) )
+
+	def test_pickle( self ):
+		import pickle
+
+		maexpa.lib( "std" )
+
+		obj = maexpa.Expression( "cbrt(x)*sqrt(x*y)+sqrt(x*y)-pi" )
+		data = pickle.dumps( obj )
+		# The functions of the library are stored by name, cbrt() is a lambda that cannot be pickled
+		self.assertIn( b"maexpa.namespace", data )
+
+		new = pickle.loads( data )
+		self.assertIsNone( new.tokens )
+		self.assertEqual( str( new.tree ), str( obj.tree ) )
+		self.assertEqual( new.shared(), obj.shared() )
+		self.assertAlmostEqual( new( var = { "x": 8., "y": 2. } ), obj( var = { "x": 8., "y": 2. } ) )
+		self.assertIs( new.func_cbs[ 0 ], maexpa.callback_std.functions )
+
+		new = pickle.loads( pickle.dumps( maexpa.Expression( "a*x+b" ).bind( a = 2, b = 3 ) ) )
+		self.assertEqual( new( var = { "x": 5 } ), 13 )
+
+		# Callbacks given at construction are pickled with the expression
+		new = pickle.loads( pickle.dumps( maexpa.Expression( "x+1", var = { "x": 1 } ) ) )
+		self.assertEqual( new(), 2 )
+
+	def test_names( self ):
+		maexpa.lib( "std" )
+
+		obj = maexpa.Expression( "max(a,b)*sin(x)+sin(y)-a*pi" )
+		self.assertEqual( obj.variables(), { "a", "b", "x", "y" } )
+		self.assertEqual( obj.functions(), { ( "max", 2 ), ( "sin", 1 ) } )
+
+		obj = maexpa.Expression( "max(a,b)*sin(x)+sin(y)-a*pi", fold = False )
+		self.assertEqual( obj.variables(), { "a", "b", "x", "y", "pi" } )
+
+		# Functions unknown to the library are included with the number of arguments they are called with
+		obj = maexpa.Expression( "f(x)+f(x,y)+sqrt(2)" )
+		self.assertEqual( obj.functions(), { ( "f", 1 ), ( "f", 2 ) } )
+		self.assertEqual( obj.bind( x = 1., y = 2. ).variables(), set() )
+
+	def test_profile( self ):
+		maexpa.lib( "std" )
+
+		obj = maexpa.Expression( "sqrt(x*x+y)+x/2", var = { "x": 3. } )
+		prof = obj.profile( var = { "y": 7. }, number = 3 )
+		self.assertEqual( prof.value, 5.5 )
+
+		found = { ( entry.column, entry.kind, entry.name ): entry for entry in prof.entries }
+		self.assertEqual( set( found.keys() ), { ( 6, "variable", "x" ), ( 7, "operator", "*" ), ( 10, "variable", "y" ), ( 9, "operator", "+" ), ( 1, "call", "sqrt" ), ( 12, "operator", "+" ), ( 14, "operator", "/" ) } )
+		for entry in prof.entries:
+			self.assertEqual( entry.calls, 3 )
+			self.assertEqual( entry.size, 1 )
+			self.assertGreaterEqual( entry.time, 0. )
+		self.assertEqual( found[ ( 1, "call", "sqrt" ) ].text(), "sqrt(x * x + y)" )
+
+		# Children come before their parents
+		self.assertEqual( prof.entries[ -1 ].name, "+" )
+		self.assertIn( "sqrt", str( prof ) )
+		self.assertEqual( len( prof.report( count = 2 ).splitlines() ), 3 )
+
+	def test_rewrite( self ):
+		import decimal
+		import fractions
+		import random
+
+		maexpa.lib( "std" )
+
+		gen = random.Random( 1 )
+		samples = [ gen.uniform( -100., 100. ) for _ in range( 1000 ) ] + [ gen.uniform( -1e-8, 1e-8 ) for _ in range( 100 ) ] + [ 0., -0., 1e-300, 1e300 ]
+
+		# Exactly the same results, of the same types
+		for text in [ "x**2", "pow(x,2)", "(x+1)**2*x**1", "x/4", "x/0.125", "x/3", "x**3" ]:
+			with self.subTest( "Strict rewrite", expr = text ):
+				ref = maexpa.Expression( text )
+				obj = maexpa.Expression( text, rewrite = "strict" )
+				for value in samples + [ 7, -3 ]:
+					try:
+						expected = ref( var = { "x": value } )
+					except OverflowError:
+						continue
+					res = obj( var = { "x": value } )
+					self.assertEqual( res, expected )
+					self.assertIs( type( res ), type( expected ) )
+
+		self.assertEqual( str( maexpa.Expression( "(x+1)**2/4", rewrite = "strict" ).tree ), "(x + 1) * (x + 1) * 0.25" )
+		self.assertEqual( str( maexpa.Expression( "x**1", rewrite = "fast" ).tree ), "x ** 1" )
+		self.assertEqual( maexpa.Expression( "(x+1)**2", rewrite = "strict" ).shared(), [ "x + 1" ] )
+		# Would not be exact, or would turn integers into floats
+		for text in [ "x**3", "x/3", "x**2.", "x**0.5", "exp(x)-1" ]:
+			self.assertEqual( str( maexpa.Expression( text, rewrite = "strict" ).tree ), str( maexpa.Expression( text ).tree ) )
+
+		# At most a few units in the last place from the correctly rounded result
+		for text, exact, ulps in [ ( "x**3", lambda x: x ** 3, 1 ), ( "x**4", lambda x: x ** 4, 2 ), ( "x/3", lambda x: x / 3, 1 ) ]:
+			with self.subTest( "Fast rewrite", expr = text ):
+				obj = maexpa.Expression( text, rewrite = "fast" )
+				self.assertNotIn( "**", str( obj.tree ) )
+				self.assertNotIn( "/", str( obj.tree ) )
+				for value in samples:
+					if abs( value ) > 1e100:
+						continue
+					expected = float( exact( fractions.Fraction( value ) ) )
+					self.assertLessEqual( abs( obj( var = { "x": value } ) - expected ), ulps * ulp( expected ) )
+
+		self.assertEqual( maexpa.Expression( "x**3", rewrite = "fast" )( var = { "x": 3 } ), 27 )
+		self.assertIs( type( maexpa.Expression( "x**3", rewrite = "fast" )( var = { "x": 3 } ) ), int )
+		# The square root of the standard library raises an error for negative numbers, unlike the power
+		self.assertEqual( str( maexpa.Expression( "x**0.5", rewrite = "fast" ).tree ), "x ** 0.5" )
+
+		# More accurate than the expressions they replace, with enough digits for exp(x)-1 with the smallest samples
+		with decimal.localcontext() as ctx:
+			ctx.prec = 350
+			for text, new, exact in [ ( "exp(x)-1", "expm1(x)", lambda x: x.exp() - 1 ), ( "log(1+x)", "log1p(x)", lambda x: ( 1 + x ).ln() ) ]:
+				with self.subTest( "Fast rewrite", expr = text ):
+					ref = maexpa.Expression( text )
+					obj = maexpa.Expression( text, rewrite = "fast" )
+					self.assertEqual( str( obj.tree ), new )
+					for value in samples:
+						if value <= -1. or abs( value ) > 100.:
+							continue
+						expected = float( exact( decimal.Decimal( value ) ) )
+						self.assertLessEqual( abs( obj( var = { "x": value } ) - expected ), abs( ref( var = { "x": value } ) - expected ) + ulp( expected ) )
+
+		with self.assertRaises( Exception ):
+			maexpa.Expression( "x", rewrite = "unsafe" )
+
+	def test_long( self ):
+		# Long chains of operations must not be limited by the recursion depth
+		import pickle
+
+		maexpa.lib( "std" )
+
+		text = "+".join( "x*{:d}-y/{:d}".format( i, i + 1 ) for i in range( 5000 ) )
+		ref = sum( 1.5 * i - 2.5 / ( i + 1 ) for i in range( 5000 ) )
+
+		obj = maexpa.Expression( text )
+		self.assertAlmostEqual( obj( var = { "x": 1.5, "y": 2.5 } ), ref, delta = 1e-6 )
+		self.assertEqual( str( obj.tree ).count( "+" ), 4999 )
+		self.assertAlmostEqual( obj.bind( x = 1.5 )( var = { "y": 2.5 } ), ref, delta = 1e-6 )
+		self.assertAlmostEqual( obj.lambdify()( 1.5, 2.5 ), ref, delta = 1e-6 )
+		self.assertAlmostEqual( pickle.loads( pickle.dumps( obj ) )( var = { "x": 1.5, "y": 2.5 } ), ref, delta = 1e-6 )
+
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,149 @@
+# Test suite for the runtime metrics of MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import math
+import unittest
+
+import maexpa
+import maexpa.cache
+
+def var_cb( name ):
+	if name == "x":
+		return 2.
+	raise maexpa.exception.NoVarException( name )
+
+def func_cb( name, args ):
+	if name == "twice":
+		return 2 * args[ 0 ]
+	raise maexpa.exception.NoFuncException( name )
+
+class MetricsTestCase( unittest.TestCase ):
+	def setUp( self ):
+		maexpa.lib( "std" )
+		maexpa.metrics.reset()
+		maexpa.metrics.enable()
+
+	def tearDown( self ):
+		maexpa.metrics.disable()
+		maexpa.metrics.reset()
+
+	def test_disabled( self ):
+		maexpa.metrics.disable()
+		self.assertFalse( maexpa.metrics.is_enabled() )
+
+		self.assertEqual( maexpa.Expression( "twice(x)", var = var_cb, func = func_cb )(), 4. )
+		stats = maexpa.metrics.stats()
+		self.assertEqual( stats[ "expressions" ], {} )
+		self.assertEqual( stats[ "variables" ], {} )
+		self.assertEqual( stats[ "functions" ], {} )
+
+	def test_evaluations( self ):
+		obj = maexpa.Expression( "twice(x)+sqrt(y)", var = var_cb, func = func_cb )
+		for _ in range( 3 ):
+			self.assertEqual( obj( var = { "y": 4. } ), 6. )
+
+		stats = maexpa.metrics.stats()
+		self.assertEqual( stats[ "expressions" ][ "twice(x)+sqrt(y)" ][ "evaluations" ], 3 )
+		self.assertEqual( stats[ "expressions" ][ "twice(x)+sqrt(y)" ][ "errors" ], 0 )
+		self.assertGreater( stats[ "expressions" ][ "twice(x)+sqrt(y)" ][ "time" ], 0. )
+
+		# The namespaces are measured as well as the callbacks
+		self.assertEqual( set( stats[ "variables" ].keys() ), { "x", "y" } )
+		self.assertEqual( set( stats[ "functions" ].keys() ), { "twice", "sqrt" } )
+		self.assertEqual( stats[ "functions" ][ "sqrt" ][ "count" ], 3 )
+
+		hist = stats[ "variables" ][ "x" ]
+		self.assertEqual( hist[ "count" ], 3 )
+		self.assertEqual( hist[ "buckets" ][ -1 ], ( float( "inf" ), 3 ) )
+		self.assertEqual( [ count for _, count in hist[ "buckets" ] ], sorted( count for _, count in hist[ "buckets" ] ) )
+
+		maexpa.metrics.reset()
+		self.assertEqual( maexpa.metrics.stats()[ "expressions" ], {} )
+
+	def test_exceptions( self ):
+		obj = maexpa.Expression( "x+z", var = var_cb )
+		for _ in range( 2 ):
+			with self.assertRaises( maexpa.exception.NoVarException ):
+				obj()
+
+		stats = maexpa.metrics.stats()
+		self.assertEqual( stats[ "exceptions" ], { "NoVarException": 2 } )
+		self.assertEqual( stats[ "expressions" ][ "x+z" ][ "evaluations" ], 2 )
+		self.assertEqual( stats[ "expressions" ][ "x+z" ][ "errors" ], 2 )
+		# Lookups that no callback provides are not measured
+		self.assertNotIn( "z", stats[ "variables" ] )
+		self.assertEqual( stats[ "variables" ][ "x" ][ "count" ], 2 )
+
+	def test_providers( self ):
+		def other_cb( name ):
+			raise maexpa.exception.NoVarException( name )
+
+		# Only the callback that provides the variable is measured, not those asked before it
+		self.assertEqual( maexpa.Expression( "x", var = var_cb )( var = other_cb ), 2. )
+		self.assertEqual( maexpa.metrics.stats()[ "variables" ][ "x" ][ "count" ], 1 )
+
+		# Library constants are measured when they are looked up rather than folded
+		self.assertEqual( maexpa.Expression( "pi*x", var = var_cb, fold = False )(), math.pi * 2. )
+		self.assertEqual( maexpa.metrics.stats()[ "variables" ][ "pi" ][ "count" ], 1 )
+
+	def test_set( self ):
+		obj = maexpa.ExpressionSet( { "a": "twice(x)", "b": "x+y" }, var = var_cb, func = func_cb )
+		self.assertEqual( obj( var = { "y": 1. } ), { "a": 4., "b": 3. } )
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			obj()
+
+		# The set is counted as a whole, not each of its expressions
+		stats = maexpa.metrics.stats()
+		self.assertEqual( list( stats[ "expressions" ].keys() ), [ "twice(x); x+y" ] )
+		self.assertEqual( stats[ "expressions" ][ "twice(x); x+y" ][ "evaluations" ], 2 )
+		self.assertEqual( stats[ "expressions" ][ "twice(x); x+y" ][ "errors" ], 1 )
+		self.assertEqual( stats[ "exceptions" ], { "NoVarException": 1 } )
+
+	def test_async( self ):
+		async def async_cb( name ):
+			return var_cb( name )
+
+		loop = asyncio.new_event_loop()
+		try:
+			obj = maexpa.Expression( "twice(x)", var = async_cb, func = func_cb )
+			self.assertEqual( loop.run_until_complete( obj.evaluate_async() ), 4. )
+			self.assertEqual( loop.run_until_complete( obj.evaluate_async() ), 4. )
+		finally:
+			loop.close()
+
+		stats = maexpa.metrics.stats()
+		self.assertEqual( stats[ "expressions" ][ "twice(x)" ][ "evaluations" ], 2 )
+		self.assertEqual( stats[ "functions" ][ "twice" ][ "count" ], 2 )
+
+	def test_parse_errors( self ):
+		for text in [ "x+", "x $ y", "(x" ]:
+			with self.assertRaises( maexpa.exception.CommonException ):
+				maexpa.Expression( text )
+
+		self.assertEqual( sum( maexpa.metrics.stats()[ "exceptions" ].values() ), 3 )
+
+	def test_cache( self ):
+		cache = maexpa.cache.ExpressionCache()
+		cache( "x+1" )
+		cache( "x+1" )
+		cache( "x+1" )
+		cache( "x+2" )
+
+		self.assertEqual( maexpa.metrics.stats()[ "cache" ], { "hits": 2, "misses": 2, "hit_rate": 0.5 } )
+
+if __name__ == '__main__':
+	unittest.main()
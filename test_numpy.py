@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import math
 
 import unittest
@@ -233,3 +234,391 @@ class StdTestCase( unittest.TestCase ):
 			with self.subTest( "Cube root on floats", expr = expr ):
 				res = maexpa.Expression( expr )( var = self.var_cb_float )
 				self.comp_array( res, comp )
+
+	def test_bind( self ):
+		obj = maexpa.Expression( "log(a)*sqrt(b*b+1)+x" )
+		a = numpy.asarray( [ 1., 2., 3. ] )
+		b = numpy.asarray( [ 0., 1., 2. ] )
+		bound = obj.bind( a = a, b = b )
+
+		# All that remains is the addition of the pre-computed array
+		self.assertIsInstance( bound.tree.left, maexpa.nodes.NodeLiteral )
+		self.assertEqual( bound.tree.right.name, "x" )
+		x = numpy.asarray( [ 5., 6., 7. ] )
+		self.comp_array( bound( var = { "x": x } ), numpy.log( a ) * numpy.sqrt( b * b + 1 ) + x )
+		self.comp_array( bound( var = { "x": 1. } ), numpy.log( a ) * numpy.sqrt( b * b + 1 ) + 1. )
+
+		# The bound arrays are not modified
+		self.comp_array( a, numpy.asarray( [ 1., 2., 3. ] ) )
+
+	def test_buffers( self ):
+		arrays = {
+			"a": numpy.asarray( [ 0.2, 0.3, 0.4 ] ),
+			"b": numpy.asarray( [ 5, 1, 2 ] ),
+			"c": numpy.asarray( [ 0.3, 0.6, 0.4 ], dtype = numpy.float32 ),
+			"m": numpy.asarray( [ [ 1. ], [ 2. ] ] ),
+			"s": 1.5,
+		}
+		saved = { name: numpy.copy( value ) for name, value in arrays.items() }
+
+		for expr in [ "a*b+c*a-s", "-(a+a)*2", "sqrt(a*a+b*b)/(a*a+b*b)", "exp(c*2)+c", "b*b//2", "b/2+b", "(a*m+1)**2", "max(a,c)-min(a,b)*s", "s*2+1", "-s" ]:
+			with self.subTest( "Evaluation with re-use of temporaries", expr = expr ):
+				comp = maexpa.Expression( expr )( var = arrays )
+				res = maexpa.Expression( expr, backend = "numpy" )( var = arrays )
+				self.assertIs( type( res ), type( comp ) )
+				if isinstance( comp, numpy.ndarray ):
+					self.assertEqual( res.dtype, comp.dtype )
+					self.assertTrue( numpy.array_equal( res, comp ) )
+				else:
+					self.assertEqual( res, comp )
+				for name, value in arrays.items():
+					self.assertTrue( numpy.array_equal( value, saved[ name ] ) )
+
+	def test_out( self ):
+		a = numpy.asarray( [ 0.2, 0.3, 0.4 ] )
+		for backend in [ None, "numpy" ]:
+			with self.subTest( "Output array", backend = backend ):
+				out = numpy.empty( 3 )
+				obj = maexpa.Expression( "a*2+1", backend = backend )
+				self.assertIs( obj( var = { "a": a }, out = out ), out )
+				self.comp_array( out, a * 2 + 1 )
+				self.assertIs( obj( var = { "a": 1. }, out = out ), out )
+				self.comp_array( out, numpy.full( 3, 3. ) )
+
+	def test_buffers_memory( self ):
+		import tracemalloc
+
+		size = 10**6
+		arrays = { name: numpy.random.random( size ) for name in "abcde" }
+		out = numpy.empty( size )
+
+		def peak( func ):
+			# Restarted for each measurement rather than with tracemalloc.reset_peak(), which requires Python 3.9
+			tracemalloc.start()
+			try:
+				func()
+				return tracemalloc.get_traced_memory()[ 1 ]
+			finally:
+				tracemalloc.stop()
+
+		peak_std = peak( lambda: maexpa.Expression( "sqrt(a*a+b*b)*exp(-c)/(d+e)" )( var = arrays ) )
+		peak_buf = peak( lambda: maexpa.Expression( "sqrt(a*a+b*b)*exp(-c)/(d+e)", backend = "numpy" )( var = arrays, out = out ) )
+
+		# Only two temporaries are needed at once: a*a and b*b, then their sum and -c, and so on
+		self.assertGreater( peak_std, 2.5 * size * 8 )
+		self.assertLess( peak_buf, 2.5 * size * 8 )
+
+	def test_blocked( self ):
+		import maexpa.blocked
+
+		arrays = {
+			"a": numpy.random.random( 10000 ),
+			"b": numpy.random.random( 10000 ),
+			"m": numpy.random.random( ( 300, 1 ) ),
+			"n": numpy.random.random( 50 ),
+			"i": numpy.arange( 10000 ),
+			"s": 2.,
+		}
+
+		for expr in [ "sqrt(a*a+b*b)/(a*a+b*b)*s", "exp(-a)*(1-exp(-a))+i", "m*n+s", "i//3", "s*3" ]:
+			for chunk_size in [ None, 1, 1000, 4096, 100000 ]:
+				with self.subTest( "Chunked evaluation", expr = expr, chunk_size = chunk_size ):
+					obj = maexpa.Expression( expr )
+					comp = obj( var = arrays )
+					res = obj.blocked( var = arrays, chunk_size = chunk_size )
+					self.assertEqual( numpy.shape( res ), numpy.shape( comp ) )
+					self.assertEqual( numpy.result_type( res ), numpy.result_type( comp ) )
+					self.assertTrue( numpy.array_equal( res, comp ) )
+
+		out = numpy.empty( 10000 )
+		self.assertIs( maexpa.Expression( "a+b" ).blocked( var = arrays, out = out, chunk_size = 999 ), out )
+		self.assertTrue( numpy.array_equal( out, arrays[ "a" ] + arrays[ "b" ] ) )
+
+		bound = maexpa.Expression( "a*x+b" ).bind( a = arrays[ "a" ], b = arrays[ "b" ] )
+		self.assertTrue( numpy.array_equal( bound.blocked( var = { "x": 3. }, chunk_size = 1000 ), arrays[ "a" ] * 3. + arrays[ "b" ] ) )
+
+		# Chunks are cut along the flattened index, not only along the first axis
+		self.assertEqual( len( maexpa.blocked.slices( ( 1, 10**7 ), 65536 ) ), 153 )
+		self.assertEqual( maexpa.blocked.slices( ( 2, 3, 4 ), 5 )[ :2 ], [ ( 0, slice( 0, 1 ) ), ( 0, slice( 1, 2 ) ) ] )
+		row = numpy.random.random( ( 1, 5000 ) )
+		col = numpy.random.random( ( 3, 1, 1 ) )
+		for chunk_size in [ 1, 1000, 4999, 100000 ]:
+			with self.subTest( "Chunked evaluation of several axes", chunk_size = chunk_size ):
+				self.assertTrue( numpy.array_equal( maexpa.Expression( "r*2+c" ).blocked( var = { "r": row, "c": col }, chunk_size = chunk_size ), row * 2 + col ) )
+
+	def test_parallel( self ):
+		import maexpa.parallel
+
+		arrays = {
+			"a": numpy.random.random( 10000 ),
+			"b": numpy.random.random( 10000 ),
+			"m": numpy.random.random( ( 300, 1 ) ),
+			"n": numpy.random.random( 50 ),
+			"i": numpy.arange( 10000 ),
+			"s": 2.,
+		}
+
+		with maexpa.parallel.ProcessPool( 2 ) as pool:
+			# The processes are not forked from this one, which may have threads
+			self.assertIn( pool.context, [ "forkserver", "spawn" ] )
+
+			for expr in [ "sqrt(a*a+b*b)/(a*a+b*b)*s", "exp(-a)*(1-exp(-a))+i", "m*n+s", "i//3", "s*3" ]:
+				with self.subTest( "Parallel evaluation", expr = expr ):
+					obj = maexpa.Expression( expr )
+					comp = obj( var = arrays )
+					res = obj.parallel( var = arrays, pool = pool )
+					self.assertEqual( numpy.shape( res ), numpy.shape( comp ) )
+					self.assertEqual( numpy.result_type( res ), numpy.result_type( comp ) )
+					self.assertTrue( numpy.array_equal( res, comp ) )
+
+			out = numpy.empty( 10000 )
+			self.assertIs( maexpa.Expression( "a+b" ).parallel( var = arrays, out = out, pool = pool ), out )
+			self.assertTrue( numpy.array_equal( out, arrays[ "a" ] + arrays[ "b" ] ) )
+
+			# The same processes are used for the next evaluation
+			executor = pool.executor()
+			bound = maexpa.Expression( "a*x+b" ).bind( a = arrays[ "a" ], b = arrays[ "b" ] )
+			self.assertTrue( numpy.array_equal( bound.parallel( var = { "x": 3. }, pool = pool ), arrays[ "a" ] * 3. + arrays[ "b" ] ) )
+			self.assertIs( pool.executor(), executor )
+
+			with self.assertRaises( maexpa.exception.NoVarException ):
+				maexpa.Expression( "a+z" ).parallel( var = arrays, pool = pool )
+
+			# Split along the flattened index, not only along the first axis
+			row = numpy.random.random( ( 1, 10000 ) )
+			self.assertTrue( numpy.array_equal( maexpa.Expression( "r*2+s" ).parallel( var = { "r": row, "s": 1. }, pool = pool ), row * 2 + 1. ) )
+
+			# Arrays in shared memory are used in place, including views of them
+			shared = pool.empty( ( 2, 10000 ) )
+			shared[ ... ] = numpy.random.random( ( 2, 10000 ) )
+			out = pool.empty( 5000 )
+			self.assertIs( maexpa.Expression( "a*b+1" ).parallel( var = { "a": shared[ 0, ::2 ], "b": shared[ 1, ::-2 ] }, out = out, pool = pool ), out )
+			self.assertTrue( numpy.array_equal( out, shared[ 0, ::2 ] * shared[ 1, ::-2 ] + 1 ) )
+			shared = None
+			out = None
+
+	def test_threads( self ):
+		import concurrent.futures
+
+		arrays = {
+			"a": numpy.random.random( 100000 ),
+			"b": numpy.random.random( 100000 ),
+			"m": numpy.random.random( ( 3000, 1 ) ),
+			"n": numpy.random.random( 50 ),
+		}
+
+		for expr in [ "sqrt(a*a+b*b)/(a*a+b*b)", "exp(-a)*(1-exp(-b))", "m*n+1" ]:
+			obj = maexpa.Expression( expr )
+			comp = obj( var = arrays )
+
+			with self.subTest( "Threads", expr = expr ):
+				self.assertTrue( numpy.array_equal( obj.blocked( var = arrays, chunk_size = 1000, threads = 4 ), comp ) )
+
+			with self.subTest( "Executor", expr = expr ):
+				with concurrent.futures.ThreadPoolExecutor( max_workers = 3 ) as executor:
+					self.assertTrue( numpy.array_equal( obj.blocked( var = arrays, chunk_size = 1000, executor = executor ), comp ) )
+
+		with self.assertRaises( maexpa.exception.NoFuncException ):
+			maexpa.Expression( "a+foo(b)" ).blocked( var = arrays, chunk_size = 1000, threads = 2 )
+
+	def test_vm( self ):
+		arrays = {
+			"a": numpy.random.random( 100000 ),
+			"b": numpy.random.random( 100000 ),
+			"m": numpy.random.random( ( 3000, 1 ) ),
+			"n": numpy.random.random( 50 ),
+			"i": numpy.arange( 100000 ),
+			"f": numpy.random.random( 100000 ).astype( numpy.float32 ),
+			"s": 2.,
+			"k": 3,
+		}
+
+		for expr in [ "sqrt(a*a+b*b)/(a*a+b*b)*s", "exp(-a)*(1-exp(-a))+i", "m*n+s", "i//3+k", "i*k", "f*2+f", "-a**k+max(a,b)", "log(s*k)*a" ]:
+			with self.subTest( "Virtual machine", expr = expr ):
+				obj = maexpa.Expression( expr, backend = "vm" )
+				self.assertIsNotNone( obj.program )
+				comp = maexpa.Expression( expr )( var = arrays )
+				res = obj( var = arrays )
+				self.assertEqual( numpy.shape( res ), numpy.shape( comp ) )
+				self.assertEqual( numpy.result_type( res ), numpy.result_type( comp ) )
+				self.assertTrue( numpy.allclose( res, comp ) )
+
+		out = numpy.empty( 100000 )
+		self.assertIs( maexpa.Expression( "a+b", backend = "vm" )( var = arrays, out = out ), out )
+		self.assertTrue( numpy.array_equal( out, arrays[ "a" ] + arrays[ "b" ] ) )
+
+		bound = maexpa.Expression( "a*x+b", backend = "vm" ).bind( a = arrays[ "a" ], b = arrays[ "b" ] )
+		self.assertIsNotNone( bound.program )
+		self.assertTrue( numpy.allclose( bound( var = { "x": 3. } ), arrays[ "a" ] * 3. + arrays[ "b" ] ) )
+
+		# Scalars only
+		self.assertEqual( maexpa.Expression( "s*k+1", backend = "vm" )( var = arrays ), 7. )
+
+		# Functions that are not ufuncs are evaluated by the buffers backend
+		funcs = { "twice": lambda x: 2 * x }
+		obj = maexpa.Expression( "twice(a)+b", func = funcs, backend = "vm" )
+		self.assertIsNone( obj.program )
+		self.assertTrue( numpy.allclose( obj( var = arrays ), 2 * arrays[ "a" ] + arrays[ "b" ] ) )
+
+		obj = maexpa.Expression( "exp(a)+b", backend = "vm" )
+		self.assertTrue( numpy.allclose( obj( var = arrays, func = lambda name, args: 1. ), 1. + arrays[ "b" ] ) )
+
+	def test_metrics( self ):
+		arrays = { "a": numpy.random.random( 100000 ), "b": numpy.random.random( 100000 ) }
+
+		# The functions of the library are measured whatever the backend
+		for backend in [ None, "numpy", "vm" ]:
+			with self.subTest( "Metrics", backend = backend ):
+				maexpa.metrics.reset()
+				maexpa.metrics.enable()
+				try:
+					maexpa.Expression( "sqrt(a)*exp(-b)", backend = backend )( var = arrays )
+				finally:
+					maexpa.metrics.disable()
+				stats = maexpa.metrics.stats()
+				self.assertEqual( set( stats[ "functions" ].keys() ), { "sqrt", "exp" } )
+				self.assertEqual( set( stats[ "variables" ].keys() ), { "a", "b" } )
+
+		# Chunked evaluations are counted once each, not once per chunk
+		for threads in [ None, 2 ]:
+			with self.subTest( "Metrics blocked", threads = threads ):
+				maexpa.metrics.reset()
+				maexpa.metrics.enable()
+				try:
+					obj = maexpa.Expression( "sqrt(a)*exp(-b)" )
+					obj.blocked( var = arrays, chunk_size = 1000, threads = threads )
+					obj.blocked( var = arrays, chunk_size = 1000, threads = threads )
+					with self.assertRaises( maexpa.exception.NoVarException ):
+						obj.blocked( var = { "a": arrays[ "a" ] }, threads = threads )
+				finally:
+					maexpa.metrics.disable()
+				stats = maexpa.metrics.stats()
+				self.assertEqual( stats[ "expressions" ][ "sqrt(a)*exp(-b)" ][ "evaluations" ], 3 )
+				self.assertEqual( stats[ "expressions" ][ "sqrt(a)*exp(-b)" ][ "errors" ], 1 )
+				self.assertEqual( stats[ "exceptions" ], { "NoVarException": 1 } )
+
+		maexpa.metrics.reset()
+
+	def test_vm_memory( self ):
+		import tracemalloc
+
+		size = 10**6
+		arrays = { name: numpy.random.random( size ) for name in "abcde" }
+		obj = maexpa.Expression( "(a+1)*(b+2)*(c+3)*(d+4)*(e+5)-a*b/(c+1)", backend = "vm" )
+
+		tracemalloc.start()
+		try:
+			obj( var = arrays )
+			_, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+
+		# The result and a few blocks
+		self.assertLess( peak, 1.2 * size * 8 )
+
+	def test_pickle( self ):
+		import pickle
+
+		arrays = { "a": numpy.random.random( 1000 ), "b": numpy.random.random( 1000 ) }
+
+		for backend in [ None, "numpy", "vm" ]:
+			with self.subTest( "Pickled expression", backend = backend ):
+				obj = maexpa.Expression( "exp(-a)*b+sqrt(a)", backend = backend ).bind( b = arrays[ "b" ] )
+				new = pickle.loads( pickle.dumps( obj ) )
+				self.assertEqual( new.backend, backend )
+				self.assertEqual( new.program is None, obj.program is None )
+				self.assertTrue( numpy.array_equal( new( var = arrays ), obj( var = arrays ) ) )
+
+	def test_dtype( self ):
+		import pickle
+
+		arrays = { "a": numpy.random.random( 1000 ).astype( numpy.float32 ), "b": numpy.random.random( 1000 ), "n": numpy.arange( 1000 ) }
+		text = "exp(-a)*b*sqrt(2)+pi*a**2/(n+1)+0.5"
+		ref = numpy.exp( -arrays[ "a" ] ) * arrays[ "b" ] * math.sqrt( 2 ) + math.pi * arrays[ "a" ] ** 2 / ( arrays[ "n" ] + 1 ) + 0.5
+
+		for backend in [ None, "numpy", "vm" ]:
+			with self.subTest( "Type policy", backend = backend ):
+				# Without policy, the float64 input and constants make the result float64
+				self.assertEqual( maexpa.Expression( text, backend = backend )( var = arrays ).dtype, numpy.float64 )
+
+				obj = maexpa.Expression( text, backend = backend, dtype = "float32" )
+				res = obj( var = arrays )
+				self.assertEqual( res.dtype, numpy.float32 )
+				self.assertTrue( numpy.allclose( res, ref, rtol = 1e-5 ) )
+
+				self.assertEqual( obj.blocked( var = arrays ).dtype, numpy.float32 )
+				self.assertEqual( obj.bind( b = 2. )( var = arrays ).dtype, numpy.float32 )
+				self.assertEqual( pickle.loads( pickle.dumps( obj ) )( var = arrays ).dtype, numpy.float32 )
+
+		# Library constants that are not folded are converted as variables
+		res = maexpa.Expression( "pi*a", fold = False, dtype = numpy.float32 )( var = arrays )
+		self.assertEqual( res.dtype, numpy.float32 )
+
+		# Also when profiling, and when awaiting functions
+		self.assertEqual( maexpa.Expression( text, dtype = "float32" ).profile( var = arrays ).value.dtype, numpy.float32 )
+
+		async def func_cb( name, args ):
+			if name == "twice":
+				return 2 * args[ 0 ]
+			raise maexpa.exception.NoFuncException( name )
+
+		loop = asyncio.new_event_loop()
+		try:
+			res = loop.run_until_complete( maexpa.Expression( "twice(a)*b+pi", dtype = "float32" ).evaluate_async( var = arrays, func = func_cb ) )
+		finally:
+			loop.close()
+		self.assertEqual( res.dtype, numpy.float32 )
+
+		self.assertEqual( type( maexpa.Expression( "1.5*2", dtype = "float32" )() ), numpy.float32 )
+
+		with self.assertRaises( Exception ):
+			maexpa.Expression( "a", dtype = "int32" )
+
+	def test_rewrite( self ):
+		rng = numpy.random.default_rng( 1 )
+		x = numpy.concatenate( [ rng.standard_normal( 10000 ) * 100., rng.standard_normal( 1000 ) * 1e-8, [ 0., -0., numpy.inf, -numpy.inf, numpy.nan ] ] )
+
+		with numpy.errstate( all = "ignore" ):
+			for backend in [ None, "numpy", "vm" ]:
+				for text in [ "x**2", "pow(x,2)", "(x+1)**2/4", "x/3", "x**3", "x**0.5" ]:
+					with self.subTest( "Strict rewrite", backend = backend, expr = text ):
+						ref = maexpa.Expression( text, backend = backend )( var = { "x": x } )
+						res = maexpa.Expression( text, backend = backend, rewrite = "strict" )( var = { "x": x } )
+						self.assertEqual( res.dtype, ref.dtype )
+						self.assertTrue( numpy.array_equal( res, ref, equal_nan = True ) )
+
+				for text, ulps in [ ( "x**3", 1 ), ( "x**4", 2 ), ( "x/3", 1 ), ( "x**0.5", 0 ), ( "pow(x,0.5)", 0 ) ]:
+					with self.subTest( "Fast rewrite", backend = backend, expr = text ):
+						obj = maexpa.Expression( text, backend = backend, rewrite = "fast" )
+						self.assertNotIn( "**", str( obj.tree ) )
+						self.assertNotIn( "pow", str( obj.tree ) )
+						ref = maexpa.Expression( text, backend = backend )( var = { "x": x } )
+						res = obj( var = { "x": x } )
+						self.assertEqual( res.dtype, ref.dtype )
+						finite = numpy.isfinite( ref )
+						self.assertTrue( numpy.array_equal( numpy.isnan( res ), numpy.isnan( ref ) ) )
+						self.assertTrue( numpy.all( numpy.abs( res[ finite ] - ref[ finite ] ) <= ulps * numpy.spacing( numpy.abs( ref[ finite ] ) ) ) )
+
+			# NumPy's pow turns Python integers into 64-bit ones, which x*x would not
+			obj = maexpa.Expression( "pow(x,2)", rewrite = "strict" )
+			self.assertEqual( str( obj.tree ), "pow(x, 2)" )
+			for value in [ 3, -7, 2**40 ]:
+				ref = maexpa.Expression( "pow(x,2)" )( var = { "x": value } )
+				res = obj( var = { "x": value } )
+				self.assertIs( type( res ), type( ref ) )
+				self.assertEqual( res, ref )
+
+			# Integer arrays stay integers
+			n = numpy.arange( -50, 50 )
+			res = maexpa.Expression( "n**3", rewrite = "fast" )( var = { "n": n } )
+			self.assertEqual( res.dtype, n.dtype )
+			self.assertTrue( numpy.array_equal( res, n ** 3 ) )
+
+			# The result is a new array, not the input itself
+			for mode in maexpa.rewrite.modes:
+				self.assertIsNot( maexpa.Expression( "x**1", rewrite = mode )( var = { "x": x } ), x )
+
+			# Accurate where the subtraction of 1 cancels
+			small = rng.standard_normal( 1000 ) * 1e-10
+			self.assertTrue( numpy.array_equal( maexpa.Expression( "exp(x)-1", backend = "vm", rewrite = "fast" )( var = { "x": small } ), numpy.expm1( small ) ) )
+			self.assertTrue( numpy.array_equal( maexpa.Expression( "log(x+1)", rewrite = "fast" )( var = { "x": small } ), numpy.log1p( small ) ) )
@@ -0,0 +1,69 @@
+# Test suite for the ExpressionSet class in MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import unittest
+
+import maexpa
+
+class SetTestCase( unittest.TestCase ):
+	def setUp( self ):
+		maexpa.lib( "std" )
+		self.calls = []
+
+	def var_cb( self, name ):
+		self.calls.append( name )
+		if name == "x":
+			return 2.
+		if name == "total":
+			return 8.
+		if name == "mass":
+			return 100.
+		raise maexpa.exception.NoVarException( name )
+
+	def test_names( self ):
+		exprs = maexpa.ExpressionSet( { "frac": "x/total", "pct": "x/total*100", "lm": "log10(mass)" } )
+		self.assertEqual( len( exprs ), 3 )
+		res = exprs( var = self.var_cb )
+		self.assertEqual( list( res.keys() ), [ "frac", "pct", "lm" ] )
+		self.assertAlmostEqual( res[ "frac" ], 0.25 )
+		self.assertAlmostEqual( res[ "pct" ], 25. )
+		self.assertAlmostEqual( res[ "lm" ], 2. )
+
+	def test_list( self ):
+		exprs = maexpa.ExpressionSet( [ "x/total", "log10(mass)*x/total", "sqrt(x)" ], var = self.var_cb )
+		res = exprs()
+		self.assertEqual( res, { "x/total": 0.25, "log10(mass)*x/total": 0.5, "sqrt(x)": math.sqrt( 2. ) } )
+
+	def test_shared( self ):
+		exprs = maexpa.ExpressionSet( [ "x/total", "x/total*100", "log10(mass)+x", "1-log10(mass)" ] )
+		self.assertEqual( exprs.shared(), [ "x / total", "x", "log10(mass)" ] )
+		exprs( var = self.var_cb )
+		self.assertEqual( sorted( self.calls ), [ "mass", "total", "x" ] )
+
+	def test_introspection( self ):
+		exprs = maexpa.ExpressionSet( [ "x/total", "log10(mass)*x", "pow(x,2)" ] )
+		self.assertEqual( exprs.variables(), { "x", "total", "mass" } )
+		self.assertEqual( exprs.functions(), { ( "log10", 1 ), ( "pow", 2 ) } )
+
+	def test_errors( self ):
+		exprs = maexpa.ExpressionSet( [ "x", "y" ] )
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			exprs( var = self.var_cb )
+
+if __name__ == '__main__':
+	unittest.main()
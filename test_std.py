@@ -104,6 +104,8 @@ class StdTestCase( unittest.TestCase ):
 			( "log(e)", 1. ),
 			( "log2(2)", 1. ),
 			( "log10(10)", 1. ),
+			( "expm1(1e-10)", 1.00000000005e-10 ),
+			( "log1p(e-1)", 1. ),
 		]
 
 		for expr, comp in tests:
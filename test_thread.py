@@ -0,0 +1,96 @@
+# Test suite for concurrent use of expressions in MaExPa.
+#
+# Copyright 2020 Alexandre Emsenhuber
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import concurrent.futures
+import math
+import sys
+import threading
+import time
+
+import unittest
+
+import maexpa
+
+class ThreadTestCase( unittest.TestCase ):
+	def setUp( self ):
+		maexpa.lib( "std" )
+		self.interval = sys.getswitchinterval()
+		# Switch threads as often as possible to expose races
+		sys.setswitchinterval( 1e-6 )
+
+	def tearDown( self ):
+		sys.setswitchinterval( self.interval )
+
+	def test_shared_instance( self ):
+		obj = maexpa.Expression( "sqrt(x*x+y*y)+slow(x)-slow(y)" )
+
+		def run( idx ):
+			def var_cb( name ):
+				if name == "x":
+					return float( idx )
+				if name == "y":
+					return float( idx + 1 )
+				raise maexpa.exception.NoVarException( name )
+
+			def func_cb( name, args ):
+				if name == "slow":
+					time.sleep( 0 )
+					return args[ 0 ] * idx
+				raise maexpa.exception.NoFuncException( name )
+
+			results = []
+			for _ in range( 50 ):
+				results.append( obj( var = var_cb, func = func_cb ) )
+			return results
+
+		with concurrent.futures.ThreadPoolExecutor( max_workers = 16 ) as executor:
+			futures = { idx: executor.submit( run, idx ) for idx in range( 200 ) }
+
+		for idx, future in futures.items():
+			comp = ( idx**2 + ( idx + 1 )**2 )**0.5 - idx
+			for res in future.result():
+				self.assertAlmostEqual( res, comp )
+
+		# The callbacks of the calls must not leak into the instance
+		with self.assertRaises( maexpa.exception.NoVarException ):
+			obj()
+
+	def test_prefetch( self ):
+		obj = maexpa.Expression( "a*b+c-a*pi" )
+
+		barrier = threading.Barrier( 3, timeout = 5 )
+		def var_cb( name ):
+			# Only returns once all the variables are being retrieved at the same time
+			barrier.wait()
+			if not name in { "a", "b", "c" }:
+				raise maexpa.exception.NoVarException( name )
+			return { "a": 1., "b": 2., "c": 3. }[ name ]
+
+		with concurrent.futures.ThreadPoolExecutor( max_workers = 4 ) as executor:
+			self.assertAlmostEqual( obj( var = var_cb, prefetch = executor ), 5. - math.pi )
+
+		def missing_cb( name ):
+			if name in ( "b", "c" ):
+				raise maexpa.exception.NoVarException( name )
+			return 1.
+
+		with concurrent.futures.ThreadPoolExecutor( max_workers = 4 ) as executor:
+			with self.assertRaises( maexpa.exception.NoVarException ) as cm:
+				obj( var = missing_cb, prefetch = executor )
+		self.assertEqual( cm.exception.desc, "b" )
+
+if __name__ == '__main__':
+	unittest.main()